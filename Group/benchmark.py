@@ -0,0 +1,223 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import instrument
+
+# Headers in the survey export format `preprocess.detect_columns` recognises (q4..q15).
+SURVEY_HEADER = [
+    '序号', '提交答卷时间', '1.学号', '2.邮箱',
+    '4.你能否参加本次活动？', '5.你是否接受和陌生朋友组队？', '6.你的首要目标是？',
+    '7.你最感兴趣的赛道是？', '8.你更倾向掌控哪个部分？', '9.你熟悉的技能有？',
+    '10.其他补充（选填）', '11.你的开发熟练度', '12.团队出现分歧时你会？',
+    '13.项目进展不顺时你的反应是？', '14.周六demo前夜你会？', '15.你更想做什么样的作品？',
+]
+SINGLE_CHOICES = {
+    'q4': ['确定参加', '大概率参加', '不确定'],
+    'q5': ['完全接受匹配', '部分接受', '已有队伍'],
+    'q6': ['获奖', '学习', '交朋友', '做出作品'],
+    'q8': ['前端', '后端', '算法', '产品', '设计'],
+    'q11': ['入门', '熟练', '精通'],
+    'q12': ['主导决策', '合作讨论', '听从安排', '作为协调者'],
+    'q13': ['反思原因', '情绪化', '继续推进'],
+    'q14': ['战略调整', '熬夜死磕', '早点休息'],
+    'q15': ['实用工具', '创意作品', '研究原型'],
+}
+TRACKS = ['AI', '游戏', '教育', '医疗', '金融', '环境', '社交', '硬件']
+SKILLS = ['Python', 'C++', 'Java', '前端开发', '设计', '写作', '演讲', '数据分析', '视频剪辑']
+EXTRA_SKILLS = ['', '无', 'Python 项目经验', 'LaTeX', 'C++ 比赛 SQL', '论文 实习 Java MATLAB', 'Stata', 'Pytorch 比赛']
+SEPARATORS = [';', '，', '|']
+
+# above this many respondents the dense n x n matrix is impractical; 'auto' switches to top-K
+DENSE_LIMIT = 5000
+
+
+def generate_survey(n: int, path: Path, seed: int = 0):
+    """
+    Write a synthetic survey export with `n` respondents.
+
+    Answers are drawn with skewed (not uniform) frequencies, a few blanks
+    and mixed multi-select separators, so preprocessing and scoring see
+    realistic category counts and text.
+    """
+    rng = random.Random(seed)
+
+    def pick(options):
+        # earlier options are more popular, like real survey answers
+        return rng.choices(options, weights=range(len(options) + 1, 1, -1))[0]
+
+    def multi(options, most):
+        return rng.choice(SEPARATORS).join(rng.sample(options, rng.randint(0, most)))
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(SURVEY_HEADER)
+        for i in range(1, n + 1):
+            w.writerow([
+                i, f'2025-03-{1 + i % 28:02d} {8 + i % 12:02d}:{i % 60:02d}', f'25300{i:06d}',
+                f'stu{i}@fudan.edu.cn' if rng.random() < 0.9 else f'stu{i}@m.fudan.edu.cn',
+                pick(SINGLE_CHOICES['q4']) if rng.random() < 0.97 else '',
+                pick(SINGLE_CHOICES['q5']), pick(SINGLE_CHOICES['q6']), multi(TRACKS, 3),
+                pick(SINGLE_CHOICES['q8']), multi(SKILLS, 4), rng.choice(EXTRA_SKILLS),
+                pick(SINGLE_CHOICES['q11']), pick(SINGLE_CHOICES['q12']), pick(SINGLE_CHOICES['q13']),
+                pick(SINGLE_CHOICES['q14']), pick(SINGLE_CHOICES['q15']),
+            ])
+
+
+def _stage_preprocess(workdir: str, chunksize: int = 0):
+    import preprocess
+    src, out = Path(workdir, 'survey.csv'), Path(workdir, 'trait.csv')
+    start = time.perf_counter()
+    if chunksize:
+        preprocess.load_and_clean_chunked(src, out, chunksize=chunksize)
+    else:
+        traits, _ = preprocess.load_and_clean(src)
+        preprocess.export_traits(traits, out)
+    return {'seconds': time.perf_counter() - start}
+
+
+def _stage_matrix(workdir: str, mode: str = 'dense', topk: int = 32, workers: int = 1):
+    import make_matrix
+    trait_path = make_matrix.trait_source(Path(workdir, 'trait.csv'))
+    start = time.perf_counter()
+    df = make_matrix.load_traits(trait_path)
+    loaded = time.perf_counter()
+    if mode == 'topk':
+        out = Path(workdir, 'matrix_topk.npz')
+        make_matrix.write_topk(*make_matrix.build_topk(df, k=topk), out)
+    else:
+        out = Path(workdir, 'matrix_condensed.npy' if mode == 'condensed' else 'matrix.npy')
+        make_matrix.build_matrix_parallel(df, workers=workers, condensed=mode == 'condensed', out_path=out)
+    return {'seconds': time.perf_counter() - start, 'load_seconds': loaded - start,
+            'matrix': out.name, 'matrix_mb': out.stat().st_size / (1 << 20)}
+
+
+def _stage_groups(workdir: str, matrix: str, algorithm: str = 'force_exact', seed: int = 0):
+    import divide_groups
+    start = time.perf_counter()
+    ids, mat = divide_groups.load_matrix(Path(workdir, matrix))
+    groups = divide_groups.ALGORITHMS[algorithm](ids, mat, group_size=4, seed=seed)
+    result = {'seconds': time.perf_counter() - start, 'groups': len(groups)}
+    if not isinstance(mat, divide_groups.TopKIndex):
+        result['objective'] = divide_groups.grouping_objective(ids, mat, groups)
+    return result
+
+
+def _run_stage(fn, *args, **kwargs):
+    """Run one stage in a fresh process so its peak memory is measured on its own."""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(_measured, fn, *args, **kwargs).result()
+
+
+def _measured(fn, *args, **kwargs):
+    result = fn(*args, **kwargs)
+    result['peak_rss_mb'] = instrument.peak_rss_mb()
+    return result
+
+
+def run_benchmark(sizes, seed: int = 0, matrix: str = 'auto', algorithm: str = 'force_exact',
+                  topk: int = 32, workers: int = 1, chunksize: int = 0, repeat: int = 1):
+    """
+    Generate a survey per size and time preprocess -> make_matrix -> divide_groups.
+
+    Each stage runs in its own process; the best of `repeat` runs is kept.
+    Returns a list of {'n', 'stage', 'seconds', 'peak_rss_mb', ...} records.
+    """
+    records = []
+    for n in sizes:
+        mode = matrix if matrix != 'auto' else ('dense' if n <= DENSE_LIMIT else 'topk')
+        with tempfile.TemporaryDirectory(prefix='group_bench_') as workdir:
+            start = time.perf_counter()
+            generate_survey(n, Path(workdir, 'survey.csv'), seed=seed)
+            records.append({'n': n, 'stage': 'generate', 'seconds': time.perf_counter() - start})
+            stages = (
+                ('preprocess', _stage_preprocess, (workdir,), {'chunksize': chunksize}),
+                ('make_matrix', _stage_matrix, (workdir,), {'mode': mode, 'topk': topk, 'workers': workers}),
+                ('divide_groups', _stage_groups, (workdir,), {'algorithm': algorithm, 'seed': seed}),
+            )
+            for name, fn, args, kwargs in stages:
+                if name == 'divide_groups':
+                    args = args + (records[-1]['matrix'],)
+                runs = [_run_stage(fn, *args, **kwargs) for _ in range(max(1, repeat))]
+                best = min(runs, key=lambda r: r['seconds'])
+                records.append({'n': n, 'stage': name, **best})
+                print(f"n={n:>6} {name:<14} {best['seconds']:8.3f}s  peak {best['peak_rss_mb'] or 0:8.1f} MiB")
+    return records
+
+
+def _revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=Path(__file__).resolve().parent, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """Where the numbers came from: revision, interpreter, library versions and CPU count."""
+    return {
+        'revision': _revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(old: dict, new: dict):
+    """Print per (n, stage) time and memory ratios new/old for the records both runs share."""
+    before = {(r['n'], r['stage']): r for r in old['results']}
+    print(f"comparing {new['environment']['revision']} against {old['environment']['revision']}")
+    for r in new['results']:
+        o = before.get((r['n'], r['stage']))
+        if o is None or not o['seconds']:
+            continue
+        line = f"n={r['n']:>6} {r['stage']:<14} time x{r['seconds'] / o['seconds']:.2f}"
+        if r.get('peak_rss_mb') and o.get('peak_rss_mb'):
+            line += f"  memory x{r['peak_rss_mb'] / o['peak_rss_mb']:.2f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time preprocess -> make_matrix -> divide_groups on synthetic surveys')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000],
+                        help='respondent counts to generate (e.g. 100 1000 10000 50000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--matrix', choices=('auto', 'dense', 'condensed', 'topk'), default='auto',
+                        help=f'matrix format; auto = dense up to {DENSE_LIMIT} people, top-K above')
+    parser.add_argument('--topk', type=int, default=32)
+    parser.add_argument('--algorithm', default='force_exact', help='divide_groups.ALGORITHMS entry')
+    parser.add_argument('--workers', type=int, default=1, help='make_matrix worker processes (0 = one per CPU)')
+    parser.add_argument('--chunksize', type=int, default=0, help='use the chunked preprocess path')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage; the fastest is kept')
+    parser.add_argument('--out', default='benchmark.json', help='JSON results file')
+    parser.add_argument('--compare', metavar='OLD_JSON', help='print ratios against an earlier results file')
+    parser.add_argument('--generate', metavar='CSV', help='only write a synthetic survey of --sizes[0] people')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_survey(args.sizes[0], Path(args.generate), seed=args.seed)
+        print(f'Wrote {args.sizes[0]} synthetic responses to {args.generate}')
+        raise SystemExit(0)
+    results = run_benchmark(args.sizes, seed=args.seed, matrix=args.matrix, algorithm=args.algorithm,
+                            topk=args.topk, workers=args.workers or None, chunksize=args.chunksize,
+                            repeat=args.repeat)
+    report = {'environment': environment(), 'config': vars(args), 'results': results}
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f'Wrote {args.out}')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
@@ -0,0 +1,135 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+# Content-addressed artifact cache: each entry is a directory named by the
+# sha256 of everything that determines it (input file hashes, weights, the
+# source of the code that produced it). Entries are written to a temporary
+# directory and renamed into place, so a reader never sees a partial one.
+# A `.used` marker's mtime records the last access; once the cache is over
+# its size limit the least recently used entries are deleted.
+
+USED_MARKER = '.used'
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+def file_sha256(path: Path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version(*modules):
+    """Hash of the source files of `modules`, so editing the code invalidates what it produced."""
+    h = hashlib.sha256()
+    for m in modules:
+        with open(m.__file__, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def cache_key(*parts):
+    """Stable key from JSON-serializable parts (dict keys are sorted)."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def _dir_size(path: Path):
+    return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+
+
+class ArtifactCache:
+    """
+    Directory of cached artifacts bounded to `max_bytes` with LRU eviction.
+
+    `get(key)` returns the entry directory (and marks it used) or None;
+    `put(key, write)` calls `write(tmp_dir)` to fill a new entry, then evicts
+    least recently used entries until the cache fits again.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, key: str):
+        return self.root.joinpath(key)
+
+    def get(self, key: str):
+        entry = self._entry(key)
+        if not entry.joinpath(USED_MARKER).exists():
+            return None
+        entry.joinpath(USED_MARKER).touch()
+        return entry
+
+    def put(self, key: str, write, stage: str = ''):
+        entry = self._entry(key)
+        tmp = self.root.joinpath(f'.tmp-{key}-{os.getpid()}')
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir()
+        try:
+            write(tmp)
+            with open(tmp.joinpath('meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'stage': stage, 'created': time.time()}, f)
+            tmp.joinpath(USED_MARKER).touch()
+            if entry.exists():
+                shutil.rmtree(entry)
+            os.replace(tmp, entry)
+        finally:
+            if tmp.exists():
+                shutil.rmtree(tmp)
+        self.evict(keep=key)
+        return entry
+
+    def entries(self):
+        """(key, last_used, size_bytes) for every complete entry, least recently used first."""
+        out = []
+        for entry in self.root.iterdir():
+            marker = entry.joinpath(USED_MARKER)
+            if entry.is_dir() and not entry.name.startswith('.') and marker.exists():
+                out.append((entry.name, marker.stat().st_mtime, _dir_size(entry)))
+        return sorted(out, key=lambda e: e[1])
+
+    def size(self):
+        return sum(e[2] for e in self.entries())
+
+    def evict(self, keep: str = None):
+        """Delete least recently used entries until the total size is within `max_bytes`."""
+        entries = self.entries()
+        total = sum(e[2] for e in entries)
+        removed = []
+        for key, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
+
+    def clear(self):
+        for key, _, _ in self.entries():
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or clear the pipeline artifact cache')
+    parser.add_argument('dir', help='cache directory')
+    parser.add_argument('--clear', action='store_true', help='delete every entry')
+    args = parser.parse_args()
+    cache = ArtifactCache(args.dir)
+    if args.clear:
+        cache.clear()
+    for key, used, size in cache.entries():
+        with open(cache.root.joinpath(key, 'meta.json'), encoding='utf-8') as f:
+            stage = json.load(f).get('stage', '')
+        print(f"{key[:16]}  {stage:<12} {size / (1 << 20):9.2f} MiB  last used {time.ctime(used)}")
+    print(f'total {cache.size() / (1 << 20):.2f} MiB')
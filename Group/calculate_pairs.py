@@ -1,6 +1,8 @@
+import json
 import numpy as np
 import pandas as pd
 from pathlib import Path
+import instrument
 from sklearn.preprocessing import MultiLabelBinarizer
 import re
 
@@ -13,122 +15,573 @@ def parse_multi(s: str):
     return [x.strip() for x in re.split(SEPARATOR, str(s)) if x.strip()]
 
 
-def compute(i: int, j: int, df: pd.DataFrame):
+def _mask_columns(df: pd.DataFrame, key: str):
+    """Return the `{key}_mask_<w>` bitmask columns written by preprocess, in word order."""
+    prefix = f'{key}_mask_'
+    cols = [c for c in df.columns if c.startswith(prefix) and c[len(prefix):].isdigit()]
+    return sorted(cols, key=lambda c: int(c[len(prefix):]))
+
+
+def _mask_overlap(a, b):
+    """Intersection and union sizes of two respondents' packed multi-select bitmasks (rows of words)."""
+    inter = union = 0
+    for x, y in zip(a.tolist(), b.tolist()):
+        inter += bin(x & y).count('1')
+        union += bin(x | y).count('1')
+    return inter, union
+
+
+# legacy one-hot column prefixes for the multi-select questions (long survey headers)
+LEGACY_PREFIXES = {'q7': '8.你最感兴趣的赛道是？:', 'q9': '11.其他技能（选填）_'}
+
+# Points for each scoring outcome. A weight profile (JSON, see `load_weights`) overrides any subset.
+DEFAULT_WEIGHTS = {
+    'q4_both_sure': 4.0, 'q4_both_likely': 2.0, 'q4_mixed': 1.5, 'q4_other': 0.5,
+    'q5_both_accept': 2.0, 'q5_same': 1.0, 'q5_other': 0.0,
+    'q6_same': 3.0, 'q6_diff': 1.5,
+    'q7_jaccard': 2.2, 'q7_jaccard_onehot': 2.0,
+    'q8_same': 1.5, 'q8_diff': 2.0,
+    'q9_jaccard': 1.5, 'q9_union': 1.5, 'q9_jaccard_onehot': 2.0,
+    'q11_base': 4.0, 'q11_per_diff': 0.3,
+    'q12_same': 1.0, 'q12_diff': 0.5,
+    'q13_same': 1.0, 'q13_diff': 0.5,
+    'q14_same': 1.0, 'q14_diff': 0.5,
+    'q15_same': 1.0, 'q15_diff': 0.5,
+    'philosophy_type_same': 3.0, 'philosophy_type_diff': 2.0,
+    'philosophy_score_base': 1.0, 'philosophy_score_per_diff': 0.1,
+}
+
+
+def resolve_weights(weights: dict = None):
+    """Full weight table: `DEFAULT_WEIGHTS` updated with `weights` (unknown names raise ValueError)."""
+    if weights is None:
+        return DEFAULT_WEIGHTS
+    unknown = sorted(set(weights) - set(DEFAULT_WEIGHTS))
+    if unknown:
+        raise ValueError(f'unknown weight(s): {", ".join(unknown)}')
+    return {**DEFAULT_WEIGHTS, **{k: float(v) for k, v in weights.items()}}
+
+
+def load_weights(path: Path):
+    """Read a weight profile: a JSON object mapping `DEFAULT_WEIGHTS` names to numbers."""
+    with open(path, encoding='utf-8') as f:
+        return resolve_weights(json.load(f))
+
+
+class ScoringPlan:
+    """
+    The columns `compute` reads, resolved once per traits DataFrame.
+
+    Which q7/q9 branch applies (packed masks, raw text Jaccard or legacy
+    one-hot columns) is decided here and every column is held as a NumPy
+    array, so scoring a pair does no `df.columns` lookups. Rows are
+    addressed by position.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.n = len(df)
+        self.codes = {c: df[c].to_numpy() for c in ('q4_code', 'q5_code', 'q6_code', 'q8_code', 'q15_code',
+                                                     'philosophy_type')}
+        # float so float32 columns (columnar trait store) score exactly like float64 ones
+        self.values = {c: df[c].to_numpy(dtype=float) for c in ('q11_quality', 'philosophy_score')}
+        # 07 / 09: (kind, data) with kind 'mask' (uint32 words), 'raw' (answer text) or 'onehot' (bool)
+        self.multi = {}
+        for key, legacy_prefix in LEGACY_PREFIXES.items():
+            mask_cols = _mask_columns(df, key)
+            if mask_cols:
+                self.multi[key] = ('mask', df[mask_cols].to_numpy(dtype=np.int64))
+            elif f'{key}_raw' in df.columns:
+                self.multi[key] = ('raw', df[f'{key}_raw'].to_numpy(dtype=object))
+            else:
+                cols = [c for c in df.columns if c.startswith(legacy_prefix) or c.startswith(f'{key}_')]
+                self.multi[key] = ('onehot', df[cols].to_numpy() == 1 if cols
+                                   else np.zeros((len(df), 0), dtype=bool))
+        # 12 / 13 / 14: answers as `str`, or None when the column is missing
+        self.text = {c: df[c].map(str).to_numpy(dtype=object) if c in df.columns else None
+                     for c in ('q12_raw', 'q13_raw', 'q14_raw')}
+
+
+def compile_plan(df: pd.DataFrame):
+    """Build the `ScoringPlan` for `df`; pass it to every `compute` call on the same frame."""
+    return ScoringPlan(df)
+
+
+def _multi_overlap(source, i: int, j: int):
+    """(kind, intersection, union) of one multi-select question for a pair; union is a set size."""
+    kind, data = source
+    if kind == 'mask':
+        inter, union = _mask_overlap(data[i], data[j])
+        return 'raw', inter, union
+    if kind == 'raw':
+        set_i = set(parse_multi(data[i]))
+        set_j = set(parse_multi(data[j]))
+        return 'raw', len(set_i & set_j), len(set_i | set_j)
+    a, b = data[i], data[j]
+    return 'onehot', int((a & b).sum()), int((a | b).sum())
+
+
+def compute(i: int, j: int, df: pd.DataFrame, plan: ScoringPlan = None, weights: dict = None):
     """
     Compute similarity score between person i and j based on survey responses.
     Higher score means better match.
+
+    `plan` is `compile_plan(df)`; build it once when scoring many pairs of
+    the same frame (without it every call compiles its own). `weights`
+    overrides entries of `DEFAULT_WEIGHTS`.
     """
     # `df` is expected to be the traits DataFrame produced by `preprocess.py`.
-    # We operate with integer-location indexing (`iloc`) because callers pass indices (0-based positions).
+    # i and j are 0-based row positions.
+    if plan is None:
+        plan = compile_plan(df)
+    code = plan.codes
+    w = resolve_weights(weights)
     score = 0.0
     
     # 04: 参加意愿 - 相同高分
-    if df.iloc[i]['q4_code'] == 1 and df.iloc[j]['q4_code'] == 1:  # 都确定
-        score += 4.0
-    elif df.iloc[i]['q4_code'] == 2 and df.iloc[j]['q4_code'] == 2:  # 都大概率
-        score += 2.0
-    elif df.iloc[i]['q4_code'] + df.iloc[j]['q4_code'] == 3 :
-        score += 1.5  # 不同也给点分
+    a, b = code['q4_code'][i], code['q4_code'][j]
+    if a == 1 and b == 1:  # 都确定
+        score += w['q4_both_sure']
+    elif a == 2 and b == 2:  # 都大概率
+        score += w['q4_both_likely']
+    elif a + b == 3 :
+        score += w['q4_mixed']  # 不同也给点分
     else :
-        score +=0.5
+        score += w['q4_other']
     
     # 05: 组队意愿 - 都接受匹配高分
-    if df.iloc[i]['q5_code'] == 1 and df.iloc[j]['q5_code'] == 1:  # 都完全接受
-        score += 2.0
-    elif df.iloc[i]['q5_code'] == df.iloc[j]['q5_code']:
-        score += 1.0
+    a, b = code['q5_code'][i], code['q5_code'][j]
+    if a == 1 and b == 1:  # 都完全接受
+        score += w['q5_both_accept']
+    elif a == b:
+        score += w['q5_same']
     else:
-        score += 0.0  # 有队伍的和无队伍的低分
+        score += w['q5_other']  # 有队伍的和无队伍的低分
     
     # 06: 目标 - 相同高分
-    if df.iloc[i]['q6_code'] == df.iloc[j]['q6_code']:
-        score += 3.0
+    if code['q6_code'][i] == code['q6_code'][j]:
+        score += w['q6_same']
     else:
-        score += 1.5  # 不同目标也可能互补
+        score += w['q6_diff']  # 不同目标也可能互补
     
-    # 07: multi-select tracks — prefer raw `q7_raw` Jaccard similarity when available
-    if 'q7_raw' in df.columns:
-        set_i = set(parse_multi(df.at[i, 'q7_raw']))
-        set_j = set(parse_multi(df.at[j, 'q7_raw']))
-        union = set_i | set_j
-        if union:
-            jaccard = len(set_i & set_j) / len(union)
-            score += jaccard * 2.2
-    else:
-        # fallback to legacy one-hot columns (long header names)
-        q7_cols = [c for c in df.columns if c.startswith('8.你最感兴趣的赛道是？:') or c.startswith('q7_')]
-        common_tracks = sum(1 for c in q7_cols if df.iloc[i][c] == 1 and df.iloc[j][c] == 1)
-        total_tracks = sum(1 for c in q7_cols if df.iloc[i][c] == 1 or df.iloc[j][c] == 1)
-        if total_tracks > 0:
-            jaccard = common_tracks / total_tracks
-            score += jaccard * 2.0
+    # 07: multi-select tracks — packed `q7_mask_*` bitmasks from preprocess or raw `q7_raw`
+    # (Jaccard), else legacy one-hot columns; the plan has already picked the source
+    kind, inter, union = _multi_overlap(plan.multi['q7'], i, j)
+    if union:
+        score += inter / union * (w['q7_jaccard'] if kind == 'raw' else w['q7_jaccard_onehot'])
     
     # 08: 掌控部分 
-    if df.iloc[i]['q8_code'] == df.iloc[j]['q8_code']:
-        score += 1.5
-    else:
-        score += 2.0  # 不同部分可能互补
-    
-    # 09: skills (multi-select) — prefer raw `q9_raw` Jaccard similarity when available
-    if 'q9_raw' in df.columns:
-        set_i = set(parse_multi(df.at[i, 'q9_raw']))
-        set_j = set(parse_multi(df.at[j, 'q9_raw']))
-        union = set_i | set_j
-        if union:
-            jaccard = len(set_i & set_j) / len(union)
-            score += jaccard * 1.5+len(union)*1.5
+    if code['q8_code'][i] == code['q8_code'][j]:
+        score += w['q8_same']
     else:
-        q9_cols = [c for c in df.columns if c.startswith('11.其他技能（选填）_') or c.startswith('q9_')]
-        common_skills = sum(1 for c in q9_cols if df.iloc[i][c] == 1 and df.iloc[j][c] == 1)
-        total_skills = sum(1 for c in q9_cols if df.iloc[i][c] == 1 or df.iloc[j][c] == 1)
-        if total_skills > 0:
-            jaccard = common_skills / total_skills
-            score += jaccard * 2.0
+        score += w['q8_diff']  # 不同部分可能互补
     
+    # 09: skills (multi-select) — same sources as q7; the raw branch also rewards the union size
+    kind, inter, union = _multi_overlap(plan.multi['q9'], i, j)
+    if union:
+        if kind == 'raw':
+            score += inter / union * w['q9_jaccard']+union*w['q9_union']
+        else:
+            score += inter / union * w['q9_jaccard_onehot']
     
     # q11_quality - 相似质量高分
     # q11_quality is a heuristic numeric score (0..3) derived from free text; closer quality -> higher score
-    diff_quality = abs(df.iloc[i]['q11_quality'] - df.iloc[j]['q11_quality'])
-    score += max(0, 4.0 - diff_quality * 0.3)
+    diff_quality = abs(plan.values['q11_quality'][i] - plan.values['q11_quality'][j])
+    score += max(0, w['q11_base'] - diff_quality * w['q11_per_diff'])
     
-    # helper to safely get raw/text fields; fallback to philosophy_raw parts if available
-    # helper to retrieve raw/text answers. Use `df.at` for fast scalar access by label.
-    def _get_raw(idx, col):
-        return str(df.at[idx, col]) if col in df.columns else ''
-
     # 12: 分歧处理 - 相同风格高分
     # comparing verbatim raw text answers can be noisy but is simple and explainable here
-    v_i = _get_raw(i, 'q12_raw')
-    v_j = _get_raw(j, 'q12_raw')
-    score += 1.0 if v_i == v_j and v_i != '' else 0.5
-
     # 13: 反应方式 - 相同高分
-    v_i = _get_raw(i, 'q13_raw')
-    v_j = _get_raw(j, 'q13_raw')
-    score += 1.0 if v_i == v_j and v_i != '' else 0.5
-
     # 14: 压力处理 - 相同高分
-    v_i = _get_raw(i, 'q14_raw')
-    v_j = _get_raw(j, 'q14_raw')
-    score += 1.0 if v_i == v_j and v_i != '' else 0.5
+    for key in ('q12', 'q13', 'q14'):
+        text = plan.text[f'{key}_raw']
+        v_i = text[i] if text is not None else ''
+        v_j = text[j] if text is not None else ''
+        score += w[f'{key}_same'] if v_i == v_j and v_i != '' else w[f'{key}_diff']
     
     # 15: 作品偏好 - 相同高分
     # q15_code is a compact integer encoding for single-choice Q15
-    if df.iloc[i]['q15_code'] == df.iloc[j]['q15_code']:
-        score += 1.0
+    if code['q15_code'][i] == code['q15_code'][j]:
+        score += w['q15_same']
     else:
-        score += 0.5
+        score += w['q15_diff']
     
     # 哲学类型 - 相同类型高分
     # philosophy_type is a categorical label produced by `score_philosophy`.
     # Matching types should increase compatibility; different types might also complement each other.
-    if df.iloc[i]['philosophy_type'] == df.iloc[j]['philosophy_type']:
-        score += 3.0
+    if code['philosophy_type'][i] == code['philosophy_type'][j]:
+        score += w['philosophy_type_same']
     else:
-        score += 2.0
+        score += w['philosophy_type_diff']
     
     # 哲学分数 - 接近高分
-    diff_phil = abs(df.iloc[i]['philosophy_score'] - df.iloc[j]['philosophy_score'])
-    score += max(0, 1.0 - diff_phil * 0.1)  # 相差0 1.0, 相差5 0.5
+    diff_phil = abs(plan.values['philosophy_score'][i] - plan.values['philosophy_score'][j])
+    score += max(0, w['philosophy_score_base'] - diff_phil * w['philosophy_score_per_diff'])  # 相差0 1.0, 相差5 0.5
     
+    return float(score)
+
+
+# ---------------------------------------------------------------------------
+# Batched scoring: the same rules as `compute`, evaluated for whole row blocks
+# at once with NumPy broadcasting instead of one `df.iloc` lookup per term.
+# ---------------------------------------------------------------------------
+
+# number of pair scores evaluated per block (rows * n); bounds the temporaries
+BLOCK_CELLS = 4_000_000
+
+
+# popcount lookup for one byte; used when `np.bitwise_count` (NumPy >= 2.0) is unavailable
+_POPCOUNT8 = np.array([bin(b).count('1') for b in range(256)], dtype=np.uint8)
+
+
+def _popcount(words: np.ndarray):
+    """Per-row number of set bits across uint32 mask words of shape (n, w)."""
+    words = np.ascontiguousarray(words, dtype='<u4')
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    return _POPCOUNT8[words.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+
+def _mask_indicator(words: np.ndarray):
+    """Unpack uint32 mask words (n, w) into a (n, 32 * w) 0/1 float32 indicator matrix."""
+    words = np.ascontiguousarray(words, dtype='<u4')
+    bits = np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')
+    return bits.astype(np.float32)
+
+
+def _multi_indicator(values):
+    """Parse multi-select answers once and return a (n, V) 0/1 indicator matrix."""
+    vocab = {}
+    rows = []
+    for v in values:
+        toks = set(parse_multi(v))
+        rows.append([vocab.setdefault(t, len(vocab)) for t in toks])
+    ind = np.zeros((len(rows), max(len(vocab), 1)), dtype=np.float32)
+    for r, cols in enumerate(rows):
+        ind[r, cols] = 1.0
+    return ind
+
+
+def prepare_features(df: pd.DataFrame, plan: ScoringPlan = None, weights: dict = None):
+    """
+    Turn the columns of a `ScoringPlan` into the flat NumPy arrays block scoring reads.
+
+    The result is reused by every `score_block` call so the DataFrame is
+    inspected once instead of once per pair. It also carries the weight
+    table (`weights` over `DEFAULT_WEIGHTS`) the blocks are scored with.
+    """
+    with instrument.stage('calculate_pairs.prepare_features', rows=len(df)):
+        return _prepare_features(df, plan, weights)
+
+
+def _prepare_features(df: pd.DataFrame, plan: ScoringPlan, weights: dict):
+    if plan is None:
+        plan = compile_plan(df.reset_index(drop=True))
+    feats = {'n': plan.n, 'weights': dict(resolve_weights(weights))}
+    feats.update(plan.codes)
+    feats.update(plan.values)
+
+    # 07 / 09: each entry is (kind, indicator matrix, selection counts); packed masks
+    # score like the raw-text branch, so both become 'raw' indicators
+    for key, (kind, data) in plan.multi.items():
+        if kind == 'mask':
+            words = data.astype('<u4')
+            feats[key] = ('raw', _mask_indicator(words), _popcount(words))
+            continue
+        if kind == 'raw':
+            ind = _multi_indicator(data.tolist())
+        else:
+            ind = data.astype(np.float32) if data.shape[1] else np.zeros((plan.n, 1), dtype=np.float32)
+        feats[key] = (kind, ind, ind.sum(axis=1, dtype=np.int64))
+
+    # 12 / 13 / 14: factorize the text so equality becomes integer equality; (codes, nonempty) or None
+    for c, text in plan.text.items():
+        feats[c] = None if text is None else (pd.factorize(text)[0], text != '')
+    return feats
+
+
+def _jaccard(ind: np.ndarray, cnt: np.ndarray, rows: slice, cols: slice):
+    """Return (intersection, union) sizes of `ind[rows]` against `ind[cols]`."""
+    # intersections via one matrix product; counts are small integers so float32 is exact,
+    # unions from the per-row popcounts: |A u B| = |A| + |B| - |A n B|
+    inter = ind[rows] @ ind[cols].T
+    union = cnt[rows][:, None] + cnt[cols][None, :] - inter
+    return inter.astype(float), union.astype(float)
+
+
+def score_block(feats, start: int, stop: int, col_start: int = 0):
+    """
+    Score rows `start..stop-1` against people `col_start..n-1`.
+
+    Returns a (stop-start, n-col_start) array. Terms are accumulated in the
+    same order as `compute` so the results agree with the scalar
+    implementation (the diagonal is not special-cased here).
+    """
+    return score_rows(feats, slice(start, stop), slice(col_start, feats['n']))
+
+
+def score_rows(feats, rows, cols=slice(None)):
+    """Like `score_block`, for arbitrary row/column selections (slices or index arrays)."""
+    return combine_components(score_components(feats, rows, cols), feats['weights'])
+
+
+def score_components(feats, rows, cols=slice(None)):
+    """
+    Per-question outcomes for a block of pairs, before any weights are applied.
+
+    Returns a dict of same-shaped arrays: outcome classes for q4/q5, `same`
+    flags for the equality questions, intersection and union sizes for q7/q9
+    (plus which branch produced them) and absolute differences for the two
+    numeric scores. `combine_components` turns them into points.
+    """
+    def pair(col):
+        v = feats[col]
+        return v[rows][:, None], v[cols][None, :]
+
+    comps = {}
+    # 04: 参加意愿 -> 0 both sure, 1 both likely, 2 one of each, 3 other
+    a, b = pair('q4_code')
+    comps['q4'] = np.select([(a == 1) & (b == 1), (a == 2) & (b == 2), (a + b) == 3],
+                            [0, 1, 2], default=3).astype(np.int8)
+    # 05: 组队意愿 -> 0 both accept, 1 same answer, 2 other
+    a, b = pair('q5_code')
+    comps['q5'] = np.select([(a == 1) & (b == 1), a == b], [0, 1], default=2).astype(np.int8)
+    for key in ('q6', 'q8'):
+        a, b = pair(f'{key}_code')
+        comps[key] = a == b
+    # 07 / 09: tracks and skills (set sizes; the Jaccard ratio is taken when combining)
+    for key in ('q7', 'q9'):
+        kind, ind, cnt = feats[key]
+        comps[f'{key}_inter'], comps[f'{key}_union'] = _jaccard(ind, cnt, rows, cols)
+        comps[f'{key}_kind'] = kind
+    a, b = pair('q11_quality')
+    comps['q11_quality'] = np.abs(a - b)
+    # 12 / 13 / 14: verbatim raw text equality (a missing column never matches)
+    for c in ('q12_raw', 'q13_raw', 'q14_raw'):
+        tc = feats[c]
+        if tc is None:
+            comps[c[:3]] = np.zeros(comps['q6'].shape, dtype=bool)
+            continue
+        codes, nonempty = tc
+        comps[c[:3]] = (codes[rows][:, None] == codes[cols][None, :]) & nonempty[rows][:, None]
+    a, b = pair('q15_code')
+    comps['q15'] = a == b
+    # 哲学类型 / 哲学分数
+    a, b = pair('philosophy_type')
+    comps['philosophy_type'] = a == b
+    a, b = pair('philosophy_score')
+    comps['philosophy_score'] = np.abs(a - b)
+    return comps
+
+
+def _ratio(inter, union):
+    """Jaccard ratio of intersection and union sizes; 0 where both selections are empty."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(union > 0, inter / union, 0.0)
+
+
+def combine_components(comps, weights: dict = None):
+    """
+    Weighted sum of `score_components` output (or a cached copy of it).
+
+    Terms are accumulated in the same order as `compute`, so the result is
+    bit-identical to scoring the pairs directly with the same weights.
+    """
+    w = resolve_weights(weights)
+    # cached differences may be float32; weigh them in float64 like freshly scored ones
+    quality, philosophy = (np.asarray(comps[k], dtype=float) for k in ('q11_quality', 'philosophy_score'))
+    # 04 / 05: outcome class -> points
+    score = np.array([w['q4_both_sure'], w['q4_both_likely'], w['q4_mixed'], w['q4_other']])[comps['q4']]
+    score += np.array([w['q5_both_accept'], w['q5_same'], w['q5_other']])[comps['q5']]
+    # 06: 目标
+    score += np.where(comps['q6'], w['q6_same'], w['q6_diff'])
+
+    # 07: tracks
+    score += _ratio(comps['q7_inter'], comps['q7_union']) * (w['q7_jaccard'] if comps['q7_kind'] == 'raw' else w['q7_jaccard_onehot'])
+
+    # 08: 掌控部分
+    score += np.where(comps['q8'], w['q8_same'], w['q8_diff'])
+
+    # 09: skills (raw branch also rewards the size of the union)
+    jac = _ratio(comps['q9_inter'], comps['q9_union'])
+    if comps['q9_kind'] == 'raw':
+        union = comps['q9_union']
+        score += np.where(union > 0, jac * w['q9_jaccard'] + union * w['q9_union'], 0.0)
+    else:
+        score += jac * w['q9_jaccard_onehot']
+
+    # q11_quality (fmax: a missing score gives 0 points, like Python's max(0, nan) in `compute`)
+    score += np.fmax(0, w['q11_base'] - quality * w['q11_per_diff'])
+
+    # 12 / 13 / 14: verbatim raw text equality
+    for key in ('q12', 'q13', 'q14'):
+        score += np.where(comps[key], w[f'{key}_same'], w[f'{key}_diff'])
+
+    # 15: 作品偏好
+    score += np.where(comps['q15'], w['q15_same'], w['q15_diff'])
+
+    # 哲学类型 / 哲学分数
+    score += np.where(comps['philosophy_type'], w['philosophy_type_same'], w['philosophy_type_diff'])
+    score += np.fmax(0, w['philosophy_score_base'] - philosophy * w['philosophy_score_per_diff'])
     return score
+
+
+def score_bounds(feats):
+    """
+    (low, high) enclosing every pair score `score_rows(feats, ...)` can
+    produce, from the weights and the features' value ranges (largest q9
+    selection, spread of the two numeric scores). Known before any pair is
+    scored, so a fixed-range storage format can be chosen up front.
+    """
+    w = feats['weights']
+    choices = [
+        (w['q4_both_sure'], w['q4_both_likely'], w['q4_mixed'], w['q4_other']),
+        (w['q5_both_accept'], w['q5_same'], w['q5_other']),
+    ] + [(w[f'{key}_same'], w[f'{key}_diff']) for key in ('q6', 'q8', 'q12', 'q13', 'q14', 'q15', 'philosophy_type')]
+    low = sum(min(c) for c in choices)
+    high = sum(max(c) for c in choices)
+    for key in ('q7', 'q9'):
+        kind, _, cnt = feats[key]
+        jw = w[f'{key}_jaccard' if kind == 'raw' else f'{key}_jaccard_onehot']
+        low += min(0.0, jw)
+        high += max(0.0, jw)
+        if key == 'q9' and kind == 'raw':
+            # |A u B| <= |A| + |B|
+            terms = (w['q9_union'], w['q9_union'] * 2 * int(cnt.max(initial=0)))
+            low += min(0.0, *terms)
+            high += max(0.0, *terms)
+    for col, base, per_diff in (('q11_quality', 'q11_base', 'q11_per_diff'),
+                                ('philosophy_score', 'philosophy_score_base', 'philosophy_score_per_diff')):
+        values = feats[col]
+        spread = float(np.nanmax(values) - np.nanmin(values)) if len(values) else 0.0
+        high += max(0.0, w[base] + max(0.0, -w[per_diff]) * spread)
+    return low, high
+
+
+def compute_matrix(df: pd.DataFrame, block_cells: int = BLOCK_CELLS, weights: dict = None):
+    """
+    Compute the full n x n similarity matrix in row blocks (diagonal = 1.0).
+
+    Equivalent to calling `compute(i, j, df, weights=weights)` for every ordered pair.
+    """
+    feats = prepare_features(df, weights=weights)
+    n = feats['n']
+    mat = np.zeros((n, n), dtype=float)
+    step = max(1, block_cells // max(n, 1))
+    with instrument.stage('calculate_pairs.score_dense', pairs=n * n):
+        for start in range(0, n, step):
+            stop = min(n, start + step)
+            mat[start:stop] = score_block(feats, start, stop)
+    np.fill_diagonal(mat, 1.0)
+    return mat
+
+
+def condensed_index(n: int, i, j):
+    """Position of pair (i, j), i < j, in a condensed vector (scipy `pdist` layout)."""
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def compute_condensed(df: pd.DataFrame, block_cells: int = BLOCK_CELLS, weights: dict = None):
+    """
+    Score each unordered pair once and return the condensed upper triangle.
+
+    Every term of `compute` is symmetric, so `compute_matrix(df)[i, j]` for
+    i < j is stored at `condensed_index(n, i, j)`; the vector has n*(n-1)/2
+    entries and the diagonal (always 1.0) is implicit.
+    """
+    feats = prepare_features(df, weights=weights)
+    n = feats['n']
+    out = np.zeros(n * (n - 1) // 2, dtype=float)
+    start = 0
+    with instrument.stage('calculate_pairs.score_condensed', pairs=len(out)):
+        while start < n - 1:
+            # rows shrink towards the bottom of the triangle, so grow the block to keep its size constant
+            step = max(1, block_cells // (n - start))
+            stop = min(n - 1, start + step)
+            block = score_block(feats, start, stop, col_start=start + 1)
+            for i in range(start, stop):
+                # row i of the block holds columns start+1..n-1; keep only j > i
+                pos = condensed_index(n, i, i + 1)
+                out[pos:pos + n - i - 1] = block[i - start, i - start:]
+            start = stop
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Component cache: every pair's per-question outcomes, stored once so a new
+# weight profile is a weighted sum over cached arrays instead of a re-score.
+# ---------------------------------------------------------------------------
+
+def _component_dtypes(feats):
+    """
+    Storage dtype of each cached component that is not kept as scored: q7/q9
+    set sizes in the narrowest unsigned type holding them, the two numeric
+    differences as float32 (widened back if a difference is not exact in it).
+    """
+    dtypes = {'q11_quality': np.dtype(np.float32), 'philosophy_score': np.dtype(np.float32)}
+    for key in ('q7', 'q9'):
+        # |A n B| <= |A u B| <= |A| + |B|
+        dtypes[f'{key}_inter'] = dtypes[f'{key}_union'] = np.min_scalar_type(2 * int(feats[key][2].max(initial=0)))
+    return dtypes
+
+
+def compute_components(df: pd.DataFrame, block_cells: int = BLOCK_CELLS):
+    """
+    `score_components` for every unordered pair, in the condensed layout of
+    `compute_condensed`. Returns a dict of 1-D arrays plus 'n' and the
+    q7/q9 branch kinds; `combine_components(result, weights)` equals
+    `compute_condensed(df, weights=weights)`.
+
+    Outcomes are stored narrow (`_component_dtypes`): flags and classes as
+    bool/int8, set sizes as uint8 for surveys with up to 127 options chosen,
+    differences as float32, about 21 bytes per pair. The ratios and sums are
+    still taken in float64 from these exact values.
+    """
+    feats = prepare_features(df)
+    dtypes = _component_dtypes(feats)
+    n = feats['n']
+    m = n * (n - 1) // 2
+    out = {'n': n}
+    start = 0
+    with instrument.stage('calculate_pairs.components', pairs=m):
+        while start < n - 1:
+            step = max(1, block_cells // (n - start))
+            stop = min(n - 1, start + step)
+            comps = score_components(feats, slice(start, stop), slice(start + 1, n))
+            for name, block in comps.items():
+                if isinstance(block, str):
+                    out[name] = block
+                    continue
+                if name not in out:
+                    out[name] = np.zeros(m, dtype=dtypes.get(name, block.dtype))
+                if out[name].dtype == np.float32 and not np.array_equal(block.astype(np.float32), block,
+                                                                        equal_nan=True):
+                    out[name] = out[name].astype(float)
+                for i in range(start, stop):
+                    pos = condensed_index(n, i, i + 1)
+                    out[name][pos:pos + n - i - 1] = block[i - start, i - start:]
+            start = stop
+    if n < 2:
+        # no pairs: empty components with the dtypes combine_components expects
+        empty = score_components(feats, slice(0, 0), slice(0, 0))
+        out.update({k: v if isinstance(v, str) else v.reshape(0).astype(dtypes.get(k, v.dtype))
+                    for k, v in empty.items()})
+    return out
+
+
+def save_components(comps: dict, path: Path, **meta):
+    """Write a component cache as `.npz`; `meta` (e.g. ids, a trait hash) is stored alongside."""
+    arrays = {k: np.asarray(v) for k, v in comps.items()}
+    arrays.update({f'meta_{k}': np.asarray(v) for k, v in meta.items()})
+    np.savez(str(path), **arrays)
+
+
+def load_components(path: Path):
+    """Inverse of `save_components`: returns (components, meta)."""
+    comps, meta = {}, {}
+    with np.load(str(path)) as z:
+        for k in z.files:
+            v = z[k]
+            target, name = (meta, k[5:]) if k.startswith('meta_') else (comps, k)
+            target[name] = v.item() if v.ndim == 0 else v
+    return comps, meta
+
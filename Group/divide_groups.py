@@ -1,11 +1,201 @@
+import argparse
 import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import numpy as np
 import random
+import instrument
+
+# Reduced-precision (float32 / int16) scores that agree to this many decimals
+# are ties: the stored scores are exact, but float64 sums of them carry
+# ~1e-15 rounding noise, so their orderings compare rounded keys and fall
+# back to index order. Float64 matrices keep exact ordering.
+TIE_DECIMALS = 9
+
+
+class CondensedMatrix:
+    """
+    Read-only view of a symmetric similarity matrix stored as its condensed
+    upper triangle (scipy `pdist` layout, as written by `make_matrix.py --condensed`).
+
+    Supports the indexing the grouping code uses: `mat[i, j]` (scalars or
+    index arrays) and `mat[i]` for a full row; rows are expanded on demand,
+    `np.asarray(mat)` materializes the dense matrix.
+
+    Quantized (int16) values are decoded as `offset + value * scale`.
+    """
+
+    def __init__(self, values, n: int, diagonal: float = 1.0, scale: float = None, offset: float = 0.0):
+        self.values = values
+        self.n = n
+        self.diagonal = diagonal
+        self.scale = scale
+        self.offset = offset
+        self.shape = (n, n)
+        self.dtype = values.dtype if scale is None else np.dtype(float)
+
+    def decode(self, raw):
+        """Stored values -> scores."""
+        return raw if self.scale is None else raw * self.scale + self.offset
+
+    def __len__(self):
+        return self.n
+
+    def _index(self, i, j):
+        # order each pair so that i < j, then map to the condensed position
+        lo = np.minimum(i, j)
+        hi = np.maximum(i, j)
+        return self.n * lo - lo * (lo + 1) // 2 + (hi - lo - 1)
+
+    def pair(self, i, j):
+        """Scores for index arrays (or scalars) `i`, `j`; the diagonal is implicit."""
+        i = np.asarray(i, dtype=np.int64)
+        j = np.asarray(j, dtype=np.int64)
+        same = i == j
+        out = self.decode(np.asarray(self.values[np.where(same, 0, self._index(i, j))]))
+        return np.where(same, self.diagonal, out).astype(self.dtype)
+
+    def row(self, i: int):
+        """Dense row i (length n)."""
+        n = self.n
+        out = np.empty(n, dtype=self.dtype)
+        # columns j < i live in earlier rows of the triangle, j > i are contiguous
+        j = np.arange(i, dtype=np.int64)
+        out[:i] = self.decode(self.values[self._index(j, i)])
+        out[i] = self.diagonal
+        start = self._index(i, i + 1)
+        out[i + 1:] = self.decode(self.values[start:start + n - i - 1])
+        return out
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            i, j = key
+            if np.isscalar(i) and np.isscalar(j):
+                return self.pair(i, j)[()]
+            return self.pair(i, j)
+        return self.row(int(key))
+
+    def to_dense(self):
+        n = self.n
+        mat = np.empty((n, n), dtype=self.dtype)
+        iu = np.triu_indices(n, 1)
+        values = self.decode(np.asarray(self.values))
+        mat[iu] = values
+        mat[(iu[1], iu[0])] = values
+        np.fill_diagonal(mat, self.diagonal)
+        return mat
+
+    def __array__(self, dtype=None, copy=None):
+        mat = self.to_dense()
+        return mat if dtype is None else mat.astype(dtype)
+
+
+class QuantizedMatrix:
+    """
+    Dense n x n matrix stored as int16 (`make_matrix.py --dtype int16`),
+    decoded on access as `offset + value * scale`.
+
+    Indexing (`mat[i, j]`, `mat[rows]`, slices) returns float scores, so the
+    grouping code reads it like any dense array while only a quarter of the
+    float64 bytes are paged in.
+    """
+
+    def __init__(self, values, scale: float, offset: float = 0.0):
+        self.values = values
+        self.scale = scale
+        self.offset = offset
+        self.shape = values.shape
+        self.dtype = np.dtype(float)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, key):
+        raw = self.values[key]
+        if np.isscalar(raw) or np.ndim(raw) == 0:
+            return float(raw) * self.scale + self.offset
+        return np.asarray(raw) * self.scale + self.offset
+
+    def item(self, i: int, j: int):
+        return self.values.item(i, j) * self.scale + self.offset
+
+    def __array__(self, dtype=None, copy=None):
+        mat = np.asarray(self.values) * self.scale + self.offset
+        return mat if dtype is None else mat.astype(dtype)
+
+
+class TopKIndex:
+    """
+    Sparse neighbor index holding only each person's K best partners
+    (written by `make_matrix.py --topk K`).
+
+    `neighbors[i]` / `scores[i]` are ordered best first; `row_sums[i]` is
+    i's total similarity to everyone. `mat[i, j]` returns the stored score
+    when j is among i's neighbors (or i among j's), otherwise `fill`
+    (default: the smallest stored score, a stand-in for "not a good match").
+    """
+
+    def __init__(self, neighbors, scores, row_sums, fill: float = None):
+        self.neighbors = np.asarray(neighbors)
+        self.scores = np.asarray(scores)
+        self.row_sums = np.asarray(row_sums)
+        self.n = len(self.neighbors)
+        self.k = self.neighbors.shape[1] if self.neighbors.ndim == 2 else 0
+        self.shape = (self.n, self.n)
+        self.dtype = self.scores.dtype
+        if fill is None:
+            fill = float(self.scores.min()) if self.scores.size else 0.0
+        self.fill = fill
+        # per-row lookup of neighbor -> score, built on first use
+        self._lookup = None
+
+    def __len__(self):
+        return self.n
+
+    def pair(self, i: int, j: int):
+        if i == j:
+            return 1.0
+        if self._lookup is None:
+            self._lookup = [dict(zip(nb.tolist(), sc.tolist())) for nb, sc in zip(self.neighbors, self.scores)]
+        v = self._lookup[i].get(j)
+        if v is None:
+            v = self._lookup[j].get(i, self.fill)
+        return v
+
+    def __getitem__(self, key):
+        i, j = key
+        return self.pair(int(i), int(j))
+
+    def pairs(self):
+        """Unique (i, j, score) pairs with i < j present in the index."""
+        seen = {}
+        for i in range(self.n):
+            for j, sc in zip(self.neighbors[i].tolist(), self.scores[i].tolist()):
+                key = (i, j) if i < j else (j, i)
+                if key not in seen:
+                    seen[key] = sc
+        return [(i, j, sc) for (i, j), sc in seen.items()]
 
 
 def load_matrix(path: Path):
-    """Load matrix.csv (square) and return ids list and numpy matrix."""
+    """
+    Load matrix.csv (square) and return ids list and numpy matrix.
+
+    A condensed file (header row of ids followed by a single `condensed`
+    row) is returned as a `CondensedMatrix` instead of a dense array.
+    A binary `.npy` matrix (see `make_matrix.write_binary`) is opened with
+    `np.memmap` and its ids are read from the `*_ids.txt` sidecar; a
+    top-K `.npz` index is returned as a `TopKIndex`.
+    """
+    path = Path(path)
+    if path.suffix == '.npy':
+        return load_binary_matrix(path)
+    if path.suffix == '.npz':
+        data = np.load(str(path))
+        return data['ids'].tolist(), TopKIndex(data['neighbors'], data['scores'], data['row_sums'])
     with open(path, newline='', encoding='utf-8') as f:
         reader = csv.reader(f)
         rows = list(reader)
@@ -15,176 +205,276 @@ def load_matrix(path: Path):
     header = rows[0]
     ids = header[1:]
     n = len(ids)
-    mat = np.zeros((n, n), dtype=float)
-    # parse rows into a numpy matrix; convert strings to float
-    for i, row in enumerate(rows[1:1 + n]):
-        for j in range(n):
-            mat[i, j] = float(row[j + 1])
+    if len(rows) > 1 and rows[1] and rows[1][0] == 'condensed':
+        values = np.array(rows[1][1:], dtype=float)
+        if len(values) != n * (n - 1) // 2:
+            raise ValueError(f'{path}: expected {n * (n - 1) // 2} condensed values, got {len(values)}')
+        return ids, CondensedMatrix(values, n)
+    # parse rows into a numpy matrix; NumPy converts the string cells to float in one pass
+    mat = np.array([row[1:n + 1] for row in rows[1:1 + n]], dtype=float).reshape(-1, n)
     return ids, mat
 
 
-def greedy_grouping(ids, mat, group_size=4):
+def find_matrix(base: Path):
+    """The most recently written output of make_matrix.py in `base` (dense/condensed/top-K, csv/npy)."""
+    candidates = [base.joinpath(c) for c in ('matrix.npy', 'matrix.csv', 'matrix_condensed.npy',
+                                             'matrix_condensed.csv', 'matrix_topk.npz')]
+    existing = [p for p in candidates if p.exists()]
+    if not existing:
+        raise FileNotFoundError('matrix.csv not found - run make_matrix.py first')
+    return max(existing, key=lambda p: p.stat().st_mtime)
+
+
+def load_binary_matrix(path: Path):
+    """
+    Memory-map a `.npy` matrix (dense or condensed; float64, float32 or
+    int16 with its codec sidecar) and read its sidecar id list.
+    """
+    path = Path(path)
+    with open(path.with_name(path.stem + '_ids.txt'), encoding='utf-8') as f:
+        ids = [line.rstrip('\n') for line in f]
+    values = np.load(str(path), mmap_mode='r')
+    n = len(ids)
+    # int16 storage: the scale and offset live in a `*_codec.json` sidecar
+    scale, offset = None, 0.0
+    if values.dtype.kind == 'i':
+        with open(path.with_name(path.stem + '_codec.json'), encoding='utf-8') as f:
+            codec = json.load(f)
+        scale, offset = codec['scale'], codec['offset']
+    if values.ndim == 1:
+        if len(values) != n * (n - 1) // 2:
+            raise ValueError(f'{path}: expected {n * (n - 1) // 2} condensed values, got {len(values)}')
+        return ids, CondensedMatrix(values, n, scale=scale, offset=offset)
+    if values.shape != (n, n):
+        raise ValueError(f'{path}: matrix shape {values.shape} does not match {n} ids')
+    return ids, (values if scale is None else QuantizedMatrix(values, scale, offset))
+
+
+def make_rng(seed=None):
+    """
+    Normalize a `seed` argument: a `random.Random` is used as is, anything
+    else (int, None) seeds a fresh private `random.Random`, so grouping never
+    touches the global `random` state.
+    """
+    if isinstance(seed, random.Random):
+        return seed
+    return random.Random(seed)
+
+
+def storage_dtype(mat):
+    """dtype the scores of any supported matrix are stored in (int16 for quantized storage)."""
+    if isinstance(mat, TopKIndex):
+        return mat.scores.dtype
+    if isinstance(mat, (CondensedMatrix, QuantizedMatrix)):
+        return mat.values.dtype
+    return mat.dtype
+
+
+def _tie_decimals(mat):
+    """`TIE_DECIMALS` for float32 / int16 storage, None for float64 (exact ordering)."""
+    return None if storage_dtype(mat) == np.float64 else TIE_DECIMALS
+
+
+def _tie_key(scores, decimals):
+    """Float scores as a sort key: rounded to `decimals`, or unchanged when None."""
+    return scores if decimals is None else np.round(scores, decimals)
+
+
+def _scalar_lookup(mat):
+    """
+    `score(i, j)` for Python-int indices: the same value as `mat[i, j]`,
+    without the generic indexing cost. float32 scores come back as Python
+    floats so sums of them are not rounded to float32.
+    """
+    if isinstance(mat, TopKIndex):
+        return mat.pair
+    if isinstance(mat, CondensedMatrix):
+        values, n, scale, offset = mat.values, mat.n, mat.scale, mat.offset
+        diagonal = float(mat.diagonal)
+
+        def score(i, j):
+            if i == j:
+                return diagonal
+            lo, hi = (i, j) if i < j else (j, i)
+            v = values[n * lo - lo * (lo + 1) // 2 + (hi - lo - 1)]
+            return float(v) if scale is None else float(v) * scale + offset
+        return score
+    return mat.item
+
+
+def _pair_order(mat, chunk: int = 1 << 16):
+    """
+    Yield (i, j) lists of all pairs i < j, best score first, `chunk` pairs at a time.
+
+    The upper triangle is one flat score vector (the condensed values
+    themselves, or the dense rows gathered once, in the matrix's own dtype)
+    ordered by a single stable argsort, so ties keep row-major (i, j)
+    order; pair coordinates are decoded from the flat positions chunk by
+    chunk. A top-K index contributes only its stored pairs.
+    """
+    if isinstance(mat, TopKIndex):
+        pairs = mat.pairs()
+        i = np.array([p[0] for p in pairs], dtype=np.int64)
+        j = np.array([p[1] for p in pairs], dtype=np.int64)
+        order = np.argsort(-np.array([p[2] for p in pairs], dtype=float), kind='stable')
+        for s in range(0, len(order), chunk):
+            sel = order[s:s + chunk]
+            yield i[sel].tolist(), j[sel].tolist()
+        return
+    n = len(mat)
+    if isinstance(mat, CondensedMatrix):
+        # stored values order like the scores (decoding is increasing), so int16 sorts as is
+        keys = -np.asarray(mat.values)
+    else:
+        raw = mat.values if isinstance(mat, QuantizedMatrix) else mat
+        keys = np.concatenate([np.asarray(raw[r, r + 1:]) for r in range(n)] or [np.zeros(0)])
+        np.negative(keys, out=keys)
+    order = np.argsort(keys, kind='stable')
+    del keys
+    # row_start[r]: flat position of pair (r, r + 1)
+    row_start = np.concatenate(([0], np.cumsum(np.arange(n - 1, 0, -1))))
+    for s in range(0, len(order), chunk):
+        k = order[s:s + chunk]
+        i = np.searchsorted(row_start, k, side='right') - 1
+        yield i.tolist(), (k - row_start[i] + i + 1).tolist()
+
+
+def greedy_grouping(ids, mat, group_size=4, seed=None):
     """
     Greedy grouping by descending pair scores.
 
+    Evictions are random; pass `seed` (int or `random.Random`) for a
+    reproducible run. With `seed=None` every run draws a fresh seed.
+
     Strategy:
-    - Build list of all pairs (i,j,score), sort by score desc.
+    - Visit all pairs (i, j) by score descending (`_pair_order`: one argsort over the triangle).
     - Iterate pairs, try to form/extend groups as described by user rules.
     - Maintain groups as sets; when conflict (both i and j already in different groups),
       decide by removing the 'least important' member from one group and reassigning.
     - 'Least important' heuristic: for a member x in a group G, compute sum of similarities
       between x and other members of G; lower sum -> less important.
     - Stop when no more groups can be formed and return list of groups (each list of ids).
+
+    A person moved into another group during a conflict leaves their old
+    group's set, so that group does not keep looking full. Membership is an
+    array (`label[x]`, -1 = unassigned); `stamp[x]` records when x was last
+    assigned, which fixes the output order of the groups. On float32 / int16
+    storage a replacement must win by more than the `TIE_DECIMALS` tolerance.
     """
-    # `mat` is a dense NumPy matrix of pairwise similarity scores
+    rng = make_rng(seed)
     n = len(ids)
-    # pair list
-    # generate all upper-triangle pairs and sort by score descending (greedy seeding)
-    pairs = []
-    for i in range(n):
-        for j in range(i + 1, n):
-            pairs.append((i, j, mat[i, j]))
-    pairs.sort(key=lambda x: x[2], reverse=True)
-
+    score = _scalar_lookup(mat)
+    decimals = _tie_decimals(mat)
+    tol = 0.0 if decimals is None else 10.0 ** -decimals
     groups = []  # list of sets of indices
-    member_to_group = {}  # idx -> group_idx
-
-    def least_important_member(group_set):
-        # return member idx with smallest sum similarity to other members in group
-        best_idx = None
-        best_score = None
-        for x in group_set:
-            s = sum(mat[x, y] for y in group_set if y != x)
-            if best_score is None or s < best_score:
-                best_score = s
-                best_idx = x
-        return best_idx
-
-    for i, j, score in pairs:
-        gi = member_to_group.get(i)
-        gj = member_to_group.get(j)
-
-        # neither in group -> make new group with i,j
-        if gi is None and gj is None:
-            g = {i, j}
-            groups.append(g)
-            gidx = len(groups) - 1
-            member_to_group[i] = gidx
-            member_to_group[j] = gidx
-            continue
+    label = [-1] * n  # idx -> group_idx
+    stamp = [0] * n
+    clock = 0
 
-        # one in group -> try to add other if group not full
-        if gi is not None and gj is None:
-            g = groups[gi]
-            if len(g) < group_size:
-                g.add(j)
-                member_to_group[j] = gi
-            else:
-                # group full: randomly evict one member and replace if beneficial
-                if g:
-                    li = random.choice(list(g))
-                    sum_j = sum(mat[j, y] for y in g)
-                    sum_li = sum(mat[li, y] for y in g if y != li)
-                    if sum_j > sum_li:
-                        if li in g:
-                            g.remove(li)
-                        if li in member_to_group:
-                            del member_to_group[li]
-                        g.add(j)
-                        member_to_group[j] = gi
-            continue
+    def assign(x, g):
+        nonlocal clock
+        if label[x] < 0:
+            stamp[x] = clock
+            clock += 1
+        label[x] = g
 
-        if gj is not None and gi is None:
-            g = groups[gj]
-            if len(g) < group_size:
-                g.add(i)
-                member_to_group[i] = gj
-            else:
-                if g:
-                    lj = random.choice(list(g))
-                    sum_i = sum(mat[i, y] for y in g)
-                    sum_lj = sum(mat[lj, y] for y in g if y != lj)
-                    if sum_i > sum_lj:
-                        if lj in g:
-                            g.remove(lj)
-                        if lj in member_to_group:
-                            del member_to_group[lj]
-                        g.add(i)
-                        member_to_group[i] = gj
-            continue
+    def replace_if_better(g, x, gidx):
+        # group full: randomly pick a member and replace it with x if x fits the group better
+        li = rng.choice(list(g))
+        sum_x = sum(score(x, y) for y in g)
+        sum_li = sum(score(li, y) for y in g if y != li)
+        if sum_x > sum_li + tol:
+            g.discard(li)
+            label[li] = -1
+            g.add(x)
+            assign(x, gidx)
 
-        # both in groups
-        if gi == gj:
-            # already same group; maybe need to expand if group not full
-            g = groups[gi]
-            if len(g) < group_size:
-                # nothing to add
-                pass
-            continue
-        # conflict: i in group A, j in group B
-        A = groups[gi]
-        B = groups[gj]
-        # if combined size <= group_size, merge
-        if len(A) + len(B) <= group_size:
-            # merge B into A
-            A.update(B)
-            for member in B:
-                member_to_group[member] = gi
-            # mark B as empty
-            groups[gj] = set()
-            continue
+    for chunk_i, chunk_j in _pair_order(mat):
+        for i, j in zip(chunk_i, chunk_j):
+            gi = label[i]
+            gj = label[j]
+
+            # neither in group -> make new group with i,j
+            if gi < 0 and gj < 0:
+                groups.append({i, j})
+                assign(i, len(groups) - 1)
+                assign(j, len(groups) - 1)
+                continue
 
-        # else need to evict randomly from one of the groups to accommodate
-        # randomly choose which group to evict from
-        evict_from_A = random.choice([True, False])
-        if evict_from_A:
-            if A:
-                la = random.choice(list(A))
-                if la in A:
-                    A.remove(la)
-                if la in member_to_group:
-                    del member_to_group[la]
-            # try to add j to A if space
-            if len(A) < group_size:
-                A.add(j)
-                member_to_group[j] = gi
+            # one in group -> add the other if the group is not full, else maybe replace a member
+            if gj < 0:
+                g = groups[gi]
+                if len(g) < group_size:
+                    g.add(j)
+                    assign(j, gi)
+                elif g:
+                    replace_if_better(g, j, gi)
+                continue
+            if gi < 0:
+                g = groups[gj]
+                if len(g) < group_size:
+                    g.add(i)
+                    assign(i, gj)
+                elif g:
+                    replace_if_better(g, i, gj)
+                continue
+
+            # both in groups: already together
+            if gi == gj:
+                continue
+            # conflict: i in group A, j in group B
+            A = groups[gi]
+            B = groups[gj]
+            # if combined size <= group_size, merge B into A
+            if len(A) + len(B) <= group_size:
+                A.update(B)
+                for member in B:
+                    assign(member, gi)
+                groups[gj] = set()
+                continue
+
+            # else evict a random member from one group, then move j to A (leaving B)
+            # or i to B (leaving A), whichever has room
+            if rng.choice([True, False]):
+                if A:
+                    la = rng.choice(list(A))
+                    A.discard(la)
+                    label[la] = -1
+                if len(A) < group_size:
+                    B.discard(j)
+                    A.add(j)
+                    assign(j, gi)
+                elif len(B) < group_size:
+                    A.discard(i)
+                    B.add(i)
+                    assign(i, gj)
             else:
-                # otherwise try to add i to B
+                if B:
+                    lb = rng.choice(list(B))
+                    B.discard(lb)
+                    label[lb] = -1
                 if len(B) < group_size:
+                    A.discard(i)
                     B.add(i)
-                    member_to_group[i] = gj
-        else:
-            if B:
-                lb = random.choice(list(B))
-                if lb in B:
-                    B.remove(lb)
-                if lb in member_to_group:
-                    del member_to_group[lb]
-            if len(B) < group_size:
-                B.add(i)
-                member_to_group[i] = gj
-            else:
-                if len(A) < group_size:
+                    assign(i, gj)
+                elif len(A) < group_size:
+                    B.discard(j)
                     A.add(j)
-                    member_to_group[j] = gi
+                    assign(j, gi)
 
-    # finalize: rebuild groups from authoritative member_to_group mapping
-    # This guarantees each person ends up in exactly one group (and only one).
+    # finalize from the labels: groups in order of their earliest-assigned member, members sorted,
+    # split if one ever exceeds group_size
     grouped = {}
-    for member_idx, gidx in member_to_group.items():
-        grouped.setdefault(gidx, []).append(member_idx)
-
+    for x in sorted((x for x in range(n) if label[x] >= 0), key=stamp.__getitem__):
+        grouped.setdefault(label[x], []).append(x)
     result = []
-    # convert each gathered group, splitting if it exceeds group_size
     for members in grouped.values():
         members_sorted = sorted(members)
         for k in range(0, len(members_sorted), group_size):
-            chunk = members_sorted[k:k + group_size]
-            result.append([ids[x] for x in chunk])
+            result.append([ids[x] for x in members_sorted[k:k + group_size]])
 
-    # collect any indices not present in member_to_group (unassigned) and pack them
-    assigned = set(member_to_group.keys())
-    unassigned_idxs = [i for i in range(n) if i not in assigned]
+    # collect any indices not in a group (unassigned) and pack them
+    unassigned_idxs = [x for x in range(n) if label[x] < 0]
     for k in range(0, len(unassigned_idxs), group_size):
         chunk = unassigned_idxs[k:k + group_size]
         result.append([ids[x] for x in chunk])
@@ -192,7 +482,41 @@ def greedy_grouping(ids, mat, group_size=4):
     return result
 
 
-def force_grouping_exact(ids, mat, group_size=4, max_iters=10_000_000):
+def _rows(mat, start: int, stop: int):
+    """Dense float rows start..stop-1 of any supported matrix (ndarray, memmap, CondensedMatrix)."""
+    if isinstance(mat, CondensedMatrix):
+        return np.stack([mat.row(i) for i in range(start, stop)]).astype(float)
+    return np.array(mat[start:stop], dtype=float)
+
+
+def row_sums(mat, block_rows: int = 256):
+    """
+    Each person's total similarity to everyone else (diagonal excluded).
+
+    Summed sequentially along each row (`np.cumsum`), so the totals are
+    bit-identical to a Python `sum(mat[i, j] for j != i)`; rows are read in
+    blocks, which keeps memmapped matrices paged in one block at a time.
+    """
+    if isinstance(mat, TopKIndex):
+        return np.asarray(mat.row_sums, dtype=float)
+    n = len(mat)
+    totals = np.zeros(n, dtype=float)
+    for start in range(0, n, block_rows):
+        stop = min(n, start + block_rows)
+        block = _rows(mat, start, stop)
+        block[np.arange(stop - start), np.arange(start, stop)] = 0.0
+        totals[start:stop] = np.cumsum(block, axis=1)[:, -1]
+    return totals
+
+
+def _preferences(mat, i: int):
+    """Everyone ordered by similarity to i, best first, ties by index (a stable descending sort)."""
+    if isinstance(mat, TopKIndex):
+        return mat.neighbors[i]
+    return np.argsort(-_tie_key(_rows(mat, i, i + 1)[0], _tie_decimals(mat)), kind='stable')
+
+
+def force_grouping_exact(ids, mat, group_size=4, max_iters=10_000_000, seed=None):
     """
     Force groups of exactly `group_size` by repeatedly picking a seed person
     and greedily filling their group with highest-similarity unassigned people.
@@ -200,56 +524,64 @@ def force_grouping_exact(ids, mat, group_size=4, max_iters=10_000_000):
     The process repeats until all people are assigned or `max_iters` is reached.
     Returns a list of groups (each list of ids). If total number of people is not
     divisible by `group_size`, the final group may be smaller.
+
+    Seeds are taken in descending total-similarity order (ties: smaller
+    index first; reduced-precision storage compares `_tie_key`s) from one
+    presorted array; assignment is a boolean mask and each seed's
+    preference list is argsorted only when it is used, then walked with a
+    pointer that skips assigned people.
+
+    The result is fully deterministic; `seed` is accepted (and unused) so
+    every grouping entry point has the same signature.
     """
     n = len(ids)
     if n == 0:
         return []
 
-    # precompute preference lists for each person
-    # Precompute preference lists (rank other indices by similarity). Sorting uses Python lists.
-    prefs = [None] * n
-    for i in range(n):
-        others = list(range(n))
-        others.remove(i)
-        others.sort(key=lambda j: mat[i, j], reverse=True)
-        prefs[i] = others
-
-    unassigned = set(range(n))
+    # seed order: highest total similarity first; lexsort's last key is the primary key
+    total_sim = row_sums(mat)
+    seed_order = np.lexsort((np.arange(n), -_tie_key(total_sim, _tie_decimals(mat))))
+    assigned = np.zeros(n, dtype=bool)
+    remaining = n
+    seed_ptr = 0  # position in seed_order; everything before it is assigned
+    fill_ptr = 0  # smallest index that may still be unassigned
     groups = []
     iters = 0
 
-    # pick seed by total similarity to others (descending)
-    # compute aggregate similarity per person to use as seed selection heuristic
-    total_sim = [sum(mat[i, j] for j in range(n) if j != i) for i in range(n)]
-
-    while unassigned and iters < max_iters:
+    while remaining and iters < max_iters:
         iters += 1
-        # choose highest-total-sim unassigned as seed
-        seed = max(unassigned, key=lambda x: total_sim[x])
-        unassigned.remove(seed)
+        while assigned[seed_order[seed_ptr]]:
+            seed_ptr += 1
+        seed = int(seed_order[seed_ptr])
+        assigned[seed] = True
+        remaining -= 1
         group_idxs = [seed]
 
-        # pick top preferences that are still unassigned
-        for cand in prefs[seed]:
-            if cand in unassigned:
-                group_idxs.append(cand)
-                unassigned.remove(cand)
-                if len(group_idxs) >= group_size:
-                    break
+        # pick top preferences that are still unassigned, scanning the argsorted row in chunks
+        if remaining:
+            prefs = _preferences(mat, seed)
+            pos = 0
+            while len(group_idxs) < group_size and pos < len(prefs):
+                chunk = prefs[pos:pos + 4 * group_size]
+                pos += len(chunk)
+                free = chunk[~assigned[chunk]][:group_size - len(group_idxs)]
+                assigned[free] = True
+                group_idxs.extend(free.tolist())
+            remaining -= len(group_idxs) - 1
 
         # if still short, fill with smallest-index unassigned (deterministic)
-        if len(group_idxs) < group_size and unassigned:
-            for cand in sorted(unassigned):
-                group_idxs.append(cand)
-                unassigned.remove(cand)
-                if len(group_idxs) >= group_size:
-                    break
+        while len(group_idxs) < group_size and remaining:
+            while assigned[fill_ptr]:
+                fill_ptr += 1
+            assigned[fill_ptr] = True
+            remaining -= 1
+            group_idxs.append(fill_ptr)
 
         groups.append([ids[i] for i in group_idxs])
 
     # if we stopped due to max_iters but still have unassigned, pack the rest
-    if unassigned:
-        rem = sorted(unassigned)
+    if remaining:
+        rem = np.flatnonzero(~assigned).tolist()
         for k in range(0, len(rem), group_size):
             chunk = rem[k:k + group_size]
             groups.append([ids[i] for i in chunk])
@@ -257,14 +589,512 @@ def force_grouping_exact(ids, mat, group_size=4, max_iters=10_000_000):
     return groups
 
 
+def _gather_rows(mat, idx):
+    """Dense float rows for an index array (ndarray, memmap or CondensedMatrix)."""
+    if isinstance(mat, TopKIndex):
+        raise TypeError('local search needs full rows; build a dense or condensed matrix instead of --topk')
+    if isinstance(mat, CondensedMatrix):
+        return np.stack([mat.row(int(i)) for i in idx]).astype(float)
+    return np.array(mat[np.asarray(idx)], dtype=float)
+
+
+def grouping_objective(ids, mat, groups):
+    """Total intra-group similarity: the sum of mat[i, j] over all pairs i < j inside each group."""
+    pos = {x: k for k, x in enumerate(ids)}
+    total = 0.0
+    for g in groups:
+        idx = np.array([pos[x] for x in g], dtype=np.int64)
+        if len(idx) > 1:
+            block = _gather_rows(mat, idx)[:, idx]
+            total += float(np.triu(block, 1).sum())
+    return total
+
+
+def _swap_deltas(rows, A, own, label, n_groups: int):
+    """
+    Objective change of swapping each member a of group A (`rows` = their
+    matrix rows) with every person b, shape (|A|, n):
+        delta = S(b, A) - S(a, A) + S(a, B) - S(b, B) - 2 * mat[a, b]
+    where `own` holds S(x, own group) for everyone.
+    """
+    cross_a = rows.sum(axis=0)  # S(b, A) for every b
+    # S(a, G) for each member a of A and every group G; people in no group (label -1) get bin 0
+    by_group = np.stack([np.bincount(label + 1, weights=r, minlength=n_groups + 1) for r in rows])
+    return cross_a[None, :] - own[A][:, None] + by_group[:, label + 1] - own[None, :] - 2 * rows
+
+
+def _apply_swap(members, label, own, a: int, b: int, row_a, row_b):
+    """Exchange a and b (in different groups) in place, updating both groups' running sums in O(group_size)."""
+    ga, gb = int(label[a]), int(label[b])
+    A, B = members[ga], members[gb]
+    # members of A lose a and gain b, members of B the reverse
+    rest_a = A[A != a]
+    rest_b = B[B != b]
+    own[rest_a] += row_b[rest_a] - row_a[rest_a]
+    own[rest_b] += row_a[rest_b] - row_b[rest_b]
+    own[b] = row_b[rest_a].sum()
+    own[a] = row_a[rest_b].sum()
+    A[A == a] = b
+    B[B == b] = a
+    label[a], label[b] = gb, ga
+    return ga, gb
+
+
+def improve_grouping(ids, mat, groups, time_budget=5.0, max_rounds=100, tol=1e-9):
+    """
+    Local search after a greedy pass: swap members between groups while it
+    raises the total intra-group similarity (`grouping_objective`).
+
+    Every person keeps a running sum of their similarity to their own group.
+    For a group A, one gather of A's rows scores every possible swap
+    (a in A, b elsewhere) at once:
+        delta = S(b, A) - S(a, A) + S(a, B) - S(b, B) - 2 * mat[a, b]
+    and the best improving swap is applied; the running sums of the two
+    groups are then updated in O(group_size). Group sizes never change;
+    people missing from `groups` stay out of every group.
+
+    Stops after a full round without improvement (converged), after
+    `max_rounds`, or when `time_budget` seconds are used up. Assumes a
+    symmetric matrix. Returns (groups, report) where report holds the
+    initial/final objective, swaps, rounds, seconds and `converged`.
+    """
+    t0 = time.perf_counter()
+    n = len(ids)
+    pos = {x: k for k, x in enumerate(ids)}
+    members = [np.array([pos[x] for x in g], dtype=np.int64) for g in groups]
+    label = np.full(n, -1, dtype=np.int64)
+    for g, m in enumerate(members):
+        label[m] = g
+    n_groups = len(members)
+
+    # own[x]: similarity of x to the other members of x's group
+    own = np.zeros(n, dtype=float)
+    for m in members:
+        if len(m):
+            block = _gather_rows(mat, m)[:, m]
+            own[m] = block.sum(axis=1) - np.diagonal(block)
+    initial = float(own.sum() / 2)
+
+    swaps = 0
+    rounds = 0
+    converged = False
+    out_of_time = False
+    while rounds < max_rounds and not out_of_time:
+        rounds += 1
+        improved = False
+        for ga in range(n_groups):
+            A = members[ga]
+            if not len(A):
+                continue
+            rows = _gather_rows(mat, A)  # (|A|, n)
+            delta = _swap_deltas(rows, A, own, label, n_groups)
+            delta[:, label == ga] = -np.inf
+            delta[:, label < 0] = -np.inf  # people not in any group
+            flat = int(np.argmax(delta))
+            i, b = divmod(flat, n)
+            if delta[i, b] > tol:
+                _apply_swap(members, label, own, int(A[i]), b, rows[i], _gather_rows(mat, [b])[0])
+                swaps += 1
+                improved = True
+            if time.perf_counter() - t0 > time_budget:
+                out_of_time = True
+                break
+        if not improved and not out_of_time:
+            converged = True
+            break
+
+    result = [[ids[x] for x in m] for m in members]
+    report = {
+        'initial': initial,
+        'final': float(own.sum() / 2),
+        'swaps': swaps,
+        'rounds': rounds,
+        'seconds': time.perf_counter() - t0,
+        'converged': converged,
+    }
+    return result, report
+
+
+def group_sizes(n: int, group_size: int = 4):
+    """
+    Exact sizes for splitting n people into ceil(n / group_size) groups that
+    differ by at most one (10 people, size 4 -> [4, 3, 3]) instead of leaving
+    one undersized remainder group.
+    """
+    if n == 0:
+        return []
+    k = -(-n // group_size)
+    base, extra = divmod(n, k)
+    return [base + 1] * extra + [base] * (k - extra)
+
+
+class SpreadConstraint:
+    """
+    At most `max_per_group` members of a group may share a label, e.g. the
+    q8 role, so roles are balanced across groups. Every member over the limit
+    counts as one violation.
+    """
+
+    def __init__(self, labels, max_per_group: int = 1):
+        _, self.labels = np.unique(np.asarray(labels), return_inverse=True)
+        self.n_labels = int(self.labels.max()) + 1 if len(self.labels) else 1
+        self.max_per_group = max_per_group
+
+    def penalty(self, counts):
+        """Violations of groups with label `counts` (last axis = label)."""
+        return np.maximum(counts - self.max_per_group, 0).sum(axis=-1)
+
+
+class TogetherConstraint:
+    """
+    People flagged True, e.g. q5 "already have a team", are grouped only with
+    each other. A group's violations are its minority side: min(flagged, others).
+    """
+
+    def __init__(self, flags):
+        self.labels = np.asarray(flags, dtype=bool).astype(np.int64)
+        self.n_labels = 2
+
+    def penalty(self, counts):
+        return np.minimum(counts[..., 0], counts[..., 1])
+
+
+def constraints_from_traits(traits, ids, together=(), spread=()):
+    """
+    Build constraints from trait columns, aligned to the matrix `ids`.
+
+    `together` entries are 'COLUMN=VALUE' (people whose value matches stay
+    together); `spread` entries are 'COLUMN' or 'COLUMN:MAX' (at most MAX,
+    default 1, members per group share a value).
+    """
+    import make_matrix
+    pos = {x: k for k, x in enumerate(make_matrix.matrix_ids(traits))}
+    order = np.array([pos[x] for x in ids], dtype=np.int64)
+    constraints = []
+    for spec in together:
+        column, _, value = spec.partition('=')
+        values = traits[column].astype(str).to_numpy()[order]
+        constraints.append(TogetherConstraint(values == value))
+    for spec in spread:
+        column, _, limit = spec.partition(':')
+        values = traits[column].astype(str).to_numpy()[order]
+        constraints.append(SpreadConstraint(values, max_per_group=int(limit or 1)))
+    return constraints
+
+
+def _max_abs(mat, block_rows: int = 256):
+    """
+    Largest |score| in the matrix (bounds how much one swap can change the objective).
+
+    Dense and memmapped matrices are scanned in row blocks, taking each
+    block's min and max, so no n x n `abs` temporary is made.
+    """
+    if isinstance(mat, TopKIndex):
+        raise TypeError('the constrained solver needs full rows; build a dense or condensed matrix instead of --topk')
+    if isinstance(mat, (CondensedMatrix, QuantizedMatrix)):
+        values = np.asarray(mat.values)
+        if not values.size:
+            return abs(float(getattr(mat, 'diagonal', 0.0)))
+        # decoding is monotonic, so the extremes of the stored values bound the scores
+        if isinstance(mat, QuantizedMatrix) or mat.scale is not None:
+            ends = np.array([values.min(), values.max()], dtype=float) * mat.scale + mat.offset
+        else:
+            ends = np.array([values.min(), values.max()], dtype=float)
+        return max(float(np.abs(ends).max()), abs(float(getattr(mat, 'diagonal', 0.0))))
+    largest = 0.0
+    for start in range(0, len(mat), block_rows):
+        block = np.asarray(mat[start:start + block_rows])
+        if block.size:
+            largest = max(largest, abs(float(block.min())), abs(float(block.max())))
+    return largest
+
+
+class _Partition:
+    """Group labels, members and per-constraint label counts of one grouping, updated per swap."""
+
+    def __init__(self, mat, members, constraints):
+        self.members = [np.asarray(m, dtype=np.int64) for m in members]
+        n = sum(len(m) for m in self.members)
+        self.label = np.empty(n, dtype=np.int64)
+        for g, m in enumerate(self.members):
+            self.label[m] = g
+        self.constraints = constraints
+        self.counts = [np.zeros((len(self.members), c.n_labels), dtype=np.int64) for c in constraints]
+        for c, counts in zip(constraints, self.counts):
+            np.add.at(counts, (self.label, c.labels), 1)
+        # own[x]: similarity of x to the other members of x's group
+        self.own = np.zeros(n, dtype=float)
+        for m in self.members:
+            block = _gather_rows(mat, m)[:, m]
+            self.own[m] = block.sum(axis=1) - np.diagonal(block)
+
+    def objective(self):
+        return float(self.own.sum() / 2)
+
+    def violations(self):
+        return int(sum(c.penalty(counts).sum() for c, counts in zip(self.constraints, self.counts)))
+
+    def penalty_delta(self, ga: int, A):
+        """Change in violations for swapping each member of group `ga` with every person: shape (|A|, n)."""
+        total = np.zeros((len(A), len(self.label)))
+        for c, counts in zip(self.constraints, self.counts):
+            eye = np.eye(c.n_labels, dtype=np.int64)
+            la = c.labels[A]
+            # group A loses a's label and gains b's
+            CA = counts[ga]
+            table_a = c.penalty(CA[None, None, :] - eye[la][:, None, :] + eye[None, :, :]) - c.penalty(CA)
+            total += table_a[:, c.labels]
+            # b's group loses b's label and gains a's
+            CB = counts[self.label]
+            CB_minus = CB - eye[c.labels]
+            table_b = c.penalty(CB_minus[None, :, :] + eye[:, None, :]) - c.penalty(CB)[None, :]
+            total += table_b[la]
+        return total
+
+    def swap(self, mat, a: int, b: int, row_a=None, row_b=None):
+        """Exchange a and b (in different groups), updating running sums and counts."""
+        row_a = _gather_rows(mat, [a])[0] if row_a is None else row_a
+        row_b = _gather_rows(mat, [b])[0] if row_b is None else row_b
+        ga, gb = _apply_swap(self.members, self.label, self.own, a, b, row_a, row_b)
+        for c, counts in zip(self.constraints, self.counts):
+            counts[ga, c.labels[a]] -= 1
+            counts[ga, c.labels[b]] += 1
+            counts[gb, c.labels[b]] -= 1
+            counts[gb, c.labels[a]] += 1
+
+
+def _construct(mat, sizes, constraints, weight):
+    """
+    Constraint-aware greedy start: each group is seeded with the unassigned
+    person of highest total similarity and filled, up to its exact size, with
+    whoever adds the most similarity minus `weight` per new violation.
+    """
+    n = sum(sizes)
+    total_sim = row_sums(mat)
+    seed_order = np.lexsort((np.arange(n), -_tie_key(total_sim, _tie_decimals(mat))))
+    assigned = np.zeros(n, dtype=bool)
+    seed_ptr = 0
+    members = []
+    for size in sizes:
+        while assigned[seed_order[seed_ptr]]:
+            seed_ptr += 1
+        group = [int(seed_order[seed_ptr])]
+        assigned[group[0]] = True
+        gain = _gather_rows(mat, group)[0]
+        counts = [np.bincount(c.labels[group], minlength=c.n_labels) for c in constraints]
+        while len(group) < size:
+            score = gain.copy()
+            for c, cnt in zip(constraints, counts):
+                added = c.penalty(cnt[None, :] + np.eye(c.n_labels, dtype=np.int64)) - c.penalty(cnt)
+                score -= weight * added[c.labels]
+            score[assigned] = -np.inf
+            x = int(np.argmax(score))
+            group.append(x)
+            assigned[x] = True
+            gain += _gather_rows(mat, [x])[0]
+            for c, cnt in zip(constraints, counts):
+                cnt[c.labels[x]] += 1
+        members.append(group)
+    return members
+
+
+def solve_constrained(ids, mat, group_size=4, constraints=(), time_limit=5.0, seed=None, sizes=None,
+                      max_rounds=1000, tol=1e-9):
+    """
+    Partition into groups of exact sizes under pluggable hard constraints.
+
+    `sizes` defaults to `group_sizes(n, group_size)`. A constraint is any
+    object with per-person integer `labels`, `n_labels` and a vectorized
+    `penalty(counts)` giving a group's violations from its label counts
+    (see `SpreadConstraint`, `TogetherConstraint`).
+
+    Violations are weighted above any similarity a swap can gain, so the
+    search is lexicographic: fewer violations first, then higher total
+    intra-group similarity. A constraint-aware greedy start is improved by
+    best-swap local search (the `improve_grouping` move, penalty aware);
+    whenever it converges before `time_limit` seconds it is kicked with a
+    few random swaps (`seed`) and searched again, keeping the best grouping.
+
+    Returns (groups, report) with the best grouping's `objective`
+    (`grouping_objective`), `violations`, `feasible` (no violations),
+    `swaps`, `restarts` and `seconds`.
+    """
+    t0 = time.perf_counter()
+    rng = make_rng(seed)
+    constraints = list(constraints)
+    n = len(ids)
+    sizes = list(sizes) if sizes is not None else group_sizes(n, group_size)
+    if sum(sizes) != n:
+        raise ValueError(f'group sizes add up to {sum(sizes)}, not {n} people')
+    if n == 0:
+        return [], {'objective': 0.0, 'violations': 0, 'feasible': True, 'swaps': 0, 'restarts': 0,
+                    'seconds': 0.0}
+    # one violation outweighs the largest similarity change any swap can make
+    weight = 4 * max(sizes) * _max_abs(mat) + 1.0
+
+    state = _Partition(mat, _construct(mat, sizes, constraints, weight), constraints)
+    best = ([m.copy() for m in state.members], state.violations(), state.objective())
+    n_groups = len(sizes)
+    swaps = restarts = rounds = 0
+    out_of_time = n_groups < 2
+    while not out_of_time and rounds < max_rounds:
+        rounds += 1
+        improved = False
+        for ga in range(n_groups):
+            A = state.members[ga]
+            rows = _gather_rows(mat, A)
+            delta = _swap_deltas(rows, A, state.own, state.label, n_groups)
+            if constraints:
+                delta -= weight * state.penalty_delta(ga, A)
+            delta[:, state.label == ga] = -np.inf
+            i, b = divmod(int(np.argmax(delta)), n)
+            if delta[i, b] > tol:
+                state.swap(mat, int(A[i]), b, row_a=rows[i])
+                swaps += 1
+                improved = True
+            if time.perf_counter() - t0 > time_limit:
+                out_of_time = True
+                break
+        if improved:
+            continue
+        # local optimum: keep it if it is the best so far, then kick and search again
+        violations, objective = state.violations(), state.objective()
+        if (violations, -objective) < (best[1], -best[2]):
+            best = ([m.copy() for m in state.members], violations, objective)
+        if out_of_time:
+            break
+        members = [m.copy() for m in best[0]]
+        for _ in range(max(1, n_groups // 10)):
+            ga, gb = rng.sample(range(n_groups), 2)
+            ia, ib = rng.randrange(len(members[ga])), rng.randrange(len(members[gb]))
+            members[ga][ia], members[gb][ib] = members[gb][ib], members[ga][ia]
+        state = _Partition(mat, members, constraints)
+        restarts += 1
+    violations, objective = state.violations(), state.objective()
+    if (violations, -objective) < (best[1], -best[2]):
+        best = ([m.copy() for m in state.members], violations, objective)
+
+    groups = [[ids[x] for x in m] for m in best[0]]
+    report = {
+        'objective': grouping_objective(ids, mat, groups),
+        'violations': best[1],
+        'feasible': best[1] == 0,
+        'swaps': swaps,
+        'restarts': restarts,
+        'seconds': time.perf_counter() - t0,
+    }
+    return groups, report
+
+
+def constrained_grouping(ids, mat, group_size=4, seed=None, constraints=(), time_limit=5.0):
+    """`solve_constrained` with the common grouping signature; returns only the groups."""
+    groups, _ = solve_constrained(ids, mat, group_size=group_size, constraints=constraints,
+                                  time_limit=time_limit, seed=seed)
+    return groups
+
+
+# grouping entry points selectable by name (e.g. for multi-restart runs)
+ALGORITHMS = {
+    'greedy': greedy_grouping,
+    'force_exact': force_grouping_exact,
+    'constrained': constrained_grouping,
+}
+# entry points that stop on a wall-clock limit, so a seed alone does not reproduce their result
+TIME_BOUNDED = {'constrained'}
+# entry points that read full matrix rows and so cannot run on a `TopKIndex`
+FULL_ROWS = {'constrained'}
+
+# per-worker state for `best_of_restarts`, set once by `_init_restart_worker`
+_RESTART = {}
+
+
+def _init_restart_worker(ids, mat, algorithm, group_size):
+    _RESTART.update(ids=ids, mat=mat, algorithm=algorithm, group_size=group_size)
+
+
+def _restart_attempt(seed, state=None):
+    state = _RESTART if state is None else state
+    ids, mat = state['ids'], state['mat']
+    groups = ALGORITHMS[state['algorithm']](ids, mat, group_size=state['group_size'], seed=seed)
+    return grouping_objective(ids, mat, groups), groups
+
+
+def best_of_restarts(ids, mat, restarts=8, seed=0, workers=1, algorithm='greedy', group_size=4):
+    """
+    Multi-restart mode: run `restarts` seeded attempts of a grouping algorithm
+    and keep the partition with the highest `grouping_objective`.
+
+    Attempt k uses the k-th seed drawn from `random.Random(seed)`, and ties
+    go to the earliest attempt, so the result depends only on `seed` and
+    `restarts`, not on `workers`. With workers > 1 the attempts run in a
+    process pool (the matrix is sent once per worker).
+
+    Returns (groups, objective, scores) where `scores` lists every attempt's objective.
+    """
+    master = make_rng(seed)
+    seeds = [master.getrandbits(64) for _ in range(restarts)]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or restarts <= 1:
+        state = dict(ids=ids, mat=mat, algorithm=algorithm, group_size=group_size)
+        results = [_restart_attempt(sd, state) for sd in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, restarts), initializer=_init_restart_worker,
+                                 initargs=(ids, mat, algorithm, group_size)) as pool:
+            results = list(pool.map(_restart_attempt, seeds))
+    scores = [score for score, _ in results]
+    best = max(range(len(results)), key=lambda k: (scores[k], -k))
+    return results[best][1], scores[best], scores
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Divide people into groups from the similarity matrix')
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='force_exact')
+    parser.add_argument('--seed', type=int, default=None, help='seed for reproducible runs')
+    parser.add_argument('--restarts', type=int, default=1,
+                        help='run this many seeded attempts and keep the best-scoring partition')
+    parser.add_argument('--workers', type=int, default=1, help='processes for --restarts (0 = one per CPU)')
+    parser.add_argument('--improve', type=float, default=0.0, metavar='SECONDS',
+                        help='run the swap local search for up to SECONDS after the greedy pass')
+    parser.add_argument('--time-limit', type=float, default=5.0, metavar='SECONDS',
+                        help='search time for --algorithm constrained')
+    parser.add_argument('--together', action='append', default=[], metavar='COLUMN=VALUE',
+                        help='constrained: people with this trait value are grouped only with each other')
+    parser.add_argument('--spread', action='append', default=[], metavar='COLUMN[:MAX]',
+                        help='constrained: at most MAX (default 1) members per group share this trait')
+    parser.add_argument('--traits', default='trait.csv', help='trait table for --together / --spread')
+    args = parser.parse_args()
+
     base = Path(__file__).resolve().parent
-    # use the canonical matrix file `matrix.csv` only
-    mat_path = base.joinpath('matrix.csv')
-    if not mat_path.exists():
-        raise FileNotFoundError('matrix.csv not found - run make.py first')
-    ids, mat = load_matrix(mat_path)
-    groups = force_grouping_exact(ids, mat, group_size=4, max_iters=10_000_000)
+    mat_path = find_matrix(base)
+    with instrument.stage('divide_groups.load_matrix') as st:
+        ids, mat = load_matrix(mat_path)
+        st.add(rows=len(ids))
+    if args.algorithm == 'constrained':
+        constraints = []
+        if args.together or args.spread:
+            import make_matrix
+            traits = make_matrix.load_traits(make_matrix.trait_source(base.joinpath(args.traits)))
+            constraints = constraints_from_traits(traits, ids, together=args.together, spread=args.spread)
+        with instrument.stage('divide_groups.constrained', rows=len(ids)):
+            groups, report = solve_constrained(ids, mat, group_size=4, constraints=constraints,
+                                               time_limit=args.time_limit, seed=args.seed)
+        print(f"Constrained: objective {report['objective']:.3f}, {report['violations']} violations "
+              f"(feasible={report['feasible']}), {report['swaps']} swaps, {report['restarts']} restarts, "
+              f"{report['seconds']:.2f}s")
+    elif args.restarts > 1:
+        with instrument.stage('divide_groups.restarts', rows=len(ids) * args.restarts):
+            groups, objective, scores = best_of_restarts(ids, mat, restarts=args.restarts, seed=args.seed or 0,
+                                                         workers=args.workers, algorithm=args.algorithm)
+        print(f'Best of {args.restarts} restarts: {objective:.3f} (worst {min(scores):.3f})')
+    else:
+        with instrument.stage(f'divide_groups.{args.algorithm}', rows=len(ids)):
+            groups = ALGORITHMS[args.algorithm](ids, mat, group_size=4, seed=args.seed)
+    if args.improve > 0:
+        with instrument.stage('divide_groups.improve', rows=len(ids)):
+            groups, report = improve_grouping(ids, mat, groups, time_budget=args.improve)
+        print(f"Local search: {report['initial']:.3f} -> {report['final']:.3f} "
+              f"({report['swaps']} swaps, {report['rounds']} rounds, {report['seconds']:.2f}s, "
+              f"converged={report['converged']})")
     for gi, g in enumerate(groups, start=1):
         print(f'Group {gi}:', g)
 
@@ -0,0 +1,169 @@
+import argparse
+import csv
+import json
+import time
+from pathlib import Path
+import numpy as np
+import divide_groups
+from divide_groups import CondensedMatrix, TopKIndex
+
+
+def read_groups(path: Path):
+    """Read a groups.csv (columns group, id as written by `pipeline.write_groups`) into lists of ids."""
+    groups = {}
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            groups.setdefault(row['group'], []).append(row['id'])
+    return list(groups.values())
+
+
+def pair_scores(mat, i, j):
+    """
+    Scores of the pairs (i[k], j[k]) for index arrays from any matrix form:
+    dense array or memmap (one fancy-index gather), `CondensedMatrix` or
+    `TopKIndex`. Returns (scores, unknown) where `unknown` marks pairs a
+    top-K index does not hold; those score the index's `fill` value.
+    """
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    unknown = np.zeros(i.shape, dtype=bool)
+    if isinstance(mat, CondensedMatrix):
+        return mat.pair(i, j).astype(float), unknown
+    if isinstance(mat, TopKIndex):
+        scores = np.full(i.shape, np.nan)
+        # look j up among i's neighbors, then i among j's
+        for a, b in ((i, j), (j, i)):
+            hit = mat.neighbors[a] == b[..., None]
+            found = hit.any(axis=-1) & np.isnan(scores)
+            scores[found] = np.where(hit, mat.scores[a], 0.0).sum(axis=-1)[found]
+        unknown = np.isnan(scores) & (i != j)
+        scores[unknown] = mat.fill
+        scores[i == j] = 1.0
+        return scores, unknown
+    return np.asarray(mat[i, j], dtype=float), unknown
+
+
+def group_scores(ids, mat, groups, chunk: int = 4096):
+    """
+    Intra-group similarity of every group (sum over its pairs i < j) and the
+    number of pairs the matrix did not hold (top-K only).
+
+    Groups are padded into a (groups, largest size) index array and all of
+    their pairs are gathered at once, `chunk` groups at a time.
+    """
+    pos = {x: k for k, x in enumerate(ids)}
+    totals = np.zeros(len(groups))
+    unknown = 0
+    width = max((len(g) for g in groups), default=0)
+    a, b = np.triu_indices(width, 1)
+    for start in range(0, len(groups), chunk):
+        part = groups[start:start + chunk]
+        idx = np.full((len(part), width), -1, dtype=np.int64)
+        for r, g in enumerate(part):
+            idx[r, :len(g)] = [pos[x] for x in g]
+        I, J = idx[:, a], idx[:, b]
+        valid = (I >= 0) & (J >= 0)
+        scores, missing = pair_scores(mat, I[valid], J[valid])
+        owner = np.broadcast_to(np.arange(len(part))[:, None], I.shape)[valid]
+        totals[start:start + len(part)] = np.bincount(owner, weights=scores, minlength=len(part))
+        unknown += int(missing.sum())
+    return totals, unknown
+
+
+def evaluate(ids, mat, groups):
+    """
+    Quality statistics of one partition: the objective (total intra-group
+    similarity, as `divide_groups.grouping_objective`), the spread of the
+    per-group scores (min, percentiles, mean, max, std and a 10-bin
+    histogram), the mean score per pair, group sizes, and people the
+    partition misses or lists twice.
+    """
+    scores, unknown = group_scores(ids, mat, groups)
+    sizes = np.array([len(g) for g in groups], dtype=np.int64)
+    pairs = int((sizes * (sizes - 1) // 2).sum())
+    members = [x for g in groups for x in g]
+    counts, edges = np.histogram(scores, bins=10) if len(scores) else (np.zeros(0), np.zeros(0))
+    pct = np.percentile(scores, [0, 10, 50, 90, 100]) if len(scores) else np.zeros(5)
+    return {
+        'groups': len(groups),
+        'sizes': {int(s): int(c) for s, c in zip(*np.unique(sizes, return_counts=True))},
+        'missing': len(set(ids) - set(members)),
+        'duplicates': len(members) - len(set(members)),
+        'objective': float(scores.sum()),
+        'mean_pair': float(scores.sum() / pairs) if pairs else 0.0,
+        'min': float(pct[0]),
+        'p10': float(pct[1]),
+        'median': float(pct[2]),
+        'p90': float(pct[3]),
+        'max': float(pct[4]),
+        'mean': float(scores.mean()) if len(scores) else 0.0,
+        'std': float(scores.std()) if len(scores) else 0.0,
+        'histogram': {'counts': counts.astype(int).tolist(), 'edges': edges.tolist()},
+        'unknown_pairs': unknown,
+    }
+
+
+def compare_algorithms(ids, mat, algorithms=None, group_size: int = 4, seed=0):
+    """
+    Run each `divide_groups.ALGORITHMS` entry on the same matrix; one
+    `evaluate` row (+ name, seconds) each, or {name, error} for an algorithm
+    that cannot use this matrix form (`divide_groups.FULL_ROWS` on a top-K
+    index). Errors raised by an algorithm propagate.
+    """
+    rows = []
+    for name in algorithms or sorted(divide_groups.ALGORITHMS):
+        if name in divide_groups.FULL_ROWS and isinstance(mat, TopKIndex):
+            rows.append({'name': name, 'error': 'needs full rows; build a dense or condensed matrix instead of --topk'})
+            continue
+        start = time.perf_counter()
+        groups = divide_groups.ALGORITHMS[name](ids, mat, group_size=group_size, seed=seed)
+        rows.append({'name': name, 'seconds': time.perf_counter() - start, **evaluate(ids, mat, groups)})
+    return rows
+
+
+def format_table(rows):
+    """Side-by-side text table of `evaluate` rows (best objective marked with *)."""
+    scored = [k for k, r in enumerate(rows) if 'error' not in r]
+    best = max(scored, key=lambda k: rows[k]['objective']) if scored else None
+    lines = [f"{'':<2}{'name':<16}{'seconds':>9}{'groups':>8}{'objective':>14}{'mean/pair':>11}"
+             f"{'min':>10}{'p10':>10}{'median':>10}{'max':>10}  sizes"]
+    for k, r in enumerate(rows):
+        if 'error' in r:
+            lines.append(f"{'':<2}{r['name']:<16}  skipped: {r['error']}")
+            continue
+        sizes = ' '.join(f'{s}x{c}' for s, c in sorted(r['sizes'].items()))
+        flags = ''
+        if r['missing'] or r['duplicates']:
+            flags += f"  missing {r['missing']}, duplicates {r['duplicates']}"
+        if r['unknown_pairs']:
+            flags += f"  ({r['unknown_pairs']} pairs outside the top-K index)"
+        lines.append(f"{'*' if k == best else '':<2}{r['name']:<16}{r.get('seconds', 0.0):>9.2f}{r['groups']:>8}"
+                     f"{r['objective']:>14.3f}{r['mean_pair']:>11.3f}{r['min']:>10.3f}{r['p10']:>10.3f}"
+                     f"{r['median']:>10.3f}{r['max']:>10.3f}  {sizes}{flags}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score groupings against the similarity matrix and compare algorithms')
+    parser.add_argument('--matrix', help='matrix file (default: the newest make_matrix.py output)')
+    parser.add_argument('--groups', nargs='+', metavar='CSV', help='evaluate these groups.csv files')
+    parser.add_argument('--algorithms', nargs='+', choices=sorted(divide_groups.ALGORITHMS),
+                        help='algorithms to run and compare (default: all)')
+    parser.add_argument('--group-size', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='OUT', help='also write the full statistics as JSON')
+    args = parser.parse_args()
+
+    base = Path(__file__).resolve().parent
+    mat_path = Path(args.matrix) if args.matrix else divide_groups.find_matrix(base)
+    ids, mat = divide_groups.load_matrix(mat_path)
+    print(f'{mat_path.name}: {len(ids)} people')
+    if args.groups:
+        rows = [{'name': p, **evaluate(ids, mat, read_groups(p))} for p in args.groups]
+    else:
+        rows = compare_algorithms(ids, mat, args.algorithms, group_size=args.group_size, seed=args.seed)
+    print(format_table(rows))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False, indent=1)
+        print(f'Wrote {args.json}')
@@ -0,0 +1,199 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+import calculate_pairs
+import divide_groups
+import instrument
+import make_matrix
+
+# Hierarchical grouping for large cohorts: cluster people on trait feature
+# vectors, group each cluster on its own small dense matrix (in parallel),
+# then regroup the people left in undersized groups across clusters. Work is
+# about n * cluster_size score evaluations instead of n^2.
+
+DEFAULT_CLUSTER_SIZE = 400
+
+
+def trait_features(traits, weights: dict = None):
+    """
+    One float32 row per person whose squared distances roughly follow the
+    score points two people would lose against each other: one-hot answers
+    scaled by sqrt((same - diff) / 2), length-normalized q7/q9 indicators
+    scaled by their Jaccard weight and the two numeric scores by their
+    per-difference weight. Terms that reward difference (q8) or set size
+    (q9 union) carry no similarity and are left out.
+    """
+    feats = calculate_pairs.prepare_features(traits.reset_index(drop=True), weights=weights)
+    w = feats['weights']
+    n = feats['n']
+    blocks = []
+
+    def onehot(codes, gap):
+        if gap <= 0:
+            return
+        _, inv = np.unique(np.asarray(codes), return_inverse=True)
+        block = np.zeros((n, int(inv.max()) + 1 if n else 0), dtype=np.float32)
+        block[np.arange(n), inv] = np.sqrt(gap / 2)
+        blocks.append(block)
+
+    onehot(feats['q4_code'], w['q4_both_sure'] - w['q4_other'])
+    onehot(feats['q5_code'], w['q5_both_accept'] - w['q5_other'])
+    for key in ('q6', 'q15'):
+        onehot(feats[f'{key}_code'], w[f'{key}_same'] - w[f'{key}_diff'])
+    onehot(feats['philosophy_type'], w['philosophy_type_same'] - w['philosophy_type_diff'])
+    for c in ('q12_raw', 'q13_raw', 'q14_raw'):
+        if feats[c] is not None:
+            key = c[:3]
+            onehot(feats[c][0], w[f'{key}_same'] - w[f'{key}_diff'])
+    for key in ('q7', 'q9'):
+        kind, ind, cnt = feats[key]
+        weight = w[f'{key}_jaccard_onehot' if kind == 'onehot' else f'{key}_jaccard']
+        norm = np.sqrt(np.maximum(cnt, 1)).astype(np.float32)[:, None]
+        blocks.append(ind.astype(np.float32) / norm * np.float32(np.sqrt(weight / 2)))
+    blocks.append((feats['q11_quality'] * np.sqrt(w['q11_per_diff'])).astype(np.float32)[:, None])
+    blocks.append((feats['philosophy_score'] * np.sqrt(w['philosophy_score_per_diff'])).astype(np.float32)[:, None])
+    return np.hstack(blocks)
+
+
+def cluster_people(features, cluster_size: int = DEFAULT_CLUSTER_SIZE, seed: int = 0):
+    """
+    Mini-batch k-means into about n / cluster_size clusters; clusters larger
+    than twice `cluster_size` are split again (by position if k-means cannot
+    separate them), so no cluster's dense matrix grows with n.
+
+    Returns a list of index arrays, one per non-empty cluster.
+    """
+    def split(idx, depth):
+        k = -(-len(idx) // cluster_size)
+        if k <= 1:
+            return [idx]
+        labels = MiniBatchKMeans(n_clusters=k, random_state=seed + depth, batch_size=4096,
+                                 n_init=3).fit_predict(features[idx])
+        parts = [idx[labels == c] for c in range(k) if (labels == c).any()]
+        if len(parts) == 1:
+            return [idx[s:s + cluster_size] for s in range(0, len(idx), cluster_size)]
+        out = []
+        for part in parts:
+            out.extend(split(part, depth + 1) if len(part) > 2 * cluster_size else [part])
+        return out
+
+    return split(np.arange(len(features)), 0)
+
+
+def _group_cluster(traits, algorithm: str, group_size: int, seed, weights: dict):
+    ids = make_matrix.matrix_ids(traits)
+    mat = calculate_pairs.compute_matrix(traits, weights=weights)
+    return divide_groups.ALGORITHMS[algorithm](ids, mat, group_size=group_size, seed=seed)
+
+
+def group_objective(traits, groups, weights: dict = None):
+    """`divide_groups.grouping_objective` computed from the traits, without a full matrix."""
+    traits = traits.reset_index(drop=True)
+    feats = calculate_pairs.prepare_features(traits, weights=weights)
+    pos = {x: k for k, x in enumerate(make_matrix.matrix_ids(traits))}
+    total = 0.0
+    for g in groups:
+        idx = np.array([pos[x] for x in g], dtype=np.int64)
+        if len(idx) > 1:
+            total += float(np.triu(calculate_pairs.score_rows(feats, idx, idx), 1).sum())
+    return total
+
+
+def hierarchical_grouping(traits, group_size: int = 4, algorithm: str = 'force_exact',
+                          cluster_size: int = DEFAULT_CLUSTER_SIZE, workers: int = 1, seed=None,
+                          weights: dict = None):
+    """
+    Cluster, group each cluster independently, then repair leftovers.
+
+    Each cluster is grouped with `divide_groups.ALGORITHMS[algorithm]` on
+    its own dense matrix; with workers > 1 clusters run in a process pool.
+    Cluster k gets the k-th seed drawn from `seed`, so the result does not
+    depend on `workers`. Members of groups smaller than `group_size`
+    (cluster remainders) are pooled and grouped once more together.
+
+    Returns (groups, report) with the cluster count and largest cluster,
+    the number of people repaired across clusters and the seconds spent.
+    """
+    t0 = time.perf_counter()
+    traits = traits.reset_index(drop=True)
+    with instrument.stage('hierarchical.cluster', rows=len(traits)):
+        clusters = cluster_people(trait_features(traits, weights), cluster_size=cluster_size,
+                                  seed=seed if isinstance(seed, int) else 0)
+    master = divide_groups.make_rng(seed)
+    seeds = [master.getrandbits(64) for _ in clusters]
+    jobs = [(traits.iloc[idx], algorithm, group_size, sd, weights) for idx, sd in zip(clusters, seeds)]
+    workers = workers or os.cpu_count() or 1
+    with instrument.stage('hierarchical.groups', rows=len(traits)):
+        if workers <= 1 or len(jobs) <= 1:
+            results = [_group_cluster(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                results = list(pool.map(_group_cluster, *zip(*jobs)))
+
+    groups = [g for result in results for g in result if len(g) >= group_size]
+    leftover = [x for result in results for g in result if len(g) < group_size for x in g]
+    if leftover:
+        with instrument.stage('hierarchical.repair', rows=len(leftover)):
+            ids = make_matrix.matrix_ids(traits)
+            pos = {x: k for k, x in enumerate(ids)}
+            groups.extend(_group_cluster(traits.iloc[[pos[x] for x in leftover]], algorithm, group_size,
+                                         master.getrandbits(64), weights))
+    report = {
+        'clusters': len(clusters),
+        'largest_cluster': max((len(c) for c in clusters), default=0),
+        'repaired': len(leftover),
+        'seconds': time.perf_counter() - t0,
+    }
+    return groups, report
+
+
+def compare_with_flat(traits, group_size: int = 4, algorithm: str = 'force_exact',
+                      cluster_size: int = DEFAULT_CLUSTER_SIZE, workers: int = 1, seed=None, weights: dict = None):
+    """
+    Quality report: run the hierarchical and the flat (full matrix) grouping
+    on the same traits and return both objectives, times and their ratio.
+    The flat run needs the dense n x n matrix, so keep n moderate.
+    """
+    groups, report = hierarchical_grouping(traits, group_size=group_size, algorithm=algorithm,
+                                           cluster_size=cluster_size, workers=workers, seed=seed, weights=weights)
+    start = time.perf_counter()
+    flat = _group_cluster(traits.reset_index(drop=True), algorithm, group_size, seed, weights)
+    flat_seconds = time.perf_counter() - start
+    report['objective'] = group_objective(traits, groups, weights)
+    report['flat_objective'] = group_objective(traits, flat, weights)
+    report['flat_seconds'] = flat_seconds
+    report['ratio'] = report['objective'] / report['flat_objective'] if report['flat_objective'] else None
+    return groups, report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cluster-then-group mode for large cohorts')
+    parser.add_argument('--cluster-size', type=int, default=DEFAULT_CLUSTER_SIZE,
+                        help='target people per k-means cluster (each gets its own dense matrix)')
+    parser.add_argument('--algorithm', choices=sorted(divide_groups.ALGORITHMS), default='force_exact')
+    parser.add_argument('--group-size', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=1, help='processes for the clusters (0 = one per CPU)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--weights', metavar='PROFILE', help='JSON weight profile for the scorer')
+    parser.add_argument('--compare', action='store_true',
+                        help='also run the flat algorithm on the full matrix and report both objectives')
+    args = parser.parse_args()
+
+    base = Path(__file__).resolve().parent
+    traits = make_matrix.load_traits(make_matrix.trait_source(base.joinpath('trait.csv')))
+    weights = calculate_pairs.load_weights(args.weights) if args.weights else None
+    run = compare_with_flat if args.compare else hierarchical_grouping
+    groups, report = run(traits, group_size=args.group_size, algorithm=args.algorithm,
+                         cluster_size=args.cluster_size, workers=args.workers, seed=args.seed, weights=weights)
+    line = (f"{report['clusters']} clusters (largest {report['largest_cluster']}), "
+            f"{report['repaired']} people repaired across clusters, {report['seconds']:.2f}s")
+    if args.compare:
+        line += (f"\nObjective {report['objective']:.3f} vs flat {report['flat_objective']:.3f} "
+                 f"({report['ratio']:.2%}), flat took {report['flat_seconds']:.2f}s")
+    print(line)
+    for gi, g in enumerate(groups, start=1):
+        print(f'Group {gi}:', g)
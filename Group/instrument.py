@@ -0,0 +1,143 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: no memory high-water marks
+    resource = None
+
+# Opt-in stage timing for preprocess / make_matrix / divide_groups.
+#
+#   GROUP_PROFILE=1            print a per-stage summary table to stderr at exit
+#   GROUP_PROFILE=trace.json   also write a Chrome trace (chrome://tracing, Perfetto)
+#
+# or call `enable()` from code. Disabled, `stage()` returns a shared no-op
+# context manager, so instrumented code pays one function call per stage.
+
+_STATE = {'enabled': False, 'trace_path': None, 'records': [], 't0': 0.0}
+_LOCK = threading.Lock()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB, or None where unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, **counts):
+        pass
+
+
+_NULL = _NullStage()
+
+
+class _Stage:
+    def __init__(self, name: str, counts: dict):
+        self.name = name
+        self.counts = {k: v for k, v in counts.items() if v is not None}
+
+    def add(self, **counts):
+        """Add to this stage's counters (rows, pairs, ...) from inside the block."""
+        for k, v in counts.items():
+            self.counts[k] = self.counts.get(k, 0) + v
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        record = {'name': self.name, 'start': self.start - _STATE['t0'], 'seconds': end - self.start,
+                  'counts': self.counts, 'peak_rss_mb': peak_rss_mb(), 'pid': os.getpid(),
+                  'tid': threading.get_ident()}
+        with _LOCK:
+            _STATE['records'].append(record)
+        return False
+
+
+def enabled():
+    return _STATE['enabled']
+
+
+def enable(trace_path: str = None, report_at_exit: bool = True):
+    """Start recording stages; the summary (and trace file) is written at exit unless disabled."""
+    first = not _STATE['enabled']
+    _STATE.update(enabled=True, trace_path=trace_path or _STATE['trace_path'])
+    if first:
+        _STATE['t0'] = time.perf_counter()
+        if report_at_exit:
+            atexit.register(report)
+
+
+def disable():
+    _STATE['enabled'] = False
+
+
+def stage(name: str, **counts):
+    """
+    Context manager timing one stage. Keyword counts (rows=..., pairs=...)
+    give per-second rates in the summary; more can be added with `.add()`.
+    """
+    if not _STATE['enabled']:
+        return _NULL
+    return _Stage(name, counts)
+
+
+def records():
+    with _LOCK:
+        return list(_STATE['records'])
+
+
+def summary():
+    """Per-stage totals (calls, wall time, counts and rates, memory high-water) as a text table."""
+    by_name = {}
+    for r in records():
+        agg = by_name.setdefault(r['name'], {'calls': 0, 'seconds': 0.0, 'counts': {}, 'peak_rss_mb': 0.0})
+        agg['calls'] += 1
+        agg['seconds'] += r['seconds']
+        for k, v in r['counts'].items():
+            agg['counts'][k] = agg['counts'].get(k, 0) + v
+        agg['peak_rss_mb'] = max(agg['peak_rss_mb'], r['peak_rss_mb'] or 0.0)
+    lines = [f"{'stage':<36}{'calls':>6}{'seconds':>10}{'peak MiB':>10}  counts"]
+    for name, agg in by_name.items():
+        rates = ', '.join(f'{v:,} {k} ({v / agg["seconds"]:,.0f}/s)' if agg['seconds'] > 0 else f'{v:,} {k}'
+                          for k, v in agg['counts'].items())
+        lines.append(f"{name:<36}{agg['calls']:>6}{agg['seconds']:>10.3f}{agg['peak_rss_mb']:>10.1f}  {rates}")
+    return '\n'.join(lines)
+
+
+def write_trace(path: str):
+    """Write the recorded stages as Chrome trace events (complete 'X' events, microseconds)."""
+    events = [{'name': r['name'], 'ph': 'X', 'ts': r['start'] * 1e6, 'dur': r['seconds'] * 1e6,
+               'pid': r['pid'], 'tid': r['tid'], 'args': {**r['counts'], 'peak_rss_mb': r['peak_rss_mb']}}
+              for r in records()]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def report(stream=None):
+    if not records():
+        return
+    print(summary(), file=stream or sys.stderr)
+    if _STATE['trace_path']:
+        write_trace(_STATE['trace_path'])
+        print(f"Wrote stage trace to {_STATE['trace_path']}", file=stream or sys.stderr)
+
+
+_env = os.environ.get('GROUP_PROFILE', '')
+if _env and _env != '0':
+    enable(trace_path=None if _env in ('1', 'true', 'yes') else _env)
@@ -1,37 +1,128 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from pathlib import Path
 import pandas as pd
 import numpy as np
 import calculate_pairs
+import instrument
+import trait_store
+
+# rows per task in the parallel builder; fixed (not derived from the worker count)
+# so the block schedule, and therefore the result, is the same for any `workers`
+PARALLEL_BLOCK_ROWS = 256
+
+# binary storage dtypes for the matrix: full precision, half the bytes, or a
+# quarter with int16 steps of a known scale (see `int16_codec`)
+STORAGE_DTYPES = ('float64', 'float32', 'int16')
+# int16 step sizes, finest first; the first one whose range covers the scores is used
+INT16_SCALES = (1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 0.1, 0.2, 0.5, 1.0)
+INT16_MAX = 32767
+
+
+def int16_codec(low: float, high: float):
+    """
+    (scale, offset) for storing scores in [low, high] (and the 1.0 diagonal)
+    as int16: score = offset + stored * scale, so every stored score is
+    within scale / 2 of the exact one. The finest `INT16_SCALES` step that
+    spans the range is chosen; the offset is a multiple of it.
+    """
+    low, high = min(low, 1.0), max(high, 1.0)
+    for scale in INT16_SCALES:
+        if high - low <= 2 * (INT16_MAX - 1) * scale:
+            return scale, round((low + high) / 2 / scale) * scale
+    raise ValueError(f'scores in [{low}, {high}] do not fit int16 at any scale in INT16_SCALES')
+
+
+def encode_scores(values, dtype: str, codec=None):
+    """Scores in the storage `dtype`; int16 rounds to the nearest step of `codec` = (scale, offset)."""
+    if np.dtype(dtype) == np.int16:
+        scale, offset = codec
+        return np.clip(np.rint((np.asarray(values) - offset) / scale), -INT16_MAX, INT16_MAX).astype(np.int16)
+    return np.asarray(values, dtype=dtype)
+
+
+def codec_path(matrix_path: Path):
+    """Sidecar holding an int16 matrix's scale and offset (`matrix.npy` -> `matrix_codec.json`)."""
+    matrix_path = Path(matrix_path)
+    return matrix_path.with_name(matrix_path.stem + '_codec.json')
+
+
+def _write_codec(out_path: Path, codec):
+    path = codec_path(out_path)
+    if codec is None:
+        if path.exists():
+            path.unlink()
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'dtype': 'int16', 'scale': codec[0], 'offset': codec[1]}, f)
+
+
+def read_codec(out_path: Path):
+    """(scale, offset) of an int16 matrix file, or None for float storage."""
+    path = codec_path(out_path)
+    if not path.exists():
+        return None
+    with open(path, encoding='utf-8') as f:
+        codec = json.load(f)
+    return codec['scale'], codec['offset']
 
 
 def load_traits(path: Path):
+    """
+    Load trait rows from a columnar store directory (memory-mapped, typed) or
+    from trait.csv. For the CSV, compact numeric features are converted back
+    to numbers; text columns (`*_raw` answers, ids, philosophy_type) stay
+    strings so the text-based scoring terms still see them.
+    """
+    with instrument.stage('make_matrix.load_traits') as st:
+        df = _read_traits(path)
+        st.add(rows=len(df))
+    return df
+
+
+def _read_traits(path: Path):
+    if trait_store.is_store(path):
+        return trait_store.read_store(path)
     df = pd.read_csv(str(path), dtype=str).fillna('')
-    # convert numeric-ish columns
-    # Many columns are encoded as strings in the CSV; convert compact numeric features back to numeric type.
     # `pd.to_numeric(..., errors='coerce')` safely converts non-numeric to NaN, then we fill missing with 0.
     for c in df.columns:
-       df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0)
+        if c.endswith('_raw'):
+            continue
+        num = pd.to_numeric(df[c], errors='coerce')
+        if (num.isna() & (df[c] != '')).any():
+            continue
+        df[c] = num.fillna(0)
     return df
 
 
-def build_matrix(df: pd.DataFrame):
+def trait_source(csv_path: Path):
+    """The trait store next to `csv_path` when it is at least as new as the CSV, else the CSV."""
+    store = trait_store.store_path(csv_path)
+    if trait_store.is_store(store) and (not Path(csv_path).exists() or
+                                        store.joinpath(trait_store.SCHEMA_FILE).stat().st_mtime
+                                        >= Path(csv_path).stat().st_mtime):
+        return store
+    return Path(csv_path)
+
+
+def matrix_ids(df: pd.DataFrame):
+    """Row/column labels for the matrix: survey_id when present, else person_id, else positions."""
     n = len(df)
+    if 'survey_id' in df.columns and df['survey_id'].notna().any():
+        return df['survey_id'].astype(str).tolist()
+    return df['person_id'].astype(str).tolist() if 'person_id' in df.columns else [str(i) for i in range(n)]
+
+
+def build_matrix(df: pd.DataFrame, weights: dict = None):
     # prefer survey_id for row/column labels; fall back to person_id
     df = df.reset_index(drop=True)
-    if 'survey_id' in df.columns and df['survey_id'].notna().any():
-        ids = df['survey_id'].astype(str).tolist()
-    else:
-        ids = df['person_id'].astype(str).tolist() if 'person_id' in df.columns else [str(i) for i in range(n)]
-    # Pre-allocate a NumPy array for speed; nested loops fill pairwise similarity scores.
-    # Using NumPy arrays is much faster and more memory-efficient for numeric matrices than Python lists.
-    mat = np.zeros((n, n), dtype=float)
-    for i in range(n):
-        for j in range(n):
-            if i == j:
-                mat[i, j] = 1.0
-            else:
-                # compute_similarity expects integer positions and the DataFrame
-                mat[i, j] = calculate_pairs.compute(i, j, df)
+    ids = matrix_ids(df)
+    # Score all pairs in row blocks with NumPy broadcasting (same rules as `calculate_pairs.compute`).
+    mat = calculate_pairs.compute_matrix(df, weights=weights)
     mat_df = pd.DataFrame(mat, index=ids, columns=ids)
     # ensure square numeric-only CSV and hide index/column name
     mat_df.index.name = ''
@@ -39,14 +130,622 @@ def build_matrix(df: pd.DataFrame):
     return mat_df
 
 
+def build_condensed(df: pd.DataFrame, weights: dict = None):
+    """
+    Symmetric mode: score each unordered pair once.
+
+    Returns (ids, values) where `values` is the condensed upper triangle
+    (scipy `pdist` layout, see `calculate_pairs.condensed_index`).
+    """
+    df = df.reset_index(drop=True)
+    return matrix_ids(df), calculate_pairs.compute_condensed(df, weights=weights)
+
+
+def write_condensed(ids, values, out_path: Path):
+    """
+    Write a condensed matrix as CSV: the same id header row as the dense
+    `matrix.csv`, followed by one row labelled `condensed` holding the
+    n*(n-1)/2 upper-triangle scores.
+    """
+    with instrument.stage('make_matrix.write_csv', pairs=len(values)), \
+            open(out_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(','.join([''] + [str(x) for x in ids]) + '\n')
+        f.write('condensed')
+        if len(values):
+            f.write(',')
+            np.savetxt(f, np.asarray(values)[None, :], fmt='%.6f', delimiter=',')
+        else:
+            f.write('\n')
+
+
+def write_dense_csv(ids, values, out_path: Path):
+    """Write a dense matrix as the square `matrix.csv` (ids as header row and first column)."""
+    mat_df = pd.DataFrame(values, index=ids, columns=ids)
+    # ensure square numeric-only CSV and hide index/column name
+    mat_df.index.name = ''
+    mat_df.columns.name = ''
+    with instrument.stage('make_matrix.write_csv', pairs=mat_df.size):
+        mat_df.to_csv(str(out_path), float_format='%.6f')
+
+
+def _attach_shm(name: str):
+    """Attach to an existing shared memory segment without taking ownership of it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no `track`; pool workers share the parent's resource
+        # tracker, so the duplicate registration is harmless and the parent unlinks
+        return shared_memory.SharedMemory(name=name)
+
+
+def _share(obj, segments):
+    """Copy the arrays inside a `prepare_features` result into shared memory; returns a picklable spec."""
+    if isinstance(obj, np.ndarray) and obj.dtype != object and obj.size:
+        shm = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+        np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)[...] = obj
+        segments.append(shm)
+        return ('shm', shm.name, obj.shape, obj.dtype.str)
+    if isinstance(obj, dict):
+        return {k: _share(v, segments) for k, v in obj.items()}
+    if isinstance(obj, tuple):
+        return tuple(_share(v, segments) for v in obj)
+    return obj
+
+
+def _unshare(spec, handles):
+    """Inverse of `_share` inside a worker: rebuild arrays as views on the shared segments."""
+    if isinstance(spec, tuple) and len(spec) == 4 and spec[0] == 'shm':
+        shm = _attach_shm(spec[1])
+        handles.append(shm)
+        return np.ndarray(spec[2], dtype=np.dtype(spec[3]), buffer=shm.buf)
+    if isinstance(spec, dict):
+        return {k: _unshare(v, handles) for k, v in spec.items()}
+    if isinstance(spec, tuple):
+        return tuple(_unshare(v, handles) for v in spec)
+    return spec
+
+
+# per-worker state set up once by `_init_worker`
+_WORKER = {}
+
+
+def _init_worker(feat_spec, out_spec):
+    handles = []
+    _WORKER['handles'] = handles
+    _WORKER['feats'] = _unshare(feat_spec, handles)
+    kind, target, shape, dtype, codec = out_spec
+    _WORKER['codec'] = codec
+    if kind == 'shm':
+        shm = _attach_shm(target)
+        handles.append(shm)
+        _WORKER['out'] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    else:
+        _WORKER['out'] = np.load(target, mmap_mode='r+')
+
+
+def _score_rows(start: int, stop: int, condensed: bool, feats=None, out=None, codec=None):
+    """Score rows start..stop-1 and write them straight into the shared output buffer (in its dtype)."""
+    feats = _WORKER['feats'] if feats is None else feats
+    if out is None:
+        out, codec = _WORKER['out'], _WORKER['codec']
+    n = feats['n']
+    if condensed:
+        block = encode_scores(calculate_pairs.score_block(feats, start, stop, col_start=start + 1), out.dtype, codec)
+        for i in range(start, stop):
+            pos = calculate_pairs.condensed_index(n, i, i + 1)
+            out[pos:pos + n - i - 1] = block[i - start, i - start:]
+    else:
+        block = calculate_pairs.score_block(feats, start, stop)
+        block[np.arange(stop - start), np.arange(start, stop)] = 1.0
+        out[start:stop] = encode_scores(block, out.dtype, codec)
+    return stop - start
+
+
+def build_matrix_parallel(df: pd.DataFrame, workers: int = None, condensed: bool = False,
+                          out_path: Path = None, block_rows: int = PARALLEL_BLOCK_ROWS, weights: dict = None,
+                          dtype: str = 'float64'):
+    """
+    Parallel mode of `build_matrix` / `build_condensed`.
+
+    The rows are split into fixed blocks of `block_rows` and scored in a
+    process pool. Workers read the trait arrays from a shared-memory copy
+    and write their rows directly into a preallocated output: a shared
+    memory buffer, or a `.npy` memmap at `out_path` (dense n x n or
+    condensed, see `write_binary`). Block boundaries do not depend on
+    `workers`, so the result is identical for any worker count.
+
+    `dtype` is the storage type (`STORAGE_DTYPES`). int16 needs `out_path`:
+    its codec comes from `calculate_pairs.score_bounds` before scoring and
+    is written to the `*_codec.json` sidecar.
+
+    Returns (ids, values); `values` is the memmap when `out_path` is given.
+    """
+    df = df.reset_index(drop=True)
+    ids = matrix_ids(df)
+    feats = calculate_pairs.prepare_features(df, weights=weights)
+    n = feats['n']
+    shape = (n * (n - 1) // 2,) if condensed else (n, n)
+    dtype = np.dtype(dtype)
+    codec = None
+    if dtype == np.int16:
+        if out_path is None:
+            raise ValueError('int16 storage needs out_path (the scale is kept in a sidecar next to the .npy)')
+        codec = int16_codec(*calculate_pairs.score_bounds(feats))
+    workers = workers or os.cpu_count() or 1
+    last_row = n - 1 if condensed else n
+    tasks = [(start, min(last_row, start + block_rows)) for start in range(0, last_row, block_rows)]
+
+    if out_path is not None:
+        out = np.lib.format.open_memmap(str(out_path), mode='w+', dtype=dtype, shape=shape)
+        with open(ids_path(out_path), 'w', encoding='utf-8') as f:
+            f.writelines(f'{x}\n' for x in ids)
+        _write_codec(out_path, codec)
+    else:
+        out = None
+
+    with instrument.stage('make_matrix.score_parallel', pairs=int(np.prod(shape))):
+        if workers <= 1 or len(tasks) <= 1:
+            # same block schedule in-process; no pool or shared memory needed
+            values = out if out is not None else np.zeros(shape, dtype=dtype)
+            for start, stop in tasks:
+                _score_rows(start, stop, condensed, feats=feats, out=values, codec=codec)
+            if out is not None:
+                values.flush()
+            return ids, values
+
+        segments = []
+        try:
+            feat_spec = _share(feats, segments)
+            if out is not None:
+                out.flush()
+                out_spec = ('npy', str(out_path), shape, dtype.str, codec)
+            else:
+                shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+                segments.append(shm)
+                out_spec = ('shm', shm.name, shape, dtype.str, codec)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(feat_spec, out_spec)) as pool:
+                futures = [pool.submit(_score_rows, start, stop, condensed) for start, stop in tasks]
+                for fut in futures:
+                    fut.result()
+            if out is not None:
+                # re-open so the returned map sees the workers' writes
+                values = np.load(str(out_path), mmap_mode='r')
+            else:
+                values = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+        finally:
+            for seg in segments:
+                seg.close()
+                seg.unlink()
+        return ids, values
+
+
+def _combine_rows(start: int, stop: int, condensed: bool, weights: dict, comps=None, out=None):
+    """Weigh the cached components of rows start..stop-1 and write their scores into the output buffer."""
+    comps = _WORKER['feats'] if comps is None else comps
+    out = _WORKER['out'] if out is None else out
+    n = comps['n']
+    # a row block is one contiguous run of the condensed component arrays
+    lo = calculate_pairs.condensed_index(n, start, start + 1)
+    hi = calculate_pairs.condensed_index(n, stop, stop + 1)
+    values = calculate_pairs.combine_components(
+        {k: v[lo:hi] if isinstance(v, np.ndarray) else v for k, v in comps.items()}, weights)
+    if condensed:
+        out[lo:hi] = values
+    else:
+        for i in range(start, stop):
+            pos = calculate_pairs.condensed_index(n, i, i + 1) - lo
+            out[i, i + 1:] = out[i + 1:, i] = values[pos:pos + n - i - 1]
+    return stop - start
+
+
+def build_from_components(comps: dict, weights: dict = None, workers: int = 1, condensed: bool = False,
+                          block_rows: int = PARALLEL_BLOCK_ROWS):
+    """
+    Scores for `weights` from cached per-question components
+    (`calculate_pairs.compute_components`), no pair is re-scored.
+
+    Same layouts and block schedule as `build_matrix_parallel`: condensed,
+    or dense n x n with diagonal 1.0; with `workers` other than 1 the row
+    blocks are weighed in a process pool reading the components from
+    shared memory. Returns the float64 values.
+    """
+    n = comps['n']
+    weights = calculate_pairs.resolve_weights(weights)
+    shape = (n * (n - 1) // 2,) if condensed else (n, n)
+    workers = workers or os.cpu_count() or 1
+    tasks = [(start, min(n - 1, start + block_rows)) for start in range(0, n - 1, block_rows)]
+    with instrument.stage('make_matrix.reweight', pairs=int(np.prod(shape))):
+        if workers <= 1 or len(tasks) <= 1:
+            values = np.zeros(shape, dtype=float)
+            for start, stop in tasks:
+                _combine_rows(start, stop, condensed, weights, comps=comps, out=values)
+        else:
+            segments = []
+            try:
+                comp_spec = _share(comps, segments)
+                shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 8))
+                segments.append(shm)
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(comp_spec, ('shm', shm.name, shape, '<f8', None))) as pool:
+                    futures = [pool.submit(_combine_rows, start, stop, condensed, weights) for start, stop in tasks]
+                    for fut in futures:
+                        fut.result()
+                values = np.ndarray(shape, dtype=float, buffer=shm.buf).copy()
+            finally:
+                for seg in segments:
+                    seg.close()
+                    seg.unlink()
+    if not condensed:
+        np.fill_diagonal(values, 1.0)
+    return values
+
+
+def _topk_select(block: np.ndarray, k: int):
+    """
+    Column indices and scores of the k largest entries of each block row.
+
+    Uses `np.argpartition` to find each row's k-th largest value, then
+    resolves ties at that boundary towards smaller indices and orders the
+    result by descending score (ties by index), i.e. the first k entries of
+    a stable descending sort of the row.
+    """
+    m = block.shape[0]
+    kth = np.take_along_axis(block, np.argpartition(-block, k - 1, axis=1)[:, k - 1:k], axis=1)
+    gt = block > kth
+    eq = block == kth
+    need = k - gt.sum(axis=1)
+    sel = gt | (eq & (np.cumsum(eq, axis=1) <= need[:, None]))
+    cols = np.nonzero(sel)[1].reshape(m, k)
+    vals = np.take_along_axis(block, cols, axis=1)
+    order = np.argsort(-vals, axis=1, kind='stable')
+    return np.take_along_axis(cols, order, axis=1), np.take_along_axis(vals, order, axis=1)
+
+
+def build_topk(df: pd.DataFrame, k: int = 32, block_cells: int = calculate_pairs.BLOCK_CELLS,
+               weights: dict = None, dtype: str = 'float64'):
+    """
+    Top-K neighbor index: score row blocks and keep only each person's K best partners.
+
+    Never materializes the n x n matrix. Returns (ids, neighbors, scores,
+    row_sums): `neighbors`/`scores` are (n, K) arrays ordered best first
+    (ties by index), `row_sums` is each person's total similarity to all
+    others (the seed order used by `divide_groups.force_grouping_exact`).
+    `scores` are stored as `dtype` (float64 or float32); `row_sums` stay float64.
+    Neighbors are selected and row sums taken over the scores as stored, so
+    with K = n - 1 the index orders people exactly like the dense matrix
+    written in the same `dtype`.
+    """
+    df = df.reset_index(drop=True)
+    ids = matrix_ids(df)
+    feats = calculate_pairs.prepare_features(df, weights=weights)
+    n = feats['n']
+    k = max(0, min(k, n - 1))
+    neighbors = np.zeros((n, k), dtype=np.int32)
+    scores = np.zeros((n, k), dtype=dtype)
+    row_sums = np.zeros(n, dtype=float)
+    with instrument.stage('make_matrix.score_topk', pairs=n * n):
+        step = max(1, block_cells // max(n, 1))
+        for start in range(0, n, step):
+            stop = min(n, start + step)
+            block = calculate_pairs.score_block(feats, start, stop)
+            if scores.dtype != block.dtype:
+                block = encode_scores(block, scores.dtype).astype(float)
+            diag = (np.arange(stop - start), np.arange(start, stop))
+            # sequential (cumsum) row sums without the diagonal, matching a Python sum over j != i
+            block[diag] = 0.0
+            row_sums[start:stop] = np.cumsum(block, axis=1)[:, -1] if n else 0.0
+            if k:
+                block[diag] = -np.inf  # never pick yourself
+                neighbors[start:stop], scores[start:stop] = _topk_select(block, k)
+    return ids, neighbors, scores, row_sums
+
+
+def write_topk(ids, neighbors, scores, row_sums, out_path: Path):
+    """Write a top-K index as `.npz` (loaded by `divide_groups.load_matrix` as a `TopKIndex`)."""
+    np.savez(str(out_path), ids=np.array(ids, dtype=str), neighbors=neighbors,
+             scores=scores, row_sums=row_sums)
+
+
+def ids_path(matrix_path: Path):
+    """Sidecar id list stored next to a binary matrix (`matrix.npy` -> `matrix_ids.txt`)."""
+    matrix_path = Path(matrix_path)
+    return matrix_path.with_name(matrix_path.stem + '_ids.txt')
+
+
+def write_binary(ids, values, out_path: Path, dtype: str = None, block_rows: int = PARALLEL_BLOCK_ROWS):
+    """
+    Write a matrix (dense n x n or condensed 1-D) as `.npy` plus a sidecar id list.
+
+    `divide_groups.load_matrix` opens the `.npy` memory-mapped, so only the
+    rows the grouping touches are paged in. `dtype` (`STORAGE_DTYPES`,
+    default: keep the values' dtype) converts in row blocks; int16 picks
+    its codec from the values' range and writes the `*_codec.json` sidecar.
+    """
+    with instrument.stage('make_matrix.write_npy', pairs=np.size(values)):
+        if dtype is None or np.dtype(dtype) == values.dtype:
+            np.save(str(out_path), np.ascontiguousarray(values))
+            codec = None
+        else:
+            codec = None
+            if np.dtype(dtype) == np.int16:
+                codec = int16_codec(float(np.min(values, initial=1.0)), float(np.max(values, initial=1.0)))
+            out = np.lib.format.open_memmap(str(out_path), mode='w+', dtype=dtype, shape=np.shape(values))
+            step = block_rows if out.ndim == 2 else block_rows * max(1, len(ids))
+            for start in range(0, len(out), step):
+                out[start:start + step] = encode_scores(values[start:start + step], dtype, codec)
+            out.flush()
+            del out
+        _write_codec(out_path, codec)
+        with open(ids_path(out_path), 'w', encoding='utf-8') as f:
+            f.writelines(f'{x}\n' for x in ids)
+
+
+def state_path(matrix_path: Path):
+    """Sidecar recording which trait rows a stored matrix was built from (`matrix.npy` -> `matrix_state.json`)."""
+    matrix_path = Path(matrix_path)
+    return matrix_path.with_name(matrix_path.stem + '_state.json')
+
+
+def _file_sha256(path: Path):
+    """Content hash of a file, or of every file (names and bytes) in a trait store directory."""
+    path = Path(path)
+    files = sorted(p for p in path.iterdir() if p.is_file()) if path.is_dir() else [path]
+    h = hashlib.sha256()
+    for p in files:
+        if path.is_dir():
+            h.update(p.name.encode('utf-8'))
+        with open(p, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def _row_hashes(df: pd.DataFrame):
+    """One stable 64-bit fingerprint per trait row (values only, not the index)."""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy(dtype=np.uint64)
+
+
+def _write_state(out_path: Path, df: pd.DataFrame, ids, trait_sha=None, weights: dict = None):
+    state = {
+        'trait_sha256': trait_sha,
+        'weights': calculate_pairs.resolve_weights(weights),
+        'columns': [str(c) for c in df.columns],
+        'ids': list(ids),
+        'row_hashes': [int(h) for h in _row_hashes(df)],
+    }
+    with open(state_path(out_path), 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+
+def _read_state(out_path: Path):
+    if not (Path(out_path).exists() and state_path(out_path).exists()):
+        return None
+    with open(state_path(out_path), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _same_weights(state, weights: dict = None):
+    # states written before weight profiles existed were scored with the defaults
+    return state.get('weights', calculate_pairs.DEFAULT_WEIGHTS) == calculate_pairs.resolve_weights(weights)
+
+
+def _stored_dtype(out_path: Path):
+    return np.load(str(out_path), mmap_mode='r').dtype if Path(out_path).exists() else None
+
+
+def matrix_is_current(out_path: Path, trait_path: Path, weights: dict = None, dtype: str = None):
+    """
+    True if the matrix at `out_path` was built from exactly this trait file
+    (content hash) and weights, and is stored as `dtype` when one is given.
+    """
+    state = _read_state(out_path)
+    return (state is not None and state.get('trait_sha256') == _file_sha256(trait_path)
+            and _same_weights(state, weights) and (dtype is None or _stored_dtype(out_path) == np.dtype(dtype)))
+
+
+def update_matrix(df: pd.DataFrame, out_path: Path, trait_path: Path = None, workers: int = 1,
+                  block_rows: int = PARALLEL_BLOCK_ROWS, weights: dict = None, dtype: str = None):
+    """
+    Incremental mode: bring the dense `.npy` matrix at `out_path` up to date with `df`.
+
+    The `*_state.json` sidecar stores the trait columns and one fingerprint
+    per row the matrix was built from. Rows whose survey id is new or whose
+    fingerprint changed are re-scored against everyone; scores between
+    unchanged rows are copied from the stored matrix. When `trait_path` is
+    given and its content hash matches the state, nothing is read or
+    written. A missing or incompatible state (different columns, weights
+    or storage `dtype`) falls back to a full parallel build. `dtype=None`
+    keeps the stored dtype; an int16 matrix keeps its codec and is rebuilt
+    when the new rows could score outside its range.
+
+    Returns (ids, values, n_rescored) where `values` is the memmapped matrix.
+    """
+    out_path = Path(out_path)
+    trait_sha = _file_sha256(trait_path) if trait_path is not None else None
+    state = _read_state(out_path)
+    stored = _stored_dtype(out_path)
+    dtype = np.dtype(dtype) if dtype is not None else (stored or np.dtype(float))
+    if state is not None and (not _same_weights(state, weights) or stored != dtype):
+        state = None
+    if state is not None and trait_sha is not None and state.get('trait_sha256') == trait_sha:
+        # unchanged input: the stored matrix is current
+        return state['ids'], np.load(str(out_path), mmap_mode='r'), 0
+
+    df = df.reset_index(drop=True)
+    ids = matrix_ids(df)
+    n = len(ids)
+    feats = calculate_pairs.prepare_features(df, weights=weights)
+    codec = read_codec(out_path) if dtype == np.int16 else None
+    if dtype == np.int16 and codec is None:
+        state = None
+    elif codec is not None:
+        scale, offset = codec
+        low, high = calculate_pairs.score_bounds(feats)
+        if low < offset - INT16_MAX * scale or high > offset + INT16_MAX * scale:
+            state = None
+    if state is None or state['columns'] != [str(c) for c in df.columns] or len(set(ids)) != n:
+        ids, values = build_matrix_parallel(df, workers=workers, out_path=out_path, block_rows=block_rows,
+                                            weights=weights, dtype=dtype)
+        _write_state(out_path, df, ids, trait_sha, weights)
+        return ids, values, n
+
+    # match rows to the stored matrix by id; a row is reusable only if its fingerprint is unchanged
+    old_pos = {x: k for k, x in enumerate(state['ids'])}
+    old_hash = np.array(state['row_hashes'], dtype=np.uint64)
+    new_hash = _row_hashes(df)
+    src = np.array([old_pos.get(x, -1) for x in ids], dtype=np.int64)
+    keep = src >= 0
+    keep[keep] = old_hash[src[keep]] == new_hash[keep]
+    dirty = np.flatnonzero(~keep)
+    if not len(dirty) and n == len(state['ids']) and (src == np.arange(n)).all():
+        _write_state(out_path, df, ids, trait_sha, weights)
+        return ids, np.load(str(out_path), mmap_mode='r'), 0
+
+    old = np.load(str(out_path), mmap_mode='r')
+    tmp_path = out_path.with_name(out_path.stem + '.tmp.npy')
+    new = np.lib.format.open_memmap(str(tmp_path), mode='w+', dtype=old.dtype, shape=(n, n))
+    # copy the unchanged block row-chunk by row-chunk so memory stays bounded
+    kept = np.flatnonzero(keep)
+    kept_src = src[kept]
+    for k in range(0, len(kept), block_rows):
+        rows = kept[k:k + block_rows]
+        new[rows[:, None], kept[None, :]] = old[kept_src[k:k + block_rows]][:, kept_src]
+    del old
+    # re-score only the new/changed rows; every term is symmetric, so mirror them into the columns
+    with instrument.stage('make_matrix.rescore_rows', rows=len(dirty), pairs=len(dirty) * n):
+        for k in range(0, len(dirty), block_rows):
+            rows = dirty[k:k + block_rows]
+            block = calculate_pairs.score_rows(feats, rows)
+            block[np.arange(len(rows)), rows] = 1.0
+            block = encode_scores(block, dtype, codec)
+            new[rows] = block
+            new[:, rows] = block.T
+    new.flush()
+    del new
+    os.replace(tmp_path, out_path)
+    with open(ids_path(out_path), 'w', encoding='utf-8') as f:
+        f.writelines(f'{x}\n' for x in ids)
+    _write_state(out_path, df, ids, trait_sha, weights)
+    return ids, np.load(str(out_path), mmap_mode='r'), len(dirty)
+
+
+def build_reweighted(df: pd.DataFrame, cache_path: Path, weights: dict = None, trait_path: Path = None,
+                     condensed: bool = True, workers: int = 1):
+    """
+    Scores for `weights` from a cache of per-question components.
+
+    The cache (`calculate_pairs.compute_components`, saved as `.npz`) is
+    reused when it was built from the same trait file (content hash) and
+    the same ids; otherwise it is rebuilt once. Re-weighting is then a
+    weighted sum over the cached arrays (`build_from_components`, condensed
+    or dense), no pair is re-scored.
+
+    Returns (ids, values, reused).
+    """
+    df = df.reset_index(drop=True)
+    ids = matrix_ids(df)
+    trait_sha = _file_sha256(trait_path) if trait_path is not None else ''
+    comps = None
+    if trait_sha and Path(cache_path).exists():
+        comps, meta = calculate_pairs.load_components(cache_path)
+        # caches written before the q7/q9 set sizes were stored hold Jaccard ratios instead
+        if (meta.get('trait_sha256') != trait_sha or list(np.atleast_1d(meta.get('ids', []))) != ids
+                or 'q7_inter' not in comps):
+            comps = None
+    reused = comps is not None
+    if comps is None:
+        comps = calculate_pairs.compute_components(df)
+        calculate_pairs.save_components(comps, cache_path, ids=np.array(ids, dtype=str), trait_sha256=trait_sha)
+    values = build_from_components(comps, weights, workers=workers, condensed=condensed)
+    return ids, values, reused
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the pairwise similarity matrix from trait.csv')
+    parser.add_argument('--condensed', action='store_true',
+                        help='score each pair once and write the upper triangle to matrix_condensed.csv')
+    parser.add_argument('--format', choices=('csv', 'npy'), default='csv',
+                        help='npy: binary .npy plus a *_ids.txt sidecar, loaded memory-mapped by divide_groups')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='score row blocks in this many processes (0 = one per CPU)')
+    parser.add_argument('--topk', type=int, default=0, metavar='K',
+                        help='write only the K best partners per person to matrix_topk.npz instead of a matrix')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only re-score new/changed trait rows of an existing matrix.npy (dense npy only)')
+    parser.add_argument('--weights', metavar='PROFILE',
+                        help='JSON weight profile overriding calculate_pairs.DEFAULT_WEIGHTS')
+    parser.add_argument('--dtype', choices=STORAGE_DTYPES,
+                        help='binary storage: float32 halves the matrix, int16 (known scale, error <= scale/2) '
+                             'quarters it; needs --format npy (--topk: float32 scores only). Default float64; '
+                             '--incremental keeps the stored dtype')
+    parser.add_argument('--components', action='store_true',
+                        help='score via cached per-question components (matrix_components.npz) so a new '
+                             '--weights profile is only a weighted sum (honours --condensed and --workers)')
+    args = parser.parse_args()
+    if args.incremental and (args.condensed or args.format != 'npy'):
+        parser.error('--incremental updates a dense matrix.npy; use it with --format npy and without --condensed')
+    if args.components and (args.topk or args.incremental):
+        parser.error('--components cannot be combined with --topk or --incremental')
+    if args.dtype not in (None, 'float64') and args.format != 'npy' and not args.topk:
+        parser.error('--dtype sets the binary storage type; use it with --format npy')
+    if args.topk and args.dtype == 'int16':
+        parser.error('--topk stores float64 or float32 scores')
+    weights = calculate_pairs.load_weights(args.weights) if args.weights else None
+
     base = Path(__file__).resolve().parent
-    trait_path = base.joinpath('trait.csv')
+    # prefer the typed columnar store preprocess.py writes next to trait.csv
+    trait_path = trait_source(base.joinpath('trait.csv'))
     if not trait_path.exists():
         raise FileNotFoundError('trait.csv not found - run preprocess.py first')
+    if args.topk:
+        out = base.joinpath('matrix_topk.npz')
+        write_topk(*build_topk(load_traits(trait_path), k=args.topk, weights=weights,
+                               dtype=args.dtype or 'float64'), out)
+        print(f'Wrote top-{args.topk} neighbor index to {out}')
+        raise SystemExit(0)
+    if args.incremental:
+        out = base.joinpath('matrix.npy')
+        if matrix_is_current(out, trait_path, weights, dtype=args.dtype):
+            print(f'{out} is up to date')
+            raise SystemExit(0)
+        ids, values, rescored = update_matrix(load_traits(trait_path), out, trait_path=trait_path,
+                                              workers=args.workers or None, weights=weights, dtype=args.dtype)
+        print(f'Updated trait matrix {out}: {rescored} of {len(ids)} rows re-scored')
+        raise SystemExit(0)
     df = load_traits(trait_path)
-    mat_df = build_matrix(df)
-    out = base.joinpath('matrix.csv')
-    # write pure numeric square matrix (rows and cols are survey_id)
-    mat_df.to_csv(str(out), float_format='%.6f')
+    if args.components:
+        out = base.joinpath(f'{"matrix_condensed" if args.condensed else "matrix"}.{args.format}')
+        ids, values, reused = build_reweighted(df, base.joinpath('matrix_components.npz'), weights=weights,
+                                               trait_path=trait_path, condensed=args.condensed,
+                                               workers=args.workers or None)
+        if args.format == 'npy':
+            write_binary(ids, values, out, dtype=args.dtype)
+        elif args.condensed:
+            write_condensed(ids, values, out)
+        else:
+            write_dense_csv(ids, values, out)
+        print(f'Wrote trait matrix to {out} ({"cached" if reused else "new"} components)')
+        raise SystemExit(0)
+    stem = 'matrix_condensed' if args.condensed else 'matrix'
+    out = base.joinpath(f'{stem}.{args.format}')
+    if args.format == 'npy' or args.workers != 1:
+        # npy output is scored block by block straight into a memmap in the storage dtype (in this
+        # process with --workers 1), so no full float64 matrix is held in memory
+        target = out if args.format == 'npy' else None
+        ids, values = build_matrix_parallel(df, workers=args.workers or None,
+                                            condensed=args.condensed, out_path=target, weights=weights,
+                                            dtype=args.dtype or 'float64')
+        if args.format == 'csv':
+            if args.condensed:
+                write_condensed(ids, values, out)
+            else:
+                write_dense_csv(ids, values, out)
+    elif args.condensed:
+        ids, values = build_condensed(df, weights=weights)
+        write_condensed(ids, values, out)
+    else:
+        mat_df = build_matrix(df, weights=weights)
+        # write pure numeric square matrix (rows and cols are survey_id)
+        write_dense_csv(mat_df.index.tolist(), mat_df.to_numpy(), out)
     print(f'Wrote trait matrix to {out}')
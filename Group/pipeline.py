@@ -0,0 +1,208 @@
+import argparse
+import csv
+import json
+from pathlib import Path
+import cache
+import calculate_pairs
+import divide_groups
+import hierarchical
+import instrument
+import make_matrix
+import preprocess
+import trait_store
+
+
+def score_traits(traits, condensed: bool = False, topk: int = 0, workers: int = 1, weights: dict = None):
+    """
+    Score the trait rows in memory and return (ids, mat) in the form
+    `divide_groups` takes: a dense array, a `CondensedMatrix` or a `TopKIndex`.
+    """
+    if topk:
+        ids, neighbors, scores, sums = make_matrix.build_topk(traits, k=topk, weights=weights)
+        return ids, divide_groups.TopKIndex(neighbors, scores, sums)
+    if workers != 1:
+        ids, values = make_matrix.build_matrix_parallel(traits, workers=workers or None, condensed=condensed,
+                                                        weights=weights)
+    elif condensed:
+        ids, values = make_matrix.build_condensed(traits, weights=weights)
+    else:
+        ids = make_matrix.matrix_ids(traits)
+        values = calculate_pairs.compute_matrix(traits, weights=weights)
+    if condensed:
+        return ids, divide_groups.CondensedMatrix(values, len(ids))
+    return ids, values
+
+
+def write_groups(groups, out_path: Path):
+    """Write one row per member: group number (1-based) and id."""
+    with open(out_path, 'w', encoding='utf-8', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['group', 'id'])
+        for gi, g in enumerate(groups, start=1):
+            w.writerows([gi, x] for x in g)
+
+
+def _cached(store, key: str, stage: str, build, save, load, rekey=None):
+    """
+    Return `load(entry)` for a cached artifact, or `build()` it and store it with `save(value, dir)`.
+
+    `rekey()`, called after a build, gives the key to store under instead of
+    `key`, for builds that update their own inputs (the vocabulary file).
+    """
+    entry = store.get(key) if store is not None else None
+    if entry is not None:
+        with instrument.stage(f'pipeline.cache_hit.{stage}'):
+            return load(entry)
+    value = build()
+    if store is not None:
+        store.put(rekey() if rekey is not None else key, lambda d: save(value, d), stage=stage)
+    return value
+
+
+def run_pipeline(survey_path: Path, algorithm: str = 'force_exact', group_size: int = 4, seed=None,
+                 condensed: bool = False, topk: int = 0, workers: int = 1, weights: dict = None,
+                 restarts: int = 1, improve: float = 0.0, vocab_path: Path = None, checkpoint_dir: Path = None,
+                 cache_dir: Path = None, cache_bytes: int = cache.DEFAULT_MAX_BYTES, cluster_size: int = 0):
+    """
+    preprocess -> make_matrix -> divide_groups in one process.
+
+    The cleaned traits and the score matrix are handed from stage to stage
+    as in-memory objects, so nothing is formatted to text and parsed back
+    (the matrix keeps full float64 precision). With `checkpoint_dir` the
+    intermediate results are also written there in the files the separate
+    scripts use: trait.csv (+ trait_store/), matrix*.npy with its ids
+    sidecar (or matrix_topk.npz) and groups.csv.
+
+    With `cache_dir`, the trait table, the per-question score components
+    and seeded groupings are kept in a content-addressed `cache.ArtifactCache`
+    keyed on the survey file hash (and the merged vocabulary), the weights, the
+    grouping options and the source of the code producing each artifact;
+    stages whose key is unchanged are loaded instead of recomputed. The
+    matrix is then rebuilt from the cached components, dense or condensed
+    and with `workers` as without the cache.
+    Groupings with `improve` (time-bounded) or without a seed are never cached.
+
+    With `cluster_size`, no full matrix is built: `hierarchical_grouping`
+    groups k-means clusters of about that size on their own and `mat` is None.
+
+    Returns (ids, mat, groups).
+    """
+    store = cache.ArtifactCache(cache_dir, cache_bytes) if cache_dir is not None else None
+    weights = calculate_pairs.resolve_weights(weights)
+
+    def clean():
+        traits, _ = preprocess.load_and_clean(Path(survey_path), vocab_path=vocab_path)
+        return traits.loc[:, preprocess.export_columns(traits)].reset_index(drop=True)
+
+    def key_traits():
+        # keyed on the vocabulary's content: cleaning merges the survey's categories into the
+        # file, so the entry is stored under the merged vocabulary, which is what the next run
+        # on the same survey reads (a vocabulary missing some of them misses, as it must)
+        vocab = preprocess.load_vocab(vocab_path) if vocab_path else None
+        return cache.cache_key('traits', cache.file_sha256(survey_path), vocab,
+                               cache.code_version(preprocess, trait_store))
+
+    traits = _cached(store, key_traits() if store is not None else None, 'traits', clean,
+                     lambda t, d: trait_store.write_store(t, d.joinpath('traits')),
+                     lambda e: trait_store.read_store(e.joinpath('traits')),
+                     rekey=key_traits)
+    traits_key = key_traits() if store is not None else None
+    if checkpoint_dir is not None:
+        checkpoint_dir = Path(checkpoint_dir)
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        preprocess.export_traits(traits, checkpoint_dir.joinpath('trait.csv'))
+
+    if cluster_size:
+        groups, _ = hierarchical.hierarchical_grouping(traits, group_size=group_size, algorithm=algorithm,
+                                                       cluster_size=cluster_size, workers=workers, seed=seed,
+                                                       weights=weights)
+        if checkpoint_dir is not None:
+            write_groups(groups, checkpoint_dir.joinpath('groups.csv'))
+        return make_matrix.matrix_ids(traits), None, groups
+
+    if store is not None and not topk:
+        comp_key = cache.cache_key('components', traits_key, cache.code_version(calculate_pairs))
+        comps = _cached(store, comp_key, 'components', lambda: calculate_pairs.compute_components(traits),
+                        lambda c, d: calculate_pairs.save_components(c, d.joinpath('components.npz')),
+                        lambda e: calculate_pairs.load_components(e.joinpath('components.npz'))[0])
+        ids = make_matrix.matrix_ids(traits)
+        values = make_matrix.build_from_components(comps, weights, workers=workers, condensed=condensed)
+        mat = divide_groups.CondensedMatrix(values, len(ids)) if condensed else values
+        matrix_key = cache.cache_key('matrix', comp_key, weights)
+    else:
+        ids, mat = score_traits(traits, condensed=condensed, topk=topk, workers=workers, weights=weights)
+        matrix_key = cache.cache_key('topk', traits_key, topk, weights, cache.code_version(calculate_pairs))
+    if checkpoint_dir is not None:
+        if topk:
+            make_matrix.write_topk(ids, mat.neighbors, mat.scores, mat.row_sums,
+                                   checkpoint_dir.joinpath('matrix_topk.npz'))
+        else:
+            values = mat.values if condensed else mat
+            make_matrix.write_binary(ids, values,
+                                     checkpoint_dir.joinpath('matrix_condensed.npy' if condensed else 'matrix.npy'))
+
+    def group():
+        if restarts > 1:
+            with instrument.stage('divide_groups.restarts', rows=len(ids) * restarts):
+                groups, _, _ = divide_groups.best_of_restarts(ids, mat, restarts=restarts, seed=seed or 0,
+                                                              workers=workers, algorithm=algorithm,
+                                                              group_size=group_size)
+        else:
+            with instrument.stage(f'divide_groups.{algorithm}', rows=len(ids)):
+                groups = divide_groups.ALGORITHMS[algorithm](ids, mat, group_size=group_size, seed=seed)
+        if improve > 0:
+            with instrument.stage('divide_groups.improve', rows=len(ids)):
+                groups, _ = divide_groups.improve_grouping(ids, mat, groups, time_budget=improve)
+        return groups
+
+    reproducible = seed is not None and improve <= 0 and algorithm not in divide_groups.TIME_BOUNDED
+    groups_key = None
+    if store is not None and reproducible:
+        groups_key = cache.cache_key('groups', matrix_key, algorithm, group_size, seed, restarts,
+                                     cache.code_version(divide_groups))
+    groups = _cached(store if reproducible else None, groups_key, 'groups', group,
+                     lambda g, d: d.joinpath('groups.json').write_text(json.dumps(g, ensure_ascii=False),
+                                                                      encoding='utf-8'),
+                     lambda e: json.loads(e.joinpath('groups.json').read_text(encoding='utf-8')))
+    if checkpoint_dir is not None:
+        write_groups(groups, checkpoint_dir.joinpath('groups.csv'))
+    return ids, mat, groups
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Survey CSV -> groups in one process (no mandatory intermediate files)')
+    parser.add_argument('survey', nargs='?', default='test.csv', help='raw survey export (default test.csv)')
+    parser.add_argument('--algorithm', choices=sorted(divide_groups.ALGORITHMS), default='force_exact')
+    parser.add_argument('--group-size', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--condensed', action='store_true', help='score each pair once (half the memory)')
+    parser.add_argument('--topk', type=int, default=0, metavar='K', help='keep only the K best partners per person')
+    parser.add_argument('--workers', type=int, default=1, help='processes for scoring / restarts (0 = one per CPU)')
+    parser.add_argument('--weights', metavar='PROFILE', help='JSON weight profile for the scorer')
+    parser.add_argument('--restarts', type=int, default=1)
+    parser.add_argument('--improve', type=float, default=0.0, metavar='SECONDS')
+    parser.add_argument('--vocab', default='vocab.json', help="category vocabulary file; '' to disable")
+    parser.add_argument('--checkpoint', metavar='DIR',
+                        help='also write trait.csv, the matrix (.npy) and groups.csv to DIR')
+    parser.add_argument('--cache', metavar='DIR', help='reuse unchanged stages from this artifact cache')
+    parser.add_argument('--cache-size', type=float, default=1024, metavar='MB',
+                        help='evict least recently used cache entries beyond this size')
+    parser.add_argument('--hierarchical', type=int, default=0, metavar='CLUSTER_SIZE',
+                        help='cluster people first and group each cluster on its own (large cohorts)')
+    args = parser.parse_args()
+
+    base = Path(__file__).resolve().parent
+    survey = Path(args.survey) if Path(args.survey).is_absolute() else base.joinpath(args.survey)
+    weights = calculate_pairs.load_weights(args.weights) if args.weights else None
+    ids, mat, groups = run_pipeline(
+        survey, algorithm=args.algorithm, group_size=args.group_size, seed=args.seed,
+        condensed=args.condensed, topk=args.topk, workers=args.workers, weights=weights,
+        restarts=args.restarts, improve=args.improve,
+        vocab_path=base.joinpath(args.vocab) if args.vocab else None,
+        checkpoint_dir=Path(args.checkpoint) if args.checkpoint else None,
+        cache_dir=Path(args.cache) if args.cache else None, cache_bytes=int(args.cache_size * (1 << 20)),
+        cluster_size=args.hierarchical)
+    if mat is not None and not isinstance(mat, divide_groups.TopKIndex):
+        print(f'Objective: {divide_groups.grouping_objective(ids, mat, groups):.3f}')
+    for gi, g in enumerate(groups, start=1):
+        print(f'Group {gi}:', g)
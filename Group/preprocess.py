@@ -1,11 +1,18 @@
+import argparse
+import json
 import re
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import MultiLabelBinarizer, OneHotEncoder
 from pathlib import Path
+import instrument
+import trait_store
 
 SEPARATORS_RE = r"[;,，|\n]+"
 
+# multi-select bitmasks are stored as uint32 words (exact in both int64 and float64 CSV round-trips)
+MASK_BITS = 32
+
 email_re = re.compile(r"^[A-Za-z0-9._%+-]+@(?:m\.)?fudan\.edu\.cn$")
 
 
@@ -66,7 +73,7 @@ def detect_columns(df: pd.DataFrame):
     return col_map
 
 
-def encode_single_choice(series: pd.Series):
+def encode_single_choice(series: pd.Series, categories=None):
     """
     Encode a single-choice categorical column into compact integer codes.
 
@@ -77,13 +84,15 @@ def encode_single_choice(series: pd.Series):
 
     Returns (codes, categories) where `codes` is a numpy array of ints
     and `categories` is the ordered list of category strings corresponding
-    to codes 1..K.
+    to codes 1..K. Pass `categories` to encode against a fixed vocabulary
+    (e.g. one collected over the whole file before encoding chunks);
+    answers outside it map to 0.
     """
     # normalize strings and treat empty as missing: operate vectorized with pandas Series
     s = series.fillna('').astype(str).str.strip()
     # `pd.Categorical` produces a stable integer code per category (codes -1..K-1)
     # using categorical is faster and more memory-efficient than manual mapping.
-    cats = pd.Categorical(s.replace('', np.nan))
+    cats = pd.Categorical(s.replace('', np.nan), categories=categories)
     codes = cats.codes  # -1 denotes NaN/missing
     # map -1 -> 0 (missing), else +1 so categories map to 1..K (compact representation)
     codes = np.where(codes == -1, 0, codes + 1).astype(int)
@@ -91,9 +100,9 @@ def encode_single_choice(series: pd.Series):
     return codes, categories
 
 
-def encode_multi_choice(series: pd.Series):
+def encode_multi_choice(series: pd.Series, classes=None):
     """Use MultiLabelBinarizer to produce one-hot binary columns for multi-select options.
-    Returns (df_mlb, classes)
+    Returns (df_mlb, classes). Pass `classes` to fix the option columns and their order.
     """
     # Convert each cell into a list of selected choices.
     # `MultiLabelBinarizer` vectorizes multi-select into a binary indicator matrix (one-hot per choice).
@@ -104,6 +113,8 @@ def encode_multi_choice(series: pd.Series):
     # Some sklearn versions use `sparse_output`; keep compatibility by inspecting signature.
     if 'sparse_output' in sig.parameters:
         mlb_params['sparse_output'] = False
+    if classes is not None:
+        mlb_params['classes'] = list(classes)
     mlb = MultiLabelBinarizer(**mlb_params)
     if len(series) == 0:
         return pd.DataFrame(index=series.index), []
@@ -118,6 +129,25 @@ def encode_multi_choice(series: pd.Series):
     return df_mlb, list(mlb.classes_)
 
 
+def encode_multi_bitmask(df_mlb: pd.DataFrame, key: str):
+    """
+    Pack a 0/1 indicator frame (MultiLabelBinarizer output) into integer bitmasks.
+
+    Bit k of the mask words is option k of the indicator columns; every
+    MASK_BITS options go into one `{key}_mask_<w>` column. The pair scorer
+    uses these to get intersection/union sizes with popcounts instead of
+    splitting `{key}_raw` again for every pair.
+    """
+    ind = df_mlb.to_numpy(dtype=np.uint8)
+    n_words = max(1, -(-ind.shape[1] // MASK_BITS))
+    # pad to whole words, then pack bits little-endian into uint32 words
+    padded = np.zeros((ind.shape[0], n_words * MASK_BITS), dtype=np.uint8)
+    padded[:, :ind.shape[1]] = ind
+    words = np.packbits(padded, axis=1, bitorder='little').view('<u4')
+    cols = {f'{key}_mask_{w}': words[:, w].astype(np.int64) for w in range(n_words)}
+    return pd.DataFrame(cols, index=df_mlb.index)
+
+
 def score_philosophy(s12: str, s13: str, s14: str):
     # normalize to lowercase strings for simple keyword heuristics
     s12 = (s12 or '').lower()
@@ -144,15 +174,78 @@ def score_philosophy(s12: str, s13: str, s14: str):
     return sc, t
 
 
-def load_and_clean(path: Path):
+def score_philosophy_columns(s12: pd.Series, s13: pd.Series, s14: pd.Series):
+    """Column-wise `score_philosophy`: returns (scores, types) as int arrays."""
+    s12 = s12.fillna('').astype(str).str.lower()
+    s13 = s13.fillna('').astype(str).str.lower()
+    s14 = s14.fillna('').astype(str).str.lower()
+    sc = np.select([s13.str.contains('反思', regex=False), s13.str.contains('情绪化', regex=False)],
+                   [2, 1], default=0)
+    sc = sc + np.where(s14.str.contains('战略', regex=False), 2, 1)
+    t = np.select([s12.str.contains('作', regex=False), s12.str.contains('主导', regex=False)],
+                  [3, 2], default=1)
+    return sc.astype(np.int64), t.astype(np.int64)
+
+
+# keyword groups for the `q11_quality` heuristic over free-text q10, with their weights
+Q11_EMPTY = ('无', '🈚️', '？无', '选填')
+Q11_KEYWORDS = (
+    (re.compile('|'.join(map(re.escape, ('Python', 'Pytorch', 'C++', 'Java')))), 1.25),
+    (re.compile('|'.join(map(re.escape, ('项目', '论文', '比赛', '实习')))), 2.0),
+    (re.compile('|'.join(map(re.escape, ('LaTeX', 'Stata', 'MATLAB', 'SQL')))), 0.5),
+)
+
+
+def q11_quality_column(q10_raw: pd.Series):
+    """
+    Heuristic 0..3 quality score from free-text q10, one compiled alternation per keyword group.
+
+    The column is integer when every score is 0 or the capped 3, as in
+    earlier trait.csv exports; otherwise float.
+    """
+    raw = q10_raw.astype(str).str.strip()
+    empty = ((raw == '') | raw.isin(Q11_EMPTY)).to_numpy()
+    score = np.zeros(len(raw), dtype=float)
+    for pattern, weight in Q11_KEYWORDS:
+        score += np.where(raw.str.contains(pattern).to_numpy(dtype=bool), weight, 0.0)
+    score = np.where(empty, 0.0, np.minimum(score, 3))
+    # scores strictly between 0 and the cap are the only non-integer values
+    if not ((score > 0) & (score < 3)).any():
+        return pd.Series(score.astype(np.int64), index=q10_raw.index)
+    return pd.Series(score, index=q10_raw.index)
+
+
+def load_and_clean(path: Path, vocab_path: Path = None):
     # Read CSV into pandas DataFrame. Using dtype=str avoids unwanted type coercion.
-    df = pd.read_csv(str(path), dtype=str)
+    with instrument.stage('preprocess.read_csv') as st:
+        df = pd.read_csv(str(path), dtype=str)
+        st.add(rows=len(df))
     # cleanse header whitespace and normalize missing values
     df = df.rename(columns=lambda c: c.strip())
     df = df.fillna('')
 
     col_map = detect_columns(df)
+    vocab = None
+    if vocab_path is not None:
+        # keep codes stable across runs: known categories keep their code, new ones are appended
+        vocab = merge_vocab(load_vocab(vocab_path), observed_vocab(df, col_map))
+        save_vocab(vocab, vocab_path)
+    with instrument.stage('preprocess.encode', rows=len(df)):
+        traits = clean_frame(df, col_map, vocab)
+    with instrument.stage('preprocess.sort', rows=len(traits)):
+        traits = sort_traits(traits)
+    return traits, col_map
+
 
+def clean_frame(df: pd.DataFrame, col_map: dict, vocab: dict = None):
+    """
+    Build the traits rows for one block of survey answers (whole file or one chunk).
+
+    `vocab` maps question keys ('q4', 'q7', ...) to fixed category/option
+    lists; without it each question is encoded from the categories present
+    in `df`.
+    """
+    vocab = vocab or {}
     # ensure survey id/email/student
     if 'survey' in col_map:
         df['survey_id'] = df[col_map['survey']].astype(str).str.strip()
@@ -195,13 +288,15 @@ def load_and_clean(path: Path):
         # q7 and q9 are multi-select (keep as binary indicator columns)
         if key in ('q7', 'q9'):
             # multi-select: one binary indicator column per option (0/1). This keeps sparse categorical info.
-            df_mlb, classes = encode_multi_choice(df[col])
+            df_mlb, classes = encode_multi_choice(df[col], classes=vocab.get(key))
             if not df_mlb.empty:
                 # sanitize and append
                 df_mlb.columns = [c.replace(' ', '_').replace('/', '_') for c in df_mlb.columns]
                 # also add a count of selections as a compact numeric feature
                 df_mlb[f'{key}_count'] = df_mlb.sum(axis=1)
                 feature_frames.append(df_mlb)
+                # packed bitmasks of the same choices so pair scoring never re-parses the raw text
+                feature_frames.append(encode_multi_bitmask(df_mlb.iloc[:, :len(classes)], key))
         elif key in ('q10',):
             continue
             # # q10: question for 'other skills' or free-text answers.
@@ -215,7 +310,7 @@ def load_and_clean(path: Path):
         else:
             # single-choice: encode as compact integer codes (0=missing, 1..K categories)
             # Using integer codes rather than one-hot keeps feature dimensionality small.
-            codes, categories = encode_single_choice(df[col])
+            codes, categories = encode_single_choice(df[col], categories=vocab.get(key))
             # store the integer codes as a single-column DataFrame for concatenation later
             df_codes = pd.DataFrame({f'{key}_code': codes}, index=df.index)
             feature_frames.append(df_codes)
@@ -224,37 +319,25 @@ def load_and_clean(path: Path):
     q12_col = col_map.get('q12')
     q13_col = col_map.get('q13')
     q14_col = col_map.get('q14')
-    ph_scores = []
-    ph_types = []
-    q12_list = []
-    q13_list = []
-    q14_list = []
-    # iterate rows to compute philosophy scores. `iterrows()` is acceptable for small-to-moderate data sizes.
-    for idx, row in df.iterrows():
-        s12 = row[q12_col] if q12_col else ''
-        s13 = row[q13_col] if q13_col else ''
-        s14 = row[q14_col] if q14_col else ''
-        sc, t = score_philosophy(s12, s13, s14)
-        ph_scores.append(sc)
-        ph_types.append(t)
-        # also keep individual raw answers for q12/q13/q14 to simplify downstream lookups
-        q12_list.append(str(s12))
-        q13_list.append(str(s13))
-        q14_list.append(str(s14))
+    # vectorized over whole columns (str.contains + np.select), same rules as `score_philosophy`
+    s12 = df[q12_col].astype(str) if q12_col else pd.Series('', index=df.index)
+    s13 = df[q13_col].astype(str) if q13_col else pd.Series('', index=df.index)
+    s14 = df[q14_col].astype(str) if q14_col else pd.Series('', index=df.index)
+    ph_scores, ph_types = score_philosophy_columns(s12, s13, s14)
     # write philosophy fields and numeric code
     traits['philosophy_score'] = ph_scores
     traits['philosophy_type'] = ph_types
     # expose q12/q13/q14 raw answers as explicit columns for easier access
-    traits['q12_raw'] = q12_list
-    traits['q13_raw'] = q13_list
-    traits['q14_raw'] = q14_list
+    traits['q12_raw'] = s12
+    traits['q13_raw'] = s13
+    traits['q14_raw'] = s14
 
     # process question 15 (single-choice: encode as integer code)
     q15_col = col_map.get('q15')
     if q15_col:
         traits['q15_raw'] = df[q15_col].astype(str)
         # single-choice: use compact integer codes
-        codes, categories = encode_single_choice(df[q15_col])
+        codes, categories = encode_single_choice(df[q15_col], categories=vocab.get('q15'))
         df_codes = pd.DataFrame({f'q15_code': codes}, index=df.index)
         feature_frames.append(df_codes)
     else:
@@ -271,36 +354,166 @@ def load_and_clean(path: Path):
     # add q11 quality score
     # derive a simple heuristic `q11_quality` score from free-text `q10_raw` (per your request)
     if 'q10_raw' in traits.columns:
-        q11_qualities = []
-        for raw in traits['q10_raw']:
-            raw = str(raw).strip()
-            if not raw or raw in ['无', '🈚️', '？无', '选填']:
-                q11_qualities.append(0)
-                continue
-            score = 0
-            if any(k in raw for k in ('Python', 'Pytorch', 'C++', 'Java')):
-                score += 1.25
-            if any(k in raw for k in ('项目', '论文', '比赛', '实习')):
-                score += 2.0
-            if any(k in raw for k in ('LaTeX', 'Stata', 'MATLAB', 'SQL')):
-                score += 0.5
-            q11_qualities.append(min(score, 3))
-        traits['q11_quality'] = q11_qualities
-
-    # sort by numeric survey id if possible
-    def try_int(x):
-        try:
-            return int(x)
-        except Exception:
-            return x
-    traits['__sort_key'] = traits['survey_id'].apply(try_int)
-    traits = traits.sort_values('__sort_key')
-    traits = traits.drop(columns=['__sort_key'])
+        traits['q11_quality'] = q11_quality_column(traits['q10_raw'])
+    return traits
+
+
+def sort_traits(traits: pd.DataFrame):
+    """Order trait rows by survey id."""
+    # sort by numeric survey id if possible (non-numeric ids sort after the numeric ones, as text)
+    num_key = pd.to_numeric(traits['survey_id'], errors='coerce')
+    if num_key.notna().all():
+        traits = traits.assign(__sort_key=num_key).sort_values('__sort_key')
+    elif num_key.isna().all():
+        traits = traits.assign(__sort_key=traits['survey_id'].astype(str)).sort_values('__sort_key')
+    else:
+        traits = traits.assign(__sort_num=num_key.isna(), __sort_key=num_key,
+                               __sort_text=traits['survey_id'].astype(str))
+        traits = traits.sort_values(['__sort_num', '__sort_key', '__sort_text'], kind='mergesort')
+        traits = traits.drop(columns=['__sort_num', '__sort_text'])
+    return traits.drop(columns=['__sort_key'])
 
-    return traits, col_map
 
+# questions encoded against a vocabulary: single-choice codes and multi-select options
+SINGLE_CHOICE_KEYS = ('q4', 'q5', 'q6', 'q8', 'q11', 'q15')
+MULTI_CHOICE_KEYS = ('q7', 'q9')
+
+
+def observed_vocab(df: pd.DataFrame, col_map: dict):
+    """Sorted categories (single-choice) and options (multi-select) present in `df`, per question."""
+    vocab = {}
+    for k in SINGLE_CHOICE_KEYS + MULTI_CHOICE_KEYS:
+        col = col_map.get(k)
+        if not col or col not in df.columns:
+            continue
+        if k in MULTI_CHOICE_KEYS:
+            seen = set()
+            for opts in df[col].map(split_multi):
+                seen.update(opts)
+        else:
+            seen = {v for v in df[col].astype(str).str.strip().unique() if v}
+        vocab[k] = sorted(seen)
+    return vocab
+
+
+def merge_vocab(base: dict, new: dict):
+    """
+    Extend `base` with the categories of `new`: existing categories keep their
+    position (and so their code / one-hot column / mask bit) and unseen ones
+    are appended in sorted order.
+    """
+    merged = {k: list(v) for k, v in (base or {}).items()}
+    for k, cats in new.items():
+        known = merged.setdefault(k, [])
+        present = set(known)
+        known.extend(sorted(c for c in cats if c not in present))
+    return merged
+
+
+def load_vocab(path: Path):
+    """Read a saved vocabulary file; a missing file is an empty vocabulary."""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def save_vocab(vocab: dict, path: Path):
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(vocab, fh, ensure_ascii=False, indent=1)
+
+
+def collect_vocab(path: Path, col_map: dict, header_names: dict, chunksize: int = 50_000, base: dict = None):
+    """
+    First pass of the chunked pipeline: read only the categorical columns and
+    collect every question's categories, appended to `base` (a saved
+    vocabulary) when given. Without `base` the result is sorted, as
+    `pd.Categorical` and `MultiLabelBinarizer` order them when fitting on the
+    whole file.
 
-def export_traits(traits: pd.DataFrame, out_path: Path):
+    `header_names` maps stripped column names back to the names in the file.
+    """
+    vocab = {k: list(v) for k, v in (base or {}).items()}
+    keys = [k for k in SINGLE_CHOICE_KEYS + MULTI_CHOICE_KEYS if col_map.get(k)]
+    usecols = [header_names[col_map[k]] for k in keys]
+    if not usecols:
+        return vocab
+    seen = {}
+    for chunk in pd.read_csv(str(path), dtype=str, usecols=usecols, chunksize=chunksize):
+        chunk = chunk.rename(columns=lambda c: c.strip()).fillna('')
+        for k, cats in observed_vocab(chunk, col_map).items():
+            seen.setdefault(k, set()).update(cats)
+    return merge_vocab(vocab, {k: sorted(v) for k, v in seen.items()})
+
+
+def load_and_clean_chunked(path: Path, out_path: Path, chunksize: int = 50_000, vocab_path: Path = None):
+    """
+    Streaming variant of `load_and_clean` + `export_traits` for very large exports.
+
+    Columns are detected once from the header, a first pass over only the
+    categorical columns fixes every question's vocabulary, and the second
+    pass cleans and encodes `chunksize` rows at a time against it and
+    appends the concise trait rows to `out_path` (q11_quality typed as for
+    the whole file, so every chunk formats it alike). Peak memory depends on
+    `chunksize`, not on the number of respondents. Rows are written in
+    input order (not re-sorted by survey id). With `vocab_path` the saved
+    vocabulary is extended and written back, as in `load_and_clean`.
+
+    Returns (col_map, vocab, rows_written).
+    """
+    header = pd.read_csv(str(path), dtype=str, nrows=0).columns
+    header_names = {c.strip(): c for c in header}
+    col_map = detect_columns(pd.DataFrame(columns=list(header_names)))
+    base = load_vocab(vocab_path) if vocab_path is not None else None
+    with instrument.stage('preprocess.vocab_pass'):
+        vocab = collect_vocab(path, col_map, header_names, chunksize=chunksize, base=base)
+    if vocab_path is not None:
+        save_vocab(vocab, vocab_path)
+    # q11_quality is written as integers only when no row of the whole file has a fractional score
+    fractional = False
+    if col_map.get('q10'):
+        for chunk in pd.read_csv(str(path), dtype=str, usecols=[header_names[col_map['q10']]], chunksize=chunksize):
+            if q11_quality_column(chunk.iloc[:, 0].fillna('')).dtype.kind == 'f':
+                fractional = True
+                break
+
+    rows = 0
+    cols = None
+    for chunk in pd.read_csv(str(path), dtype=str, chunksize=chunksize):
+        with instrument.stage('preprocess.chunk', rows=len(chunk)):
+            chunk = chunk.rename(columns=lambda c: c.strip()).fillna('')
+            traits = clean_frame(chunk, col_map, vocab)
+            if fractional and 'q11_quality' in traits.columns:
+                traits['q11_quality'] = traits['q11_quality'].astype(float)
+            if cols is None:
+                cols = export_columns(traits)
+            traits.loc[:, cols].to_csv(str(out_path), index=False, mode='w' if rows == 0 else 'a',
+                                       header=rows == 0)
+        rows += len(traits)
+    if cols is None:
+        # empty input: still write the header so downstream readers see the schema
+        traits = clean_frame(pd.DataFrame(columns=list(header_names)), col_map, vocab)
+        traits.loc[:, export_columns(traits)].to_csv(str(out_path), index=False)
+    print(f'Exported concise trait file: {out_path} (rows: {rows}, chunks of {chunksize})')
+    return col_map, vocab, rows
+
+
+def export_traits(traits: pd.DataFrame, out_path: Path, store: bool = True):
+    export_df = traits.loc[:, export_columns(traits)]
+    with instrument.stage('preprocess.write_csv', rows=len(export_df)):
+        export_df.to_csv(str(out_path), index=False)
+    print(f'Exported concise trait file: {out_path} (columns: {len(export_df.columns)})')
+    if store:
+        # same columns as typed arrays; make_matrix memory-maps this instead of parsing the CSV
+        store_dir = trait_store.store_path(out_path)
+        with instrument.stage('preprocess.write_store', rows=len(export_df)):
+            trait_store.write_store(export_df.reset_index(drop=True), store_dir)
+        print(f'Exported columnar trait store: {store_dir}')
+
+
+def export_columns(traits: pd.DataFrame):
+    """Columns (in order) written to the concise trait.csv export."""
     # Create a more concise export: keep identifiers, compact numeric features,
     # one-hot indicator columns, some raw text fields useful for human review,
     # and philosophy summary fields. This reduces the CSV width compared to
@@ -342,18 +555,24 @@ def export_traits(traits: pd.DataFrame, out_path: Path):
 
     # fall back: if cols is empty for some reason, export full traits
     if not cols:
-        export_df = traits
-    else:
-        # preserve original row order
-        export_df = traits.loc[:, [c for c in cols if c in traits.columns]]
-
-    export_df.to_csv(str(out_path), index=False)
-    print(f'Exported concise trait file: {out_path} (columns: {len(export_df.columns)})')
+        return list(traits.columns)
+    return [c for c in cols if c in traits.columns]
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Clean test.csv and export trait.csv')
+    parser.add_argument('--chunksize', type=int, default=0,
+                        help='stream the input in chunks of this many rows (bounded memory, input order kept)')
+    parser.add_argument('--vocab', default='vocab.json',
+                        help="category vocabulary file kept across runs (codes stay stable); '' to disable")
+    args = parser.parse_args()
+
     base = Path(__file__).resolve().parent
     csv_path = base.joinpath('test.csv')
     out = base.joinpath('trait.csv')
-    traits, col_map = load_and_clean(csv_path)
-    export_traits(traits, out)
+    vocab_path = base.joinpath(args.vocab) if args.vocab else None
+    if args.chunksize:
+        load_and_clean_chunked(csv_path, out, chunksize=args.chunksize, vocab_path=vocab_path)
+    else:
+        traits, col_map = load_and_clean(csv_path, vocab_path=vocab_path)
+        export_traits(traits, out)
@@ -0,0 +1,28 @@
+import sys
+from pathlib import Path
+import pytest
+
+# the scripts import each other as top-level modules (`import divide_groups`)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import benchmark  # noqa: E402
+import make_matrix  # noqa: E402
+import preprocess  # noqa: E402
+
+SURVEY_ROWS = 160
+
+
+@pytest.fixture(scope='session')
+def trait_csv(tmp_path_factory):
+    """A synthetic survey (`benchmark.generate_survey`) cleaned into trait.csv + trait_store/ by preprocess."""
+    workdir = tmp_path_factory.mktemp('survey')
+    benchmark.generate_survey(SURVEY_ROWS, workdir.joinpath('survey.csv'), seed=7)
+    traits, _ = preprocess.load_and_clean(workdir.joinpath('survey.csv'))
+    preprocess.export_traits(traits, workdir.joinpath('trait.csv'))
+    return workdir.joinpath('trait.csv')
+
+
+@pytest.fixture(scope='session')
+def traits(trait_csv):
+    """The trait rows as make_matrix.py reads them from trait.csv."""
+    return make_matrix.load_traits(trait_csv)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import calculate_pairs
+
+ROWS = 24
+
+
+def _fixture(traits, source):
+    """A few trait rows with missing numeric scores and empty or missing multi-select answers."""
+    df = traits.iloc[:ROWS].reset_index(drop=True).copy()
+    df['philosophy_score'] = df['philosophy_score'].astype(float)
+    df.loc[[2, 9], 'q11_quality'] = np.nan
+    df.loc[[4, 9], 'philosophy_score'] = np.nan
+    for key in ('q7', 'q9'):
+        masks = calculate_pairs._mask_columns(df, key)
+        df.loc[[1, 5], masks] = 0
+        df.loc[[1, 5], f'{key}_raw'] = ''
+        df.loc[7, f'{key}_raw'] = np.nan
+        if source == 'raw':
+            df = df.drop(columns=masks)
+        else:
+            df.loc[7, masks] = 0
+    return df
+
+
+@pytest.mark.parametrize('source', ('mask', 'raw'))
+def test_matrix_matches_pairwise_compute(traits, source):
+    df = _fixture(traits, source)
+    plan = calculate_pairs.compile_plan(df)
+    assert plan.multi['q7'][0] == source
+    expected = np.array([[calculate_pairs.compute(i, j, df, plan) for j in range(ROWS)] for i in range(ROWS)])
+    np.fill_diagonal(expected, 1.0)
+    mat = calculate_pairs.compute_matrix(df, block_cells=5 * ROWS)
+    assert not np.isnan(mat).any()
+    np.testing.assert_array_equal(mat, expected)
+    upper = np.triu_indices(ROWS, 1)
+    np.testing.assert_array_equal(calculate_pairs.compute_condensed(df, block_cells=5 * ROWS), mat[upper])
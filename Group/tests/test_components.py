@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import cache
+import calculate_pairs
+import divide_groups
+import make_matrix
+import pipeline
+
+WEIGHTS = {'q7_jaccard': 1.3, 'q9_union': 0.7, 'q11_per_diff': 0.9}
+
+
+@pytest.fixture(scope='module')
+def comps(traits):
+    return calculate_pairs.compute_components(traits)
+
+
+def test_components_are_stored_narrow(comps):
+    arrays = [v for v in comps.values() if isinstance(v, np.ndarray)]
+    assert sum(v.itemsize for v in arrays) <= 21
+    for key in ('q7', 'q9'):
+        assert comps[f'{key}_inter'].dtype == comps[f'{key}_union'].dtype == np.uint8
+    assert comps['q11_quality'].dtype == comps['philosophy_score'].dtype == np.float32
+
+
+def test_inexact_differences_are_kept_in_float64(traits):
+    shifted = traits.assign(q11_quality=traits['q11_quality'] + 0.1 * (np.arange(len(traits)) % 3))
+    comps = calculate_pairs.compute_components(shifted)
+    assert comps['q11_quality'].dtype == np.float64
+    assert np.array_equal(calculate_pairs.combine_components(comps), calculate_pairs.compute_condensed(shifted))
+
+
+@pytest.mark.parametrize('workers', (1, 2))
+def test_reweighting_matches_direct_scoring(traits, comps, workers):
+    condensed = make_matrix.build_from_components(comps, WEIGHTS, workers=workers, condensed=True, block_rows=50)
+    dense = make_matrix.build_from_components(comps, WEIGHTS, workers=workers, block_rows=50)
+    assert np.array_equal(condensed, calculate_pairs.compute_condensed(traits, weights=WEIGHTS))
+    assert np.array_equal(dense, calculate_pairs.compute_matrix(traits, weights=WEIGHTS))
+
+
+@pytest.mark.parametrize('condensed', (False, True))
+def test_cached_pipeline_builds_the_requested_layout(tmp_path, trait_csv, condensed):
+    survey = trait_csv.with_name('survey.csv')
+    store = cache.ArtifactCache(tmp_path.joinpath('cache'))
+    runs, entries = [], []
+    for _ in range(2):
+        runs.append(pipeline.run_pipeline(survey, seed=0, condensed=condensed, cache_dir=store.root,
+                                          vocab_path=tmp_path.joinpath('vocab.json')))
+        entries.append(sorted(key for key, _, _ in store.entries()))
+    # the second run finds every artifact of the first (traits keyed on the merged vocabulary)
+    assert entries[0] == entries[1]
+    _, uncached, expected = pipeline.run_pipeline(survey, seed=0, condensed=condensed)
+    for _, mat, groups in runs:
+        assert isinstance(mat, divide_groups.CondensedMatrix) == condensed
+        values = mat.values if condensed else mat
+        assert np.array_equal(values, uncached.values if condensed else uncached)
+        assert groups == expected
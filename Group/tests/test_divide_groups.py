@@ -0,0 +1,101 @@
+import random
+import numpy as np
+import divide_groups
+
+# six people, group_size 4: every seed can fit them into one group of 4 and one of 2
+SIX = np.array([
+    [1, 1, 4, 4, 8, 10],
+    [1, 1, 7, 13, 2, 7],
+    [4, 7, 1, 6, 14, 9],
+    [4, 13, 6, 1, 16, 1],
+    [8, 2, 14, 16, 1, 1],
+    [10, 7, 9, 1, 1, 1],
+], dtype=float)
+
+
+def test_greedy_move_leaves_old_group():
+    # a person moved during a conflict used to stay in their old group's set, which then
+    # looked full and kept evicting: seeds 0 and 4 ended with 4 groups (two singletons)
+    ids = [str(k) for k in range(len(SIX))]
+    for seed in range(5):
+        groups = divide_groups.greedy_grouping(ids, SIX, group_size=4, seed=seed)
+        assert sorted(x for g in groups for x in g) == sorted(ids)
+        assert sorted(len(g) for g in groups) == [2, 4]
+
+
+def test_greedy_same_groups_for_dense_and_condensed():
+    rs = np.random.RandomState(0)
+    n = 30
+    mat = rs.randint(0, 6, size=(n, n)) / 2  # half-point scores: many ties
+    mat = np.triu(mat, 1) + np.triu(mat, 1).T
+    np.fill_diagonal(mat, 1.0)
+    condensed = divide_groups.CondensedMatrix(mat[np.triu_indices(n, 1)], n)
+    ids = [str(k) for k in range(n)]
+    for seed in range(5):
+        assert (divide_groups.greedy_grouping(ids, mat, seed=seed)
+                == divide_groups.greedy_grouping(ids, condensed, seed=seed))
+
+
+def _random_matrix(n, seed):
+    rs = np.random.RandomState(seed)
+    mat = rs.randint(0, 40, size=(n, n)) / 4
+    mat = np.triu(mat, 1) + np.triu(mat, 1).T
+    np.fill_diagonal(mat, 1.0)
+    return [str(k) for k in range(n)], mat
+
+
+def test_improve_never_lowers_the_objective_or_changes_sizes():
+    for seed in range(5):
+        ids, mat = _random_matrix(23, seed)
+        start = divide_groups.greedy_grouping(ids, mat, seed=seed)
+        groups, report = divide_groups.improve_grouping(ids, mat, start, time_budget=1e9)
+        assert [len(g) for g in groups] == [len(g) for g in start]
+        assert sorted(x for g in groups for x in g) == sorted(ids)
+        before = divide_groups.grouping_objective(ids, mat, start)
+        after = divide_groups.grouping_objective(ids, mat, groups)
+        assert after >= before
+        assert np.isclose(report['initial'], before) and np.isclose(report['final'], after)
+
+
+def test_improve_leaves_people_outside_a_partial_grouping_alone():
+    ids, mat = _random_matrix(14, 3)
+    start = [ids[0:4], ids[4:8], ids[8:11]]  # 11..13 are in no group
+    groups, _ = divide_groups.improve_grouping(ids, mat, start, time_budget=1e9)
+    assert [len(g) for g in groups] == [4, 4, 3]
+    assert sorted(x for g in groups for x in g) == sorted(ids[:11])
+    assert (divide_groups.grouping_objective(ids, mat, groups)
+            >= divide_groups.grouping_objective(ids, mat, start))
+
+
+def test_same_seed_gives_the_same_groups():
+    ids, mat = _random_matrix(40, 1)
+    state = random.getstate()
+    runs = [divide_groups.greedy_grouping(ids, mat, seed=5) for _ in range(3)]
+    runs.append(divide_groups.greedy_grouping(ids, mat, seed=random.Random(5)))
+    assert all(r == runs[0] for r in runs)
+    # grouping draws from its own generator, never the global one
+    assert random.getstate() == state
+    assert any(divide_groups.greedy_grouping(ids, mat, seed=s) != runs[0] for s in range(6, 12))
+    constrained = [divide_groups.solve_constrained(ids, mat, time_limit=1e9, max_rounds=30, seed=5)[0]
+                   for _ in range(2)]
+    assert constrained[0] == constrained[1]
+
+
+def test_best_of_restarts_does_not_depend_on_workers():
+    ids, mat = _random_matrix(40, 2)
+    serial = divide_groups.best_of_restarts(ids, mat, restarts=6, seed=3, workers=1)
+    parallel = divide_groups.best_of_restarts(ids, mat, restarts=6, seed=3, workers=2)
+    assert serial == parallel
+    assert serial[1] == max(serial[2])
+
+
+def test_max_abs_scans_dense_and_memmapped_rows_in_blocks(tmp_path):
+    _, mat = _random_matrix(23, 3)
+    mat[17, 4] = mat[4, 17] = -12.5  # the largest |score| is negative
+    np.save(tmp_path.joinpath('m.npy'), mat)
+    mapped = np.load(tmp_path.joinpath('m.npy'), mmap_mode='r')
+    for m in (mat, mapped):
+        for block_rows in (1, 5, 256):
+            assert divide_groups._max_abs(m, block_rows=block_rows) == 12.5
+    condensed = divide_groups.CondensedMatrix(mat[np.triu_indices(23, 1)], 23)
+    assert divide_groups._max_abs(condensed) == 12.5
@@ -0,0 +1,26 @@
+import pytest
+import divide_groups
+import evaluate
+import make_matrix
+
+
+@pytest.fixture(scope='module')
+def topk(traits):
+    ids, neighbors, scores, sums = make_matrix.build_topk(traits, k=8)
+    return ids, divide_groups.TopKIndex(neighbors, scores, sums)
+
+
+def test_full_row_algorithms_are_skipped_on_a_topk_index(topk):
+    rows = {r['name']: r for r in evaluate.compare_algorithms(*topk)}
+    assert set(rows) == set(divide_groups.ALGORITHMS)
+    for name, row in rows.items():
+        assert ('error' in row) == (name in divide_groups.FULL_ROWS)
+
+
+def test_algorithm_errors_propagate(topk, monkeypatch):
+    def broken(ids, mat, group_size=4, seed=None):
+        raise TypeError('bug inside the algorithm')
+
+    monkeypatch.setitem(divide_groups.ALGORITHMS, 'broken', broken)
+    with pytest.raises(TypeError, match='bug inside'):
+        evaluate.compare_algorithms(*topk, algorithms=['broken'])
@@ -0,0 +1,45 @@
+import collections
+import numpy as np
+import pytest
+import calculate_pairs
+import divide_groups
+import hierarchical
+import make_matrix
+
+
+def _check_cover(traits, groups, group_size):
+    """Every id in exactly one group; all groups full except one remainder group when n does not divide."""
+    ids = make_matrix.matrix_ids(traits)
+    counts = collections.Counter(x for g in groups for x in g)
+    assert sorted(counts) == sorted(ids) and set(counts.values()) == {1}
+    short = [len(g) for g in groups if len(g) != group_size]
+    assert short == ([len(ids) % group_size] if len(ids) % group_size else [])
+
+
+@pytest.mark.parametrize('rows', (160, 158))
+@pytest.mark.parametrize('cluster_size', (30, 45))
+def test_hierarchical_grouping_covers_everyone_once(traits, rows, cluster_size):
+    df = traits.iloc[:rows]
+    groups, report = hierarchical.hierarchical_grouping(df, group_size=4, cluster_size=cluster_size, seed=0)
+    # uneven clusters leave remainders, which the repair step regroups across clusters
+    assert report['clusters'] > 1 and report['repaired'] > 0
+    _check_cover(df, groups, 4)
+
+
+def test_constrained_clusters_are_repaired_into_full_groups(traits):
+    groups, report = hierarchical.hierarchical_grouping(traits, group_size=4, algorithm='constrained',
+                                                        cluster_size=30, seed=0)
+    assert report['repaired'] > 0
+    _check_cover(traits, groups, 4)
+
+
+def test_compare_with_flat_reports_objectives_on_the_same_scale(traits):
+    groups, report = hierarchical.compare_with_flat(traits, group_size=4, cluster_size=45, seed=0)
+    ids = make_matrix.matrix_ids(traits)
+    mat = calculate_pairs.compute_matrix(traits)
+    flat = divide_groups.force_grouping_exact(ids, mat, group_size=4, seed=0)
+    # both objectives are grouping_objective on the full matrix, so their ratio compares the two groupings
+    assert report['objective'] == pytest.approx(divide_groups.grouping_objective(ids, mat, groups), rel=1e-12)
+    assert report['flat_objective'] == pytest.approx(divide_groups.grouping_objective(ids, mat, flat), rel=1e-12)
+    assert report['ratio'] == pytest.approx(report['objective'] / report['flat_objective'])
+    assert np.isfinite(report['flat_seconds'])
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+import calculate_pairs
+import make_matrix
+
+
+def test_incremental_update_rescores_only_new_and_changed_rows(traits, tmp_path):
+    out = tmp_path.joinpath('matrix.npy')
+    old = traits.iloc[:120].copy()
+    ids, _, rescored = make_matrix.update_matrix(old, out)
+    assert rescored == 120
+
+    # 40 appended rows, row 10 edited, row 5 dropped
+    new = traits.copy()
+    new.loc[10, 'q11_quality'] = 2.5 if new.loc[10, 'q11_quality'] != 2.5 else 0.5
+    new = new.drop(index=5).reset_index(drop=True)
+    ids, values, rescored = make_matrix.update_matrix(new, out)
+    assert rescored == 41
+    assert ids == make_matrix.matrix_ids(new)
+    np.testing.assert_array_equal(np.asarray(values), calculate_pairs.compute_matrix(new))
+
+    _, again, rescored = make_matrix.update_matrix(new, out)
+    assert rescored == 0
+    np.testing.assert_array_equal(np.asarray(again), np.asarray(values))
+
+
+@pytest.mark.parametrize('out', (False, True), ids=('shared_memory', 'memmap'))
+def test_parallel_build_matches_compute_matrix(traits, tmp_path, out):
+    dense = calculate_pairs.compute_matrix(traits)
+    for condensed in (False, True):
+        path = tmp_path.joinpath(f'matrix_{condensed}.npy') if out else None
+        ids, values = make_matrix.build_matrix_parallel(traits, workers=2, condensed=condensed, out_path=path,
+                                                        block_rows=32)
+        assert ids == make_matrix.matrix_ids(traits)
+        expected = dense[np.triu_indices(len(ids), 1)] if condensed else dense
+        np.testing.assert_array_equal(np.asarray(values), expected)
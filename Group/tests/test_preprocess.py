@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+import benchmark
+import preprocess
+
+Q10 = '10.其他补充（选填）'
+# q10 answers scoring only 0 or the capped 3, so the old loop wrote q11_quality as integers
+INTEGER_Q10 = ['', '无', 'Python 项目经验', '论文 实习 Java MATLAB', 'Pytorch 比赛']
+
+
+def _survey(path, rows, seed, q10=None):
+    """A synthetic survey with shuffled rows (so sorting by id matters), optionally with fixed q10 answers."""
+    benchmark.generate_survey(rows, path, seed=seed)
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    df = df.sample(frac=1, random_state=seed)
+    if q10 is not None:
+        df[Q10] = [q10[k % len(q10)] for k in range(len(df))]
+    df.to_csv(path, index=False)
+    return path
+
+
+def _scalar_traits(path):
+    """load_and_clean as it was before vectorization: scalar philosophy, per-row q11 loop, try_int sort."""
+    df = pd.read_csv(str(path), dtype=str).rename(columns=lambda c: c.strip()).fillna('')
+    col_map = preprocess.detect_columns(df)
+    traits = preprocess.clean_frame(df, col_map)
+    ph_scores, ph_types = [], []
+    for _, row in df.iterrows():
+        sc, t = preprocess.score_philosophy(*(row[col_map[k]] if col_map.get(k) else '' for k in ('q12', 'q13', 'q14')))
+        ph_scores.append(sc)
+        ph_types.append(t)
+    traits['philosophy_score'] = ph_scores
+    traits['philosophy_type'] = ph_types
+    q11_qualities = []
+    for raw in traits['q10_raw']:
+        raw = str(raw).strip()
+        if not raw or raw in ['无', '🈚️', '？无', '选填']:
+            q11_qualities.append(0)
+            continue
+        score = 0
+        if any(k in raw for k in ('Python', 'Pytorch', 'C++', 'Java')):
+            score += 1.25
+        if any(k in raw for k in ('项目', '论文', '比赛', '实习')):
+            score += 2.0
+        if any(k in raw for k in ('LaTeX', 'Stata', 'MATLAB', 'SQL')):
+            score += 0.5
+        q11_qualities.append(min(score, 3))
+    traits['q11_quality'] = q11_qualities
+
+    def try_int(x):
+        try:
+            return int(x)
+        except Exception:
+            return x
+    traits['__sort_key'] = traits['survey_id'].apply(try_int)
+    return traits.sort_values('__sort_key').drop(columns=['__sort_key'])
+
+
+@pytest.mark.parametrize('q10', (None, INTEGER_Q10), ids=('synthetic', 'integer_q11'))
+def test_trait_csv_is_byte_identical_to_the_scalar_implementation(tmp_path, q10):
+    survey = _survey(tmp_path.joinpath('survey.csv'), 300, seed=11, q10=q10)
+    traits, _ = preprocess.load_and_clean(survey)
+    preprocess.export_traits(traits, tmp_path.joinpath('trait.csv'), store=False)
+    preprocess.export_traits(_scalar_traits(survey), tmp_path.joinpath('reference.csv'), store=False)
+    if q10 is not None:
+        assert np.issubdtype(traits['q11_quality'].dtype, np.integer)
+    assert tmp_path.joinpath('trait.csv').read_bytes() == tmp_path.joinpath('reference.csv').read_bytes()
+
+
+@pytest.mark.parametrize('chunksize', (37, 5))
+def test_chunked_ingestion_writes_the_same_trait_csv(trait_csv, tmp_path, chunksize):
+    # rows are kept in input order by the chunked path; the synthetic survey is already in id order.
+    # 37 does not divide the row count; chunks of 5 include some whose q11 scores are all 0 or 3
+    survey = trait_csv.with_name('survey.csv')
+    _, _, rows = preprocess.load_and_clean_chunked(survey, tmp_path.joinpath('trait.csv'), chunksize=chunksize)
+    assert rows == len(pd.read_csv(survey)) and rows % 37
+    traits, _ = preprocess.load_and_clean(survey)
+    preprocess.export_traits(traits, tmp_path.joinpath('reference.csv'), store=False)
+    assert tmp_path.joinpath('trait.csv').read_bytes() == tmp_path.joinpath('reference.csv').read_bytes()
+
+
+def _coded_columns(traits):
+    return [c for c in traits.columns if c.endswith('_code') or '_mask_' in c]
+
+
+def test_saved_vocabulary_keeps_codes_and_bits_stable(tmp_path):
+    first = _survey(tmp_path.joinpath('first.csv'), 60, seed=4)
+    df = pd.read_csv(first, dtype=str, keep_default_na=False)
+    # a later export: the same people plus answers that sort before every known category
+    extra = df.iloc[:3].copy()
+    extra['序号'] = ['1001', '1002', '1003']
+    extra['6.你的首要目标是？'] = '0新目标'
+    extra['7.你最感兴趣的赛道是？'] = 'AR;AI'
+    extra['9.你熟悉的技能有？'] = 'Go;Python'
+    second = tmp_path.joinpath('second.csv')
+    pd.concat([df, extra]).to_csv(second, index=False)
+
+    vocab_path = tmp_path.joinpath('vocab.json')
+    before, _ = preprocess.load_and_clean(first, vocab_path=vocab_path)
+    old_vocab = preprocess.load_vocab(vocab_path)
+    after, _ = preprocess.load_and_clean(second, vocab_path=vocab_path)
+    new_vocab = preprocess.load_vocab(vocab_path)
+    for key, values in old_vocab.items():
+        assert new_vocab[key][:len(values)] == values
+    assert len(new_vocab['q6']) > len(old_vocab['q6'])
+
+    cols = _coded_columns(before)
+    kept = after[after['survey_id'].isin(before['survey_id'])].set_index('survey_id')
+    pd.testing.assert_frame_equal(kept[cols], before.set_index('survey_id')[cols], check_dtype=False)
+    # without the saved vocabulary the new categories would shift the existing codes
+    fresh, _ = preprocess.load_and_clean(second)
+    fresh = fresh[fresh['survey_id'].isin(before['survey_id'])].set_index('survey_id')
+    assert not fresh[cols].equals(kept[cols])
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+import divide_groups
+import make_matrix
+
+LAYOUTS = ('matrix', 'matrix_condensed')
+# What float32 / int16 storage guarantees is the per-score error (float32: relative
+# 2**-24, int16: scale / 2). Hence any fixed grouping's objective is within pairs * that
+# error, and a swap's gain within 4 * (group_size - 1) * that error, so local search
+# converged on stored scores leaves no swap gaining more than that on the float64 ones.
+# The groups themselves are not guaranteed to match float64: float64 scores that are
+# equal in exact arithmetic differ in their last bits, and float32 / int16 turn those
+# into exact ties that the heuristics break differently.
+
+
+def _groupings(ids, mat):
+    force = divide_groups.force_grouping_exact(ids, mat)
+    return {
+        'force_exact': force,
+        'greedy': divide_groups.greedy_grouping(ids, mat, seed=0),
+        'improve': divide_groups.improve_grouping(ids, mat, force, time_budget=1e9, max_rounds=20)[0],
+        'constrained': divide_groups.solve_constrained(ids, mat, time_limit=1e9, max_rounds=20, seed=0)[0],
+    }
+
+
+@pytest.fixture(scope='module')
+def stored(traits, tmp_path_factory):
+    """{(dtype, layout): (ids, loaded matrix)} written by the block builder."""
+    out = tmp_path_factory.mktemp('matrices')
+    result = {}
+    for dtype in make_matrix.STORAGE_DTYPES:
+        for layout in LAYOUTS:
+            path = out.joinpath(f'{dtype}_{layout}.npy')
+            make_matrix.build_matrix_parallel(traits, workers=1, condensed=layout == 'matrix_condensed',
+                                              out_path=path, dtype=dtype)
+            result[dtype, layout] = divide_groups.load_matrix(path)
+    return result
+
+
+@pytest.fixture(scope='module')
+def grouped(stored):
+    return {key: _groupings(ids, mat) for key, (ids, mat) in stored.items()}
+
+
+def test_file_sizes_shrink(stored):
+    sizes = {key: divide_groups.storage_dtype(mat).itemsize for key, (_, mat) in stored.items()}
+    for layout in LAYOUTS:
+        assert sizes['float64', layout] == 2 * sizes['float32', layout] == 4 * sizes['int16', layout]
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_scores_within_storage_precision(stored, layout):
+    ids, exact = stored['float64', layout]
+    exact = np.asarray(exact)
+    single = np.asarray(stored['float32', layout][1])
+    assert np.all(np.abs(single - exact) <= np.abs(exact) * 2.0 ** -24)
+    _, quantized = stored['int16', layout]
+    scale = quantized.scale
+    assert np.all(np.abs(np.asarray(quantized) - exact) <= scale / 2 + 1e-9)
+
+
+@pytest.mark.parametrize('dtype', make_matrix.STORAGE_DTYPES)
+def test_dense_and_condensed_give_the_same_groups(grouped, dtype):
+    assert grouped[dtype, 'matrix'] == grouped[dtype, 'matrix_condensed']
+
+
+def _storage_error(stored, dtype, layout):
+    """Largest difference between a stored score and its float64 value."""
+    largest = float(np.abs(np.asarray(stored['float64', layout][1])).max())
+    _, mat = stored[dtype, layout]
+    return largest * 2.0 ** -24 if dtype == 'float32' else mat.scale / 2
+
+
+def _best_swap_gain(ids, mat, groups):
+    """Largest objective gain any single swap of two people in different groups would make."""
+    pos = {x: k for k, x in enumerate(ids)}
+    members = [np.array([pos[x] for x in g], dtype=np.int64) for g in groups]
+    label = np.full(len(ids), -1, dtype=np.int64)
+    own = np.zeros(len(ids))
+    for g, m in enumerate(members):
+        label[m] = g
+        block = np.asarray(mat)[np.ix_(m, m)]
+        own[m] = block.sum(axis=1) - np.diagonal(block)
+    best = -np.inf
+    for ga, A in enumerate(members):
+        delta = divide_groups._swap_deltas(np.asarray(mat)[A], A, own, label, len(members))
+        delta[:, label == ga] = -np.inf
+        best = max(best, float(delta.max()))
+    return best
+
+
+@pytest.mark.parametrize('dtype', ('float32', 'int16'))
+def test_local_search_optimum_within_storage_error(stored, grouped, dtype):
+    ids, exact = stored['float64', 'matrix']
+    _, mat = stored[dtype, 'matrix']
+    groups, report = divide_groups.improve_grouping(ids, mat, grouped[dtype, 'matrix']['force_exact'],
+                                                    time_budget=1e9, max_rounds=1000)
+    assert report['converged']
+    size = max(len(g) for g in groups)
+    bound = 4 * (size - 1) * _storage_error(stored, dtype, 'matrix')
+    # 1e-9: improve_grouping's own swap threshold
+    assert _best_swap_gain(ids, exact, groups) <= bound + 1e-9 + 1e-9 * abs(report['final'])
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_objective_of_a_grouping_within_storage_precision(stored, grouped, layout):
+    ids, exact = stored['float64', layout]
+    groups = grouped['float64', layout]['force_exact']
+    pairs = sum(len(g) * (len(g) - 1) // 2 for g in groups)
+    reference = divide_groups.grouping_objective(ids, exact, groups)
+    for dtype in ('float32', 'int16'):
+        _, mat = stored[dtype, layout]
+        error = _storage_error(stored, dtype, layout)
+        assert abs(divide_groups.grouping_objective(ids, mat, groups) - reference) <= pairs * error + 1e-6
+
+
+@pytest.mark.parametrize('dtype', ('float64', 'float32'))
+def test_full_topk_index_groups_like_dense(traits, stored, dtype):
+    ids, neighbors, scores, row_sums = make_matrix.build_topk(traits, k=len(traits) - 1, dtype=dtype)
+    index = divide_groups.TopKIndex(neighbors, scores, row_sums)
+    _, dense = stored[dtype, 'matrix']
+    assert divide_groups.force_grouping_exact(ids, index) == divide_groups.force_grouping_exact(ids, dense)
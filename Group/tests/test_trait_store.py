@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+import trait_store
+
+
+@pytest.fixture(scope='module')
+def csv(trait_csv):
+    """trait.csv exactly as written (every field as its text)."""
+    return pd.read_csv(trait_csv, dtype=str, keep_default_na=False)
+
+
+@pytest.fixture(scope='module')
+def round_trip(trait_csv, tmp_path_factory):
+    """The store preprocess wrote next to trait.csv, read, written again and read back."""
+    first = trait_store.read_store(trait_store.store_path(trait_csv))
+    out = tmp_path_factory.mktemp('store').joinpath('trait_store')
+    trait_store.write_store(first, out)
+    return first, trait_store.read_store(out)
+
+
+def _mask_columns(df):
+    return [c for c in df.columns if c.startswith(('q7_mask_', 'q9_mask_'))]
+
+
+def test_store_has_the_csv_columns(csv, round_trip):
+    for df in round_trip:
+        assert list(df.columns) == list(csv.columns)
+        assert len(df) == len(csv)
+    assert _mask_columns(csv)
+
+
+def test_values_and_dtypes_match_the_csv(csv, round_trip):
+    for df in round_trip:
+        for name in csv.columns:
+            stored = df[name]
+            if pd.api.types.is_integer_dtype(stored):
+                expected = csv[name].astype(np.int64).to_numpy()
+                np.testing.assert_array_equal(stored.to_numpy(), expected, err_msg=name)
+                # smallest signed integer dtype holding the column
+                assert stored.dtype == trait_store._int_dtype(expected), name
+                assert stored.dtype.kind == 'i', name
+            elif pd.api.types.is_float_dtype(stored):
+                expected = csv[name].astype(np.float64).to_numpy()
+                np.testing.assert_array_equal(stored.to_numpy(dtype=np.float64), expected, err_msg=name)
+                assert stored.dtype == np.float32, name
+            else:
+                assert stored.tolist() == csv[name].tolist(), name
+
+
+def test_bitmask_columns_round_trip(csv, round_trip):
+    first, second = round_trip
+    for name in _mask_columns(csv):
+        assert first[name].dtype.kind == 'i' and second[name].dtype == first[name].dtype
+        np.testing.assert_array_equal(first[name].to_numpy(), csv[name].astype(np.int64).to_numpy())
+    for key in ('q7', 'q9'):
+        words = first[[c for c in _mask_columns(csv) if c.startswith(key)]].to_numpy().astype('<u4')
+        bits = np.unpackbits(words.view(np.uint8), axis=1).sum(axis=1)
+        np.testing.assert_array_equal(bits, csv[f'{key}_count'].astype(int).to_numpy())
@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+from pathlib import Path
+import pandas as pd
+import numpy as np
+
+# Columnar trait store: a directory with one `.npy` file per column plus `schema.json`.
+# Numeric columns keep the smallest signed integer dtype that holds them (int8/int16
+# codes and counts) or float32 when that is lossless; text columns (ids, *_raw answers,
+# philosophy_type) are dictionary-encoded: integer codes on disk, the distinct values in
+# the schema. `read_store` memory-maps every column, so loading costs no parsing.
+
+SCHEMA_FILE = 'schema.json'
+STORE_VERSION = 1
+
+
+def store_path(csv_path: Path):
+    """Store directory written next to a trait CSV (`trait.csv` -> `trait_store/`)."""
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.stem + '_store')
+
+
+def is_store(path: Path):
+    return Path(path).is_dir() and Path(path).joinpath(SCHEMA_FILE).exists()
+
+
+def _int_dtype(values: np.ndarray):
+    """Smallest signed integer dtype holding every value (signed, so score differences cannot wrap)."""
+    if not len(values):
+        return np.dtype(np.int8)
+    lo, hi = int(values.min()), int(values.max())
+    for dt in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dt)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dt)
+    return np.dtype(np.int64)
+
+
+def _encode_column(s: pd.Series):
+    """Return (kind, array, dictionary or None) for one trait column."""
+    if pd.api.types.is_bool_dtype(s):
+        return 'int', s.to_numpy(dtype=np.int8), None
+    if pd.api.types.is_integer_dtype(s):
+        v = s.to_numpy()
+        return 'int', v.astype(_int_dtype(v)), None
+    if pd.api.types.is_float_dtype(s):
+        v = s.to_numpy(dtype=np.float64)
+        f32 = v.astype(np.float32)
+        # scores are small multiples of 0.5 in practice; keep float64 if float32 would round
+        same = np.array_equal(f32.astype(np.float64), v, equal_nan=True)
+        return 'float', f32 if same else v, None
+    codes, uniques = pd.factorize(s.map(str))
+    return 'text', codes.astype(_int_dtype(codes)), [str(u) for u in uniques]
+
+
+def write_store(traits: pd.DataFrame, out_dir: Path):
+    """Write `traits` as a columnar store at `out_dir` (replacing any previous store)."""
+    out_dir = Path(out_dir)
+    tmp_dir = out_dir.with_name(out_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    columns = []
+    for k, name in enumerate(traits.columns):
+        kind, values, dictionary = _encode_column(traits[name])
+        fname = f'{k:04d}.npy'
+        np.save(str(tmp_dir.joinpath(fname)), np.ascontiguousarray(values))
+        col = {'name': str(name), 'kind': kind, 'dtype': values.dtype.str, 'file': fname}
+        if dictionary is not None:
+            col['values'] = dictionary
+        columns.append(col)
+    schema = {'version': STORE_VERSION, 'rows': len(traits), 'columns': columns}
+    with open(tmp_dir.joinpath(SCHEMA_FILE), 'w', encoding='utf-8') as f:
+        json.dump(schema, f, ensure_ascii=False)
+    # swap in the finished store so readers never see a half-written one
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+
+
+def read_schema(path: Path):
+    with open(Path(path).joinpath(SCHEMA_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_store(path: Path, columns=None):
+    """
+    Load a columnar store as a DataFrame. Numeric columns are memory-mapped
+    with their stored dtype; text columns are decoded from their codes and
+    the stored dictionary. `columns` limits what is opened.
+    """
+    path = Path(path)
+    schema = read_schema(path)
+    wanted = None if columns is None else set(columns)
+    data = {}
+    for col in schema['columns']:
+        if wanted is not None and col['name'] not in wanted:
+            continue
+        values = np.load(str(path.joinpath(col['file'])), mmap_mode='r')
+        if col['kind'] == 'text':
+            # decode through the dictionary with one take; plain strings keep row access cheap
+            data[col['name']] = np.asarray(col['values'], dtype=object)[values]
+        else:
+            data[col['name']] = values
+    return pd.DataFrame(data, copy=False)